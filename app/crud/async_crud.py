@@ -0,0 +1,144 @@
+from sqlalchemy import select, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models import models, schemas
+
+# crud.py の非同期版（AsyncSession を使うイベントループ上のホットパス用）
+
+# ユーザー関連のCRUD操作
+async def get_user(db: AsyncSession, user_id: str):
+    result = await db.execute(select(models.User).filter(models.User.user_id == user_id))
+    return result.scalars().first()
+
+async def create_user(db: AsyncSession, user: schemas.UserCreate):
+    db_user = models.User(user_id=user.user_id)
+    db.add(db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    return db_user
+
+async def get_or_create_user(db: AsyncSession, user_id: str):
+    user = await get_user(db, user_id)
+    if not user:
+        user = await create_user(db, schemas.UserCreate(user_id=user_id))
+    return user
+
+# エージェント関連のCRUD操作
+async def get_agent(db: AsyncSession, agent_id: str):
+    result = await db.execute(select(models.Agent).filter(models.Agent.agent_id == agent_id))
+    return result.scalars().first()
+
+async def update_agent_voice(db: AsyncSession, agent_id: str, **fields):
+    """エージェントの音声設定（voice_type, has_custom_voice など）を更新する"""
+    db_agent = await get_agent(db, agent_id)
+    if db_agent:
+        for key, value in fields.items():
+            setattr(db_agent, key, value)
+        await db.commit()
+    return db_agent
+
+# 会話履歴関連のCRUD操作
+async def create_conversation(db: AsyncSession, user_id: str, agent_id: str, user_message: str, agent_response: str):
+    db_conversation = models.Conversation(
+        user_id=user_id,
+        agent_id=agent_id,
+        user_message=user_message,
+        agent_response=agent_response
+    )
+    db.add(db_conversation)
+    await db.commit()
+    await db.refresh(db_conversation)
+    return db_conversation
+
+async def create_conversations(db: AsyncSession, rows):
+    """
+    会話履歴をまとめて保存する（1トランザクション内で executemany）
+    rows は user_id, agent_id, user_message, agent_response, created_at を持つ辞書のリスト
+    """
+    if not rows:
+        return
+    await db.execute(insert(models.Conversation), rows)
+    await db.commit()
+
+async def get_conversations(db: AsyncSession, user_id: str, agent_id: str, limit: int = 5):
+    result = await db.execute(
+        select(models.Conversation)
+        .filter(models.Conversation.user_id == user_id, models.Conversation.agent_id == agent_id)
+        .order_by(models.Conversation.created_at.desc())
+        .limit(limit)
+    )
+    return result.scalars().all()
+
+async def get_conversation(db: AsyncSession, conversation_id: int):
+    result = await db.execute(select(models.Conversation).filter(models.Conversation.id == conversation_id))
+    return result.scalars().first()
+
+async def get_conversations_after(db: AsyncSession, user_id: str, agent_id: str, after_id: int, limit: int = 20):
+    """指定したIDより新しい会話のうち、最新の limit 件を古い順に取得する"""
+    result = await db.execute(
+        select(models.Conversation)
+        .filter(
+            models.Conversation.user_id == user_id,
+            models.Conversation.agent_id == agent_id,
+            models.Conversation.id > after_id
+        )
+        .order_by(models.Conversation.id.desc())
+        .limit(limit)
+    )
+    return list(reversed(result.scalars().all()))
+
+# 会話要約関連のCRUD操作
+async def get_conversation_summary(db: AsyncSession, user_id: str, agent_id: str):
+    result = await db.execute(
+        select(models.ConversationSummary)
+        .filter(models.ConversationSummary.user_id == user_id, models.ConversationSummary.agent_id == agent_id)
+    )
+    return result.scalars().first()
+
+async def save_conversation_summary(db: AsyncSession, user_id: str, agent_id: str, summary: str, covered_until_id: int):
+    db_summary = await get_conversation_summary(db, user_id, agent_id)
+    if db_summary is None:
+        db_summary = models.ConversationSummary(user_id=user_id, agent_id=agent_id)
+        db.add(db_summary)
+    db_summary.summary = summary
+    db_summary.covered_until_id = covered_until_id
+    await db.commit()
+    await db.refresh(db_summary)
+    return db_summary
+
+# 非同期チャットジョブ関連のCRUD操作
+async def create_chat_job(db: AsyncSession, job_id: str, user_id: str, agent_id: str, user_message: str,
+                          status: str = "queued", response_text: str = None):
+    db_job = models.ChatJob(
+        job_id=job_id,
+        user_id=user_id,
+        agent_id=agent_id,
+        user_message=user_message,
+        status=status,
+        response_text=response_text
+    )
+    db.add(db_job)
+    await db.commit()
+    await db.refresh(db_job)
+    return db_job
+
+async def get_chat_job(db: AsyncSession, job_id: str):
+    result = await db.execute(select(models.ChatJob).filter(models.ChatJob.job_id == job_id))
+    return result.scalars().first()
+
+async def update_chat_job(db: AsyncSession, job_id: str, **fields):
+    """ジョブの状態（status, response_text, audio_path など）を更新する"""
+    db_job = await get_chat_job(db, job_id)
+    if db_job:
+        for key, value in fields.items():
+            setattr(db_job, key, value)
+        await db.commit()
+    return db_job
+
+async def get_unfinished_chat_jobs(db: AsyncSession):
+    """完了・失敗していないジョブを古い順に取得する（再起動時の再開用）"""
+    result = await db.execute(
+        select(models.ChatJob)
+        .filter(models.ChatJob.status.in_(["queued", "running", "text_ready"]))
+        .order_by(models.ChatJob.created_at)
+    )
+    return result.scalars().all()
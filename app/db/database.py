@@ -1,6 +1,8 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
 import os
 from dotenv import load_dotenv
 
@@ -10,12 +12,111 @@ load_dotenv()
 # データベースURL
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+def to_async_url(url):
+    """同期ドライバのURLを非同期ドライバ（aiosqlite）のURLに変換する"""
+    if url.startswith("sqlite:"):
+        return "sqlite+aiosqlite:" + url[len("sqlite:"):]
+    return url
+
+# 非同期セッション用のURL（未指定の場合は DATABASE_URL から作成）
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or to_async_url(DATABASE_URL)
+
+# SQLiteのエンジンプロファイル
+#   production: WALジャーナル・synchronous=NORMAL などのプラグマとコネクションプールを設定する
+#   default:    SQLite / SQLAlchemy の既定値のまま使う
+SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "production").lower()
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+# 負の値はKiB単位（-65536 = 64MiB）
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+# コネクションプールの設定（production プロファイルのみ）
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+
+def is_sqlite(url):
+    return url.startswith("sqlite")
+
+def is_memory_sqlite(url):
+    path = url.split("://", 1)[-1].lstrip("/").split("?", 1)[0]
+    return is_sqlite(url) and (path in ("", ":memory:") or "mode=memory" in url)
+
+def sqlite_pragmas(profile=SQLITE_PROFILE):
+    """接続ごとに実行するプラグマ（journal_mode はデータベースファイルに保存される）"""
+    if profile != "production":
+        return {}
+    return {
+        "journal_mode": SQLITE_JOURNAL_MODE,
+        "synchronous": SQLITE_SYNCHRONOUS,
+        "mmap_size": SQLITE_MMAP_SIZE,
+        "cache_size": SQLITE_CACHE_SIZE,
+        "busy_timeout": SQLITE_BUSY_TIMEOUT_MS,
+        "temp_store": "MEMORY",
+    }
+
+def apply_sqlite_pragmas(engine, pragmas):
+    """接続イベントでプラグマを設定する（非同期エンジンは内部の同期エンジンに登録）"""
+    if not pragmas:
+        return
+
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+    event.listen(getattr(engine, "sync_engine", engine), "connect", set_pragmas)
+
+def engine_options(url, profile=SQLITE_PROFILE, is_async=False):
+    """create_engine / create_async_engine に渡すオプション"""
+    options = {}
+    if not is_sqlite(url):
+        return options
+    options["connect_args"] = {"check_same_thread": False}
+    # インメモリDBは接続ごとに別のDBになるため、プールは既定値のままにする
+    if profile == "production" and not is_memory_sqlite(url):
+        options.update(
+            poolclass=AsyncAdaptedQueuePool if is_async else QueuePool,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+        )
+    return options
+
+def create_db_engine(url, profile=SQLITE_PROFILE):
+    """プロファイルを適用した同期エンジンを作成する"""
+    db_engine = create_engine(url, **engine_options(url, profile))
+    if is_sqlite(url):
+        apply_sqlite_pragmas(db_engine, sqlite_pragmas(profile))
+    return db_engine
+
+def create_async_db_engine(url, profile=SQLITE_PROFILE):
+    """プロファイルを適用した非同期エンジンを作成する"""
+    db_engine = create_async_engine(url, **engine_options(url, profile, is_async=True))
+    if is_sqlite(url):
+        apply_sqlite_pragmas(db_engine, sqlite_pragmas(profile))
+    return db_engine
+
 # データベースエンジンの作成
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+engine = create_db_engine(DATABASE_URL)
 
 # セッションローカルの設定
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# 非同期エンジンとセッション（チャットなどイベントループ上のホットパス用）
+async_engine = create_async_db_engine(ASYNC_DATABASE_URL)
+AsyncSessionLocal = sessionmaker(
+    bind=async_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False
+)
+
 # Baseクラスの作成
 Base = declarative_base()
 
@@ -25,4 +126,9 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+# 非同期DBセッションを取得する関数
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
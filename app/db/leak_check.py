@@ -0,0 +1,113 @@
+import os
+from contextvars import ContextVar
+from sqlalchemy import event
+from dotenv import load_dotenv
+
+# 環境変数の読み込み
+load_dotenv()
+
+# DB接続リークの検出モード
+#   off:    無効
+#   warn:   リクエスト終了時に返却されていない接続があればログに出す
+#   strict: 同じ条件で例外を送出する（テスト実行時に使用）
+DB_LEAK_CHECK = os.getenv("DB_LEAK_CHECK", "off").lower()
+
+class ConnectionLeakError(RuntimeError):
+    """リクエストの終了後も返却されていないDB接続がある"""
+
+class RequestConnections:
+    """1つのリクエスト（とその中で作られたタスク）が借りている接続の数"""
+
+    def __init__(self):
+        self.checked_out = 0
+        self._token = None
+
+# 処理中のリクエストの接続数（asyncio のタスクやスレッドプールにも引き継がれる）
+_current_request = ContextVar("db_leak_check_request", default=None)
+# 接続を借りたリクエストを接続レコードに記録するキー（別のコンテキストで返却されても数え直せる）
+_OWNER_KEY = "leak_check_owner"
+
+class ConnectionTracker:
+    """
+    コネクションプールの checkout / checkin を数え、貸し出し中の接続数を追跡する
+    リクエストの処理中に借りた接続は、プロセス全体とは別にそのリクエストの分として数える
+    """
+
+    def __init__(self):
+        self.checked_out = 0
+        self._pools = []
+
+    def install(self, engine):
+        # 非同期エンジンの場合は内部の同期エンジンのプールに登録する
+        pool = getattr(engine, "sync_engine", engine).pool
+        if pool in self._pools:
+            return
+        event.listen(pool, "checkout", self._on_checkout)
+        event.listen(pool, "checkin", self._on_checkin)
+        self._pools.append(pool)
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        self.checked_out += 1
+        owner = _current_request.get()
+        if owner is None:
+            # バックグラウンドの処理（ジョブのワーカー・会話の書き込みなど）はリクエストの分に数えない
+            connection_record.info.pop(_OWNER_KEY, None)
+            return
+        owner.checked_out += 1
+        connection_record.info[_OWNER_KEY] = owner
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        self.checked_out -= 1
+        # 切り離された接続はレコードがない
+        owner = connection_record.info.pop(_OWNER_KEY, None) if connection_record is not None else None
+        if owner is not None:
+            owner.checked_out -= 1
+
+    def begin_request(self):
+        """現在のコンテキストをリクエストとして追跡し始める（戻り値は end_request に渡す）"""
+        connections = RequestConnections()
+        connections._token = _current_request.set(connections)
+        return connections
+
+    def end_request(self, connections):
+        _current_request.reset(connections._token)
+
+    def assert_no_leaks(self, connections, context=""):
+        """リクエストが借りた接続がすべて返却されていなければ ConnectionLeakError"""
+        if connections.checked_out > 0:
+            raise ConnectionLeakError(
+                f"返却されていないDB接続があります: {connections.checked_out}件 {context}".rstrip()
+            )
+
+connection_tracker = ConnectionTracker()
+
+class ConnectionLeakMiddleware:
+    """
+    レスポンス送信完了時（ストリーミングの最後のチャンクまで）に、
+    そのリクエストの処理中に借りた接続がすべて返却されているか確認するASGIミドルウェア
+    同時リクエストやバックグラウンドの処理が借りている接続は数えない
+    """
+
+    def __init__(self, app, mode=DB_LEAK_CHECK, tracker=connection_tracker):
+        self.app = app
+        self.mode = mode
+        self.tracker = tracker
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.mode == "off":
+            await self.app(scope, receive, send)
+            return
+
+        connections = self.tracker.begin_request()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.tracker.end_request(connections)
+
+        context = f"({scope.get('method')} {scope.get('path')})"
+        try:
+            self.tracker.assert_no_leaks(connections, context)
+        except ConnectionLeakError as e:
+            if self.mode == "strict":
+                raise
+            print(f"警告: {str(e)}")
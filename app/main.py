@@ -1,11 +1,22 @@
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
 import os
 from dotenv import load_dotenv
-from app.routers import users, agents, chat, voice
-from app.db.database import engine
+from app.routers import users, agents, chat, chat_jobs, voice, status
+from app.db.database import engine, async_engine, SessionLocal
+from app.db.leak_check import ConnectionLeakMiddleware, connection_tracker, DB_LEAK_CHECK
 from app.models import models
+from app.services import http_clients
+from app.services.audio_cache import audio_cache
+from app.services.audio_lifecycle import audio_lifecycle
+from app.services.audio_stream import cache_control_for
+from app.services.voice_conversion import voice_conversion
+from app.services.conversation_writer import conversation_writer
+from app.services.tts_backends import tts_registry
+from app.services.speaker_catalog import speaker_catalog
+from app.services.chat_jobs import chat_jobs as chat_job_scheduler
 
 # 環境変数の読み込み
 load_dotenv()
@@ -16,10 +27,75 @@ models.Base.metadata.create_all(bind=engine)
 # 音声ファイル用ディレクトリの作成
 os.makedirs("audio_files", exist_ok=True)
 
+def load_agent_ids():
+    """参照音声を保護するため、既存エージェントのIDを取得する"""
+    db = SessionLocal()
+    try:
+        return {agent_id for (agent_id,) in db.query(models.Agent.agent_id).all()}
+    finally:
+        db.close()
+
+class TrackedStaticFiles(StaticFiles):
+    """
+    配信時刻を音声ファイルのライフサイクル管理に記録する静的ファイル配信
+    合成音声のキャッシュファイルには immutable の Cache-Control を付ける（ETag は StaticFiles が付ける）
+    """
+
+    async def get_response(self, path, scope):
+        response = await super().get_response(path, scope)
+        if response.status_code in (200, 206, 304):
+            response.headers["Cache-Control"] = cache_control_for(path)
+        if response.status_code == 200:
+            audio_lifecycle.touch(path)
+        return response
+
+def load_agent_speaker_ids():
+    """ウォームアップするため、既存エージェントが使うVoiceVoxのスピーカーIDを取得する"""
+    db = SessionLocal()
+    try:
+        return {
+            speaker_id for (speaker_id,) in db.query(models.Agent.voice_speaker_id).distinct().all()
+            if speaker_id is not None
+        }
+    finally:
+        db.close()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 上流サービス用の共有HTTPクライアントを作成
+    await http_clients.init_clients()
+    # 会話履歴の書き込みワーカーを開始
+    conversation_writer.start()
+    # 音声合成エンジンのヘルスチェックを開始
+    tts_registry.start()
+    # VoiceVoxのスピーカー一覧を取得し、エージェントが使うスピーカーを読み込んでおく
+    speaker_catalog.start(load_agent_speaker_ids())
+    # 合成音声キャッシュのインデックスを再構築
+    audio_cache.load_index()
+    # 音声ファイルのインデックスを作成し、バックグラウンドGCを開始
+    audio_lifecycle.load_index(reference_ids=load_agent_ids())
+    audio_lifecycle.start()
+    # 参照音声の変換ワーカーを開始
+    voice_conversion.start()
+    # 非同期チャットジョブのワーカーを開始（未完了のジョブを再開する）
+    await chat_job_scheduler.start()
+    try:
+        yield
+    finally:
+        await chat_job_scheduler.stop()
+        await voice_conversion.stop()
+        await speaker_catalog.stop()
+        await tts_registry.stop()
+        await audio_lifecycle.stop()
+        # キューに残っている会話履歴を書き込んでから終了する
+        await conversation_writer.stop()
+        await http_clients.close_clients()
+
 app = FastAPI(
     title="Agent Chat API",
     description="FastAPIとSQLiteを使用したエージェントチャットAPI",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORSの設定
@@ -39,14 +115,22 @@ app.add_middleware(
     expose_headers=["*"],
 )
 
+# DB接続リークの検出（DB_LEAK_CHECK=warn/strict で有効）
+if DB_LEAK_CHECK != "off":
+    connection_tracker.install(engine)
+    connection_tracker.install(async_engine)
+    app.add_middleware(ConnectionLeakMiddleware, mode=DB_LEAK_CHECK)
+
 # 静的ファイルの提供設定
-app.mount("/audio", StaticFiles(directory="audio_files"), name="audio")
+app.mount("/audio", TrackedStaticFiles(directory="audio_files"), name="audio")
 
 # ルーターの登録
 app.include_router(users.router)
 app.include_router(agents.router)
 app.include_router(chat.router)
+app.include_router(chat_jobs.router)
 app.include_router(voice.router)
+app.include_router(status.router)
 
 @app.get("/")
 def read_root():
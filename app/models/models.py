@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, Text, ForeignKey, DateTime
+from sqlalchemy import Column, String, Integer, Text, ForeignKey, DateTime, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.db.database import Base
@@ -49,4 +49,39 @@ class Conversation(Base):
     
     # リレーションシップ
     user = relationship("User", back_populates="conversations")
-    agent = relationship("Agent", back_populates="conversations")
\ No newline at end of file
+    agent = relationship("Agent", back_populates="conversations")
+
+class ConversationSummary(Base):
+    __tablename__ = "conversation_summaries"
+    __table_args__ = (UniqueConstraint("user_id", "agent_id", name="uq_conversation_summaries_user_agent"),)
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(String, ForeignKey("users.user_id"))
+    agent_id = Column(String, ForeignKey("agents.agent_id"))
+    summary = Column(Text, nullable=False, default="")  # 古い会話の要約
+    covered_until_id = Column(Integer, nullable=False, default=0)  # 要約に含めた最後の会話ID
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+class ChatJob(Base):
+    __tablename__ = "chat_jobs"
+    
+    job_id = Column(String, primary_key=True, index=True, default=generate_uuid)
+    user_id = Column(String, nullable=True, index=True)
+    agent_id = Column(String, ForeignKey("agents.agent_id"))
+    user_message = Column(Text, nullable=False)
+    status = Column(String, nullable=False, default="queued", index=True)  # queued / running / text_ready / done / failed
+    response_text = Column(Text, nullable=True)
+    audio_path = Column(String, nullable=True)
+    audio_segments = Column(Text, nullable=True)  # 文ごとの音声ファイルパス（JSON配列）
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, server_default=func.now())
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+# 会話履歴の取得（user_id, agent_id で絞り込み、created_at の新しい順）用の複合インデックス
+# 既存のデータベースには migrate_db.py で作成する
+Index(
+    "ix_conversations_user_agent_created",
+    Conversation.user_id,
+    Conversation.agent_id,
+    Conversation.created_at.desc()
+)
@@ -75,7 +75,14 @@ class ChatRequest(BaseModel):
 class ChatResponse(BaseModel):
     text: str
     audio_url: str
-    audio_data: Optional[str] = None  # Base64エンコードされた音声データ
+    audio_data: Optional[str] = None  # Base64エンコードされた音声データ（response_mode=inline の場合のみ）
+    audio_segments: List[str] = []  # 文ごとの音声URL（複数文の応答の場合のみ）
+    # 音声の状態（ready: 音声あり / pending: 合成中 / none: 音声なし）
+    audio_status: str = "ready"
+    # 合成中の音声を受け取るためのジョブ（audio_status=pending の場合のみ）
+    audio_job_id: Optional[str] = None
+    audio_status_url: Optional[str] = None
+    audio_ws_url: Optional[str] = None
 
 # オーディオ関連のスキーマ
 class AudioQueryRequest(BaseModel):
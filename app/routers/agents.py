@@ -3,6 +3,9 @@ from sqlalchemy.orm import Session
 from app.db.database import get_db
 from app.models import schemas
 from app.crud import crud
+from app.services.agent_cache import agent_cache
+from app.services.speaker_catalog import speaker_catalog
+from anyio import from_thread
 from typing import List
 
 router = APIRouter(
@@ -10,13 +13,29 @@ router = APIRouter(
     tags=["agents"]
 )
 
+def validate_speaker_id(speaker_id):
+    """
+    VoiceVoxのスピーカー一覧にないスピーカーIDを拒否する
+    取得済みの一覧で確認し、一覧がまだない場合（起動直後・VoiceVoxの停止中など）は検証せずに通す
+    """
+    if speaker_id is None:
+        return
+    # 同期エンドポイントはワーカースレッドで動くため、イベントループ側で実行する
+    # 一覧の取得は待たない（ワーカースレッドを取得のタイムアウトまで占有しない）
+    if from_thread.run_sync(speaker_catalog.lookup, speaker_id) is False:
+        raise HTTPException(status_code=422, detail=f"VoiceVoxにスピーカーID {speaker_id} は存在しません")
+
 @router.post("/{user_id}", response_model=schemas.AgentResponse)
 def create_agent(
     user_id: str,
     agent: schemas.AgentCreate,
     db: Session = Depends(get_db)
 ):
-    return crud.create_agent(db=db, agent=agent, user_id=user_id)
+    validate_speaker_id(agent.voice_speaker_id)
+    db_agent = crud.create_agent(db=db, agent=agent, user_id=user_id)
+    # 初回の音声合成でモデルの読み込みを待たないよう、スピーカーを読み込んでおく
+    from_thread.run_sync(speaker_catalog.schedule_warmup, [db_agent.voice_speaker_id])
+    return db_agent
 
 @router.get("/{user_id}", response_model=List[schemas.AgentResponse])
 def read_agents(
@@ -72,9 +91,14 @@ def update_agent(
     agent: schemas.AgentUpdate,
     db: Session = Depends(get_db)
 ):
+    validate_speaker_id(agent.voice_speaker_id)
     db_agent = crud.update_agent(db, agent_id=agent_id, agent=agent)
     if db_agent is None:
         raise HTTPException(status_code=404, detail="Agent not found")
+    # キャッシュ済みのエージェントを無効化（同期エンドポイントはワーカースレッドで動くため、イベントループ側で実行）
+    from_thread.run(agent_cache.invalidate, agent_id)
+    if agent.voice_speaker_id is not None:
+        from_thread.run_sync(speaker_catalog.schedule_warmup, [agent.voice_speaker_id])
     return db_agent
 
 @router.delete("/{agent_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -85,6 +109,7 @@ def delete_agent(
     success = crud.delete_agent(db, agent_id=agent_id)
     if not success:
         raise HTTPException(status_code=404, detail="Agent not found")
+    from_thread.run(agent_cache.invalidate, agent_id)
     return None
 
 @router.get("/debug/{agent_id}")
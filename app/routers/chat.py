@@ -1,95 +1,236 @@
-from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
-from fastapi.responses import FileResponse
-from sqlalchemy.orm import Session
-from app.db.database import get_db
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db.database import get_async_db
 from app.models import schemas
-from app.crud import crud
 from app.services import api_service
+from app.services.audio_lifecycle import audio_lifecycle
+from app.services.transcoder import media_type_for
+from app.services.audio_stream import audio_response
+from app.services.voice_settings import VoiceSettings
+from app.services.agent_cache import agent_cache
+from app.services.history_cache import save_conversation
+from app.services.context_builder import context_builder
+from app.services.chat_jobs import chat_jobs, ChatJobQueueFull
+from app.services.chat_session import ChatSession
 import os
-from typing import Optional, List
+from typing import Optional, Literal
+from urllib.parse import quote
 import asyncio
+import json
+import uuid
+import aiofiles
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# チャット応答の音声の返し方
+#   url:       音声URLのみ（音声データは含めない）
+#   inline:    Base64エンコードした音声データをJSONに含める（従来の動作）
+#   multipart: JSON部と音声部からなる multipart/mixed で返す
+#   binary:    音声ファイルをそのまま返し、テキストはヘッダーで返す
+#   deferred:  テキストができた時点で返し、音声は合成ジョブ（audio_status_url / audio_ws_url）で後から受け取る
+ResponseMode = Literal["url", "inline", "multipart", "binary", "deferred"]
+CHAT_RESPONSE_MODE = os.getenv("CHAT_RESPONSE_MODE", "inline")
+# テキスト生成と音声合成を合わせた待ち時間の上限（秒）
+# 音声合成が間に合わない場合はテキストだけ先に返し、音声は deferred と同じく後から届ける
+CHAT_TIMEOUT = float(os.getenv("CHAT_TIMEOUT", "180"))
+AUDIO_CHUNK_SIZE = 64 * 1024
+
+# WebSocketセッションの設定
+# 送信待ちにできるフレーム数（超えると応答の生成側が待つ）
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "64"))
+# 1フレームの送信にかけられる時間（秒）。超えた場合は受信が遅いクライアントとして切断する
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "30"))
+# 応答の生成中に受け付けておけるメッセージ数
+WS_MAX_PENDING_MESSAGES = int(os.getenv("WS_MAX_PENDING_MESSAGES", "3"))
 
 router = APIRouter(
     prefix="/chat",
     tags=["chat"]
 )
 
+async def build_messages(db: AsyncSession, agent, chat_request: schemas.ChatRequest):
+    """
+    システムプロンプト・会話の要約・会話履歴・ユーザーメッセージからLLMへのメッセージを組み立てる
+    履歴はトークン予算に収まるだけ新しい順に含める（システムプロンプトはエージェントキャッシュで作成済み）
+    """
+    return await context_builder.build_messages(
+        db,
+        agent,
+        chat_request.user_id,
+        chat_request.user_message
+    )
+
+async def iter_audio_file(filepath):
+    """音声ファイルをチャンク単位で読み出す（全体をメモリに載せない）"""
+    async with aiofiles.open(filepath, 'rb') as f:
+        while True:
+            chunk = await f.read(AUDIO_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+async def iter_multipart(boundary, metadata, filepath):
+    """JSON部と音声部からなる multipart/mixed の本文を生成する"""
+    yield (
+        f"--{boundary}\r\n"
+        "Content-Type: application/json; charset=utf-8\r\n\r\n"
+    ).encode()
+    yield json.dumps(metadata, ensure_ascii=False).encode("utf-8")
+    yield (
+        f"\r\n--{boundary}\r\n"
+        f"Content-Type: {media_type_for(filepath)}\r\n"
+        f"Content-Disposition: attachment; filename=\"{os.path.basename(filepath)}\"\r\n"
+        f"Content-Length: {os.path.getsize(filepath)}\r\n\r\n"
+    ).encode()
+    async for chunk in iter_audio_file(filepath):
+        yield chunk
+    yield f"\r\n--{boundary}--\r\n".encode()
+
+async def build_chat_response(text, audio_path, response_mode, segment_paths=None):
+    """
+    response_mode に応じてチャット応答を組み立てる
+    """
+    # 音声ファイルのURLを生成（音声パスが空でない場合のみ）
+    audio_url = ""
+    if audio_path:
+        audio_filename = os.path.basename(audio_path)
+        audio_url = f"/audio/{audio_filename}"
+    # 文ごとの音声URL
+    audio_segments = [f"/audio/{os.path.basename(path)}" for path in segment_paths or []]
+    
+    # 音声がない場合やURLのみの場合は音声データを含めない
+    if not audio_path or response_mode == "url":
+        return {
+            "text": text,
+            "audio_url": audio_url,
+            "audio_data": None,
+            "audio_segments": audio_segments,
+            "audio_status": "ready" if audio_path else "none"
+        }
+    
+    if response_mode == "inline":
+        return {
+            "text": text,
+            "audio_url": audio_url,
+            "audio_data": await api_service.encode_audio_base64(audio_path),  # Base64エンコードされた音声データを返す
+            "audio_segments": audio_segments
+        }
+    
+    if response_mode == "binary":
+        # テキストはヘッダーに入れるためパーセントエンコードする
+        return StreamingResponse(
+            iter_audio_file(audio_path),
+            media_type=media_type_for(audio_path),
+            headers={
+                "Content-Length": str(os.path.getsize(audio_path)),
+                "X-Chat-Text": quote(text),
+                "X-Audio-Url": audio_url,
+                "X-Audio-Segments": ",".join(audio_segments),
+            }
+        )
+    
+    boundary = uuid.uuid4().hex
+    return StreamingResponse(
+        iter_multipart(boundary, {"text": text, "audio_url": audio_url, "audio_segments": audio_segments}, audio_path),
+        media_type=f"multipart/mixed; boundary={boundary}"
+    )
+
+async def build_deferred_response(agent_id, chat_request: schemas.ChatRequest, text):
+    """
+    テキストだけを先に返し、音声合成はジョブとして続ける
+    ジョブを登録できない場合は None を返す
+    """
+    try:
+        job = await chat_jobs.submit_synthesis(agent_id, chat_request.user_id, chat_request.user_message, text)
+    except ChatJobQueueFull as e:
+        print(f"音声合成ジョブを登録できませんでした: {str(e)}")
+        return None
+    return {
+        "text": text,
+        "audio_url": "",
+        "audio_data": None,
+        "audio_segments": [],
+        "audio_status": "pending",
+        "audio_job_id": job.job_id,
+        "audio_status_url": f"/chat/jobs/{job.job_id}",
+        "audio_ws_url": f"/chat/jobs/{job.job_id}/ws"
+    }
+
 @router.post("/{agent_id}", response_model=schemas.ChatResponse)
 async def chat_with_agent(
     agent_id: str,
     chat_request: schemas.ChatRequest,
-    db: Session = Depends(get_db)
+    background_tasks: BackgroundTasks,
+    response_mode: ResponseMode = Query(default=CHAT_RESPONSE_MODE),
+    db: AsyncSession = Depends(get_async_db)
 ):
     # エージェントの存在確認
-    agent = crud.get_agent(db, agent_id=agent_id)
+    agent = await agent_cache.get(db, agent_id)
     if agent is None:
         raise HTTPException(status_code=404, detail="Agent not found")
     
-    # メッセージ履歴の取得（ユーザーIDが提供されている場合）
-    message_history = []
-    if chat_request.user_id:
-        conversations = crud.get_conversations(
-            db, 
-            user_id=chat_request.user_id, 
-            agent_id=agent_id, 
-            limit=5
-        )
-        
-        for conv in reversed(conversations):
-            message_history.append({"role": "user", "content": conv.user_message})
-            message_history.append({"role": "assistant", "content": conv.agent_response})
-    
-    # システムプロンプトの作成
-    system_prompt = f"あなたは{agent.personality1}"
-    if agent.personality2:
-        system_prompt += f"かつ{agent.personality2}"
-    system_prompt += f"なAIです。{agent.tone}な口調で話してください。"
-    
-    # メッセージの作成
-    messages = [{"role": "system", "content": system_prompt}]
-    messages.extend(message_history)
-    messages.append({"role": "user", "content": chat_request.user_message})
-    
-    # 音声処理専用のタイムアウト設定
+    messages = await build_messages(db, agent, chat_request)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + CHAT_TIMEOUT
+    
     try:
         # テキスト生成部分と音声生成部分を段階的に処理
         try:
-            # チャットAPIと音声APIを呼び出す（タイムアウトを設定）
-            result = await asyncio.wait_for(
-                api_service.process_chat_and_voice(messages, chat_request.user_id, agent_id),
-                timeout=180.0  # 3分のタイムアウト
-            )
-            
-            # 会話履歴を保存（ユーザーIDが提供されている場合）
-            if chat_request.user_id and result["text"]:
-                crud.create_conversation(
-                    db, 
-                    user_id=chat_request.user_id,
-                    agent_id=agent_id,
-                    user_message=chat_request.user_message,
-                    agent_response=result["text"]
-                )
-            
-            # 音声ファイルのURLを生成（音声パスが空でない場合のみ）
-            audio_url = ""
-            if result["audio_path"]:
-                audio_filename = os.path.basename(result["audio_path"])
-                audio_url = f"/audio/{audio_filename}"
-            
-            # レスポンスを構築する
-            return {
-                "text": result["text"],
-                "audio_url": audio_url,
-                "audio_data": result.get("audio_data", "")  # Base64エンコードされた音声データを返す
-            }
-            
+            # チャットAPIを呼び出す（タイムアウトを設定）
+            text = await asyncio.wait_for(api_service.generate_chat_text(messages), timeout=CHAT_TIMEOUT)
         except asyncio.TimeoutError:
-            print("チャットと音声処理がタイムアウトしました")
-            # テキストだけ先に返すフォールバック処理
+            print("チャット処理がタイムアウトしました")
             raise HTTPException(
                 status_code=504,  # Gateway Timeout
                 detail="処理に時間がかかりすぎています。もう少し短いメッセージでお試しください。"
             )
+        
+        # 会話履歴はテキストができた時点で保存する（音声合成の完了を待たない）
+        if chat_request.user_id:
+            await save_conversation(
+                user_id=chat_request.user_id,
+                agent_id=agent_id,
+                user_message=chat_request.user_message,
+                agent_response=text
+            )
+            # 予算からあふれた古い会話の要約はレスポンス送信後に行う
+            background_tasks.add_task(context_builder.summarize, chat_request.user_id, agent_id)
+        
+        if response_mode == "deferred":
+            response = await build_deferred_response(agent_id, chat_request, text)
+            if response is not None:
+                return response
+            # ジョブを登録できない場合はこの場で合成する
+            response_mode = "url"
+        
+        try:
+            # 残り時間で音声を合成する
+            audio_result = await asyncio.wait_for(
+                api_service.synthesize_text(text, VoiceSettings.from_agent(agent)),
+                timeout=max(deadline - loop.time(), 0)
+            )
+        except asyncio.TimeoutError:
+            # テキストは捨てずに返し、音声は合成ジョブで後から届ける
+            # （途中まで進んだ合成は single-flight と音声キャッシュでジョブ側に引き継がれる）
+            print("音声合成がタイムアウトしたため、テキストを先に返します")
+            response = await build_deferred_response(agent_id, chat_request, text)
+            if response is not None:
+                return response
+            return await build_chat_response(text, "", response_mode)
+        
+        if audio_result is None:
+            # 最終的なフォールバック: 音声なしでテキストだけ返す
+            return await build_chat_response(text, "", response_mode)
+        
+        # レスポンスを構築する
+        return await build_chat_response(text, audio_result["filepath"], response_mode, audio_result["segments"])
+        
+    except HTTPException:
+        # 上流の障害（サーキットが開いている場合の503など）はそのまま返す
+        raise
     except Exception as e:
         print(f"チャットエンドポイント例外: {str(e)}")
         # 重大なエラーの場合、500エラーを返す
@@ -98,9 +239,186 @@ async def chat_with_agent(
             detail=f"内部サーバーエラー: {str(e)}"
         )
 
+@router.post("/{agent_id}/stream")
+async def stream_chat_with_agent(
+    agent_id: str,
+    chat_request: schemas.ChatRequest,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    テキスト差分と文ごとの音声URLをNDJSONで逐次返すストリーミングチャット
+    """
+    # エージェントの存在確認
+    agent = await agent_cache.get(db, agent_id)
+    if agent is None:
+        raise HTTPException(status_code=404, detail="Agent not found")
+    
+    messages = await build_messages(db, agent, chat_request)
+    
+    async def event_stream():
+        async for event in api_service.stream_chat_and_voice(messages, VoiceSettings.from_agent(agent)):
+            # サーバー内のファイルパスはクライアントに返さない
+            event.pop("filepath", None)
+            # 会話履歴を保存（ユーザーIDが提供されている場合）
+            if event["type"] == "done" and chat_request.user_id and event["text"]:
+                await save_conversation(
+                    user_id=chat_request.user_id,
+                    agent_id=agent_id,
+                    user_message=chat_request.user_message,
+                    agent_response=event["text"]
+                )
+            yield json.dumps(event, ensure_ascii=False) + "\n"
+    
+    # 予算からあふれた古い会話の要約はストリーム終了後に行う
+    background = BackgroundTask(context_builder.summarize, chat_request.user_id, agent_id) if chat_request.user_id else None
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson", background=background)
+
+@router.websocket("/{agent_id}/ws")
+async def chat_session(
+    websocket: WebSocket,
+    agent_id: str,
+    user_id: Optional[str] = None,
+    audio: Literal["binary", "url"] = "binary"
+):
+    """
+    1つの接続で複数のメッセージをやり取りする会話セッション
+    エージェント設定と会話履歴は接続中メモリに保持する
+
+    クライアント → サーバー（JSON、またはメッセージ本文だけのテキスト）:
+        {"type": "message", "user_message": str}
+        {"type": "cancel"}  処理中の応答を中断する
+        {"type": "ping"}
+    サーバー → クライアント:
+        {"type": "ready", "session_id": str, "agent_id": str}
+        {"type": "text", "turn": int, "delta": str}
+        {"type": "audio_start", "turn": int, "index": int, "text": str, "audio_url": str}  合成中の音声のURL
+        {"type": "audio", "turn": int, "index": int, "text": str, "audio_url": str, "media_type": str, "bytes": int}
+            audio=binary の場合はこの後に音声データのバイナリフレームが続き、{"type": "audio_end", ...} で終わる
+        {"type": "done", "turn": int, "text": str}
+        {"type": "error", "detail": str}
+    """
+    await websocket.accept()
+    session = await ChatSession.open(agent_id, user_id)
+    if session is None:
+        await websocket.send_json({"type": "error", "detail": "Agent not found"})
+        await websocket.close(code=1008)
+        return
+    
+    # 送信は1つのタスクにまとめ、キューが埋まったら生成側を待たせる（バックプレッシャー）
+    outbox = asyncio.Queue(maxsize=WS_SEND_QUEUE_SIZE)
+    inbox = asyncio.Queue(maxsize=WS_MAX_PENDING_MESSAGES)
+    current = None
+    
+    async def send_frame(frame):
+        await asyncio.wait_for(frame, timeout=WS_SEND_TIMEOUT)
+    
+    async def sender():
+        while True:
+            kind, payload = await outbox.get()
+            if kind == "json":
+                await send_frame(websocket.send_json(payload))
+                continue
+            # 音声ファイルは送信する時点で読み出す（送信待ちの間メモリに載せない）
+            try:
+                async for chunk in iter_audio_file(payload):
+                    await send_frame(websocket.send_bytes(chunk))
+            except FileNotFoundError:
+                await send_frame(websocket.send_json({"type": "error", "detail": "Audio file not found"}))
+    
+    async def receiver():
+        while True:
+            raw = await websocket.receive_text()
+            try:
+                data = json.loads(raw)
+            except ValueError:
+                data = {"type": "message", "user_message": raw}
+            if not isinstance(data, dict):
+                data = {"type": "message", "user_message": str(data)}
+            message_type = data.get("type", "message")
+            if message_type == "ping":
+                await outbox.put(("json", {"type": "pong"}))
+            elif message_type == "cancel":
+                if current is not None and not current.done():
+                    current.cancel()
+            elif message_type == "message":
+                user_message = (data.get("user_message") or "").strip()
+                if not user_message:
+                    await outbox.put(("json", {"type": "error", "detail": "user_message is required"}))
+                    continue
+                try:
+                    inbox.put_nowait(user_message)
+                except asyncio.QueueFull:
+                    await outbox.put(("json", {"type": "error", "detail": "応答の生成中です。しばらくしてから送信してください。"}))
+            else:
+                await outbox.put(("json", {"type": "error", "detail": f"Unknown message type: {message_type}"}))
+    
+    async def respond(user_message):
+        turn = session.turn_count + 1
+        async for event in session.stream_turn(user_message):
+            # 変換・連結後の確定したファイルから送る（URLからパスを組み立て直さない）
+            file_path = event.pop("filepath", None)
+            if event["type"] == "audio" and audio == "binary" and file_path:
+                audio_lifecycle.touch(file_path)
+                await outbox.put(("json", {
+                    "turn": turn,
+                    **event,
+                    "media_type": media_type_for(file_path),
+                    "bytes": os.path.getsize(file_path) if os.path.exists(file_path) else 0
+                }))
+                await outbox.put(("file", file_path))
+                await outbox.put(("json", {"type": "audio_end", "turn": turn, "index": event["index"]}))
+            else:
+                await outbox.put(("json", {"turn": turn, **event}))
+    
+    async def run_turns():
+        nonlocal current
+        while True:
+            user_message = await inbox.get()
+            current = asyncio.create_task(respond(user_message))
+            try:
+                # 中断要求でターンがキャンセルされても、セッションは続ける
+                await asyncio.wait({current})
+            finally:
+                if not current.done():
+                    current.cancel()
+            if current.cancelled():
+                await outbox.put(("json", {"type": "cancelled", "turn": session.turn_count}))
+            elif current.exception() is not None:
+                error = current.exception()
+                detail = error.detail if isinstance(error, HTTPException) else str(error)
+                print(f"チャットセッションエラー: {session.session_id}: {detail}")
+                await outbox.put(("json", {"type": "error", "detail": detail}))
+    
+    await outbox.put(("json", {"type": "ready", "session_id": session.session_id, "agent_id": agent_id}))
+    tasks = [asyncio.create_task(sender()), asyncio.create_task(receiver()), asyncio.create_task(run_turns())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            error = task.exception()
+            if isinstance(error, asyncio.TimeoutError):
+                print(f"クライアントの受信が遅いため切断します: {session.session_id}")
+                try:
+                    await websocket.close(code=1008)
+                except Exception:
+                    pass
+            elif error is not None and not isinstance(error, WebSocketDisconnect):
+                print(f"チャットセッション例外: {session.session_id}: {str(error)}")
+    finally:
+        for task in tasks + ([current] if current else []):
+            task.cancel()
+        for task in tasks + ([current] if current else []):
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+
 @router.get("/audio/{filename}")
-async def get_audio_file(filename: str):
-    file_path = os.path.join("audio_files", filename)
-    if not os.path.exists(file_path):
+async def get_audio_file(filename: str, request: Request):
+    """
+    音声ファイルを取得（Range・ETag に対応し、合成中のWAVは書き込まれた分から順に返す）
+    """
+    response = audio_response(request, filename)
+    if response is None:
         raise HTTPException(status_code=404, detail="Audio file not found")
-    return FileResponse(file_path, media_type="audio/wav")
\ No newline at end of file
+    audio_lifecycle.touch(filename)
+    return response
\ No newline at end of file
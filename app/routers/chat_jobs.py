@@ -0,0 +1,86 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, WebSocket, WebSocketDisconnect, status
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db.database import get_async_db
+from app.models import schemas
+from app.services.agent_cache import agent_cache
+from app.services.chat_jobs import chat_jobs, ChatJobQueueFull
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# long-poll で1回に待つ最大時間（秒）。トンネルやプロキシのタイムアウトより短くする
+CHAT_JOB_MAX_WAIT = float(os.getenv("CHAT_JOB_MAX_WAIT", "25"))
+
+router = APIRouter(
+    prefix="/chat",
+    tags=["chat"]
+)
+
+@router.post("/{agent_id}/jobs", status_code=status.HTTP_202_ACCEPTED)
+async def submit_chat_job(
+    agent_id: str,
+    chat_request: schemas.ChatRequest,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    チャットをジョブとして登録し、すぐにジョブIDを返す
+    結果は GET /chat/jobs/{job_id}（long-poll）か WebSocket /chat/jobs/{job_id}/ws で段階ごとに受け取る
+    """
+    # エージェントの存在確認
+    agent = await agent_cache.get(db, agent_id)
+    if agent is None:
+        raise HTTPException(status_code=404, detail="Agent not found")
+
+    try:
+        job = await chat_jobs.submit(agent_id, chat_request.user_id, chat_request.user_message)
+    except ChatJobQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+
+    return {
+        "job_id": job.job_id,
+        "status": job.status,
+        "status_url": f"/chat/jobs/{job.job_id}",
+        "ws_url": f"/chat/jobs/{job.job_id}/ws",
+    }
+
+@router.get("/jobs/{job_id}")
+async def get_chat_job(
+    job_id: str,
+    after: int = Query(default=0, ge=0),
+    wait: float = Query(default=0, ge=0)
+):
+    """
+    ジョブの状態と after 番目以降のイベントを返す
+    wait を指定すると新しいイベントが届くかジョブが終わるまで最大 wait 秒待つ（long-poll）
+    次回は返された version を after に指定する
+    """
+    job = await chat_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if wait > 0:
+        await chat_jobs.wait(job, after, min(wait, CHAT_JOB_MAX_WAIT))
+    return job.to_dict(after)
+
+@router.websocket("/jobs/{job_id}/ws")
+async def watch_chat_job(websocket: WebSocket, job_id: str, after: int = 0):
+    """ジョブのイベントを届いた順に送り、ジョブが終わったら閉じる"""
+    await websocket.accept()
+    job = await chat_jobs.get(job_id)
+    if job is None:
+        await websocket.send_json({"type": "error", "detail": "Job not found"})
+        await websocket.close(code=1008)
+        return
+
+    try:
+        while True:
+            await chat_jobs.wait(job, after, CHAT_JOB_MAX_WAIT)
+            events = job.events[after:]
+            for event in events:
+                await websocket.send_json({"index": after, **event})
+                after += 1
+            if job.finished and after >= len(job.events):
+                break
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
@@ -0,0 +1,51 @@
+from fastapi import APIRouter
+from app.services.agent_cache import agent_cache
+from app.services.audio_cache import audio_cache
+from app.services.audio_lifecycle import audio_lifecycle
+from app.services.history_cache import history_cache
+from app.services.context_builder import context_builder
+from app.services.conversation_writer import conversation_writer
+from app.services.tts_backends import tts_registry
+from app.services.chat_jobs import chat_jobs
+from app.services.audio_writes import audio_writes
+from app.services.speaker_catalog import speaker_catalog
+from app.services import circuit_breaker, single_flight
+
+router = APIRouter(
+    prefix="/status",
+    tags=["status"]
+)
+
+@router.get("/cache")
+async def get_cache_status():
+    """キャッシュのヒット率などの統計情報を取得"""
+    return {
+        "agents": agent_cache.stats(),
+        "audio": audio_cache.stats(),
+        "audio_files": audio_lifecycle.stats(),
+        "audio_writes": audio_writes.stats(),
+        "history": history_cache.stats(),
+        "context": context_builder.stats(),
+        "conversation_writer": conversation_writer.stats(),
+        "coalescing": single_flight.stats()
+    }
+
+@router.get("/tts")
+async def get_tts_status():
+    """音声合成エンジンのインスタンスごとの状態（処理中のリクエスト数・切り離し状況）を取得"""
+    return tts_registry.stats()
+
+@router.get("/upstreams")
+async def get_upstream_status():
+    """上流（LLM・VoiceVox・カスタム音声合成）ごとのサーキットブレーカーの状態を取得"""
+    return circuit_breaker.stats()
+
+@router.get("/jobs")
+async def get_job_status():
+    """非同期チャットジョブのキュー・ワーカーの状態を取得"""
+    return chat_jobs.stats()
+
+@router.get("/speakers")
+async def get_speaker_status():
+    """VoiceVoxのスピーカー一覧のキャッシュとウォームアップの状態を取得"""
+    return speaker_catalog.stats()
@@ -1,46 +1,59 @@
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException, status, Depends
-from fastapi.responses import FileResponse
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, status, Request
 import os
 import uuid
-import shutil
-import requests
+import httpx
+import aiofiles
 from typing import Optional
-from app.db.database import get_db
-from app.crud import crud
+from app.db.database import AsyncSessionLocal
+from app.crud import async_crud
 from app.models import schemas
+from app.services.audio_cache import audio_cache, reference_fingerprint
+from app.services.audio_lifecycle import audio_lifecycle
+from app.services.transcoder import transcode_cached
+from app.services.audio_stream import audio_response
+from app.services import custom_voice
+from app.services.tts_backends import tts_registry, TTSError
+from app.services.circuit_breaker import CircuitOpenError
+from app.services.single_flight import synthesis_flight
+from app.services.voice_conversion import voice_conversion, ConversionQueueFull
+from app.services.voice_settings import VoiceSettings
+from app.services.agent_cache import agent_cache
+from app.services.speaker_catalog import speaker_catalog
 from dotenv import load_dotenv
 
 load_dotenv()  # .envファイルから環境変数を読み込む
 
 # 音声ファイル保存ディレクトリ
+# VoiceVox とカスタム音声合成のURLは tts_backends で管理する
 AUDIO_DIR = "audio_files"
-VOICE_SYNTHESIS_URL = os.getenv("CUSTOM_VOICE_API_URL", "http://localhost:8000")  # 環境変数から取得、デフォルトはlocalhost:8000
-
-print(f"カスタム音声合成APIのURL: {VOICE_SYNTHESIS_URL}")
 
 # ディレクトリが存在しない場合は作成
 os.makedirs(AUDIO_DIR, exist_ok=True)
 
+# アップロードを受け付ける音声形式
+SUPPORTED_FORMATS = ('.wav', '.mp3', '.ogg', '.flac', '.webm', '.m4a', '.aac')
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
 router = APIRouter(
     prefix="/voice",
     tags=["voice"]
 )
 
-@router.post("/upload")
+@router.post("/upload", status_code=status.HTTP_202_ACCEPTED)
 async def upload_voice(
     file: UploadFile = File(...),
-    agent_id: str = Form(...),
-    db: Session = Depends(get_db)
+    agent_id: str = Form(...)
 ):
-    """エージェント用の音声ファイルをアップロード"""
+    """
+    エージェント用の音声ファイルをアップロード
+    WAVへの変換はバックグラウンドのジョブで行い、ジョブIDをすぐに返す
+    """
     try:
         # サポートされている音声形式をチェック（拡張子ベース）
         # より多くのフォーマットをサポート
-        supported_formats = ('.wav', '.mp3', '.ogg', '.flac', '.webm', '.m4a', '.aac')
         original_extension = os.path.splitext(file.filename.lower())[1]
         
-        if not file.filename.lower().endswith(supported_formats):
+        if not file.filename.lower().endswith(SUPPORTED_FORMATS):
             raise HTTPException(status_code=400, detail="音声ファイル形式が無効です")
         
         # MIME typeも確認
@@ -48,132 +61,73 @@ async def upload_voice(
         print(f"アップロードされたファイル: {file.filename}, MIME type: {mime_type}")
         
         # エージェントIDをファイル名として、最終的には.wav拡張子を使用
-        # 既存のファイルと競合しないよう、一時ファイルには別の名前を使用
+        # 同時アップロードと競合しないよう、一時ファイルには一意な名前を使用
         filename = f"{agent_id}.wav"  # 最終ファイル名
-        temp_filename = f"{agent_id}_temp{original_extension}"  # 一時ファイル名
+        temp_filename = f"{agent_id}_temp_{uuid.uuid4().hex[:8]}{original_extension}"  # 一時ファイル名
         file_path = os.path.join(AUDIO_DIR, filename)
         temp_file_path = os.path.join(AUDIO_DIR, temp_filename)
         
-        # ディレクトリが存在しない場合は作成
-        os.makedirs(AUDIO_DIR, exist_ok=True)
+        # アップロードをチャンク単位でそのままディスクに書き出す
+        async with aiofiles.open(temp_file_path, "wb") as buffer:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                await buffer.write(chunk)
         
-        # 既存のファイルがあれば削除（上書き前にクリーンアップ）
-        if os.path.exists(file_path):
-            try:
-                os.remove(file_path)
-                print(f"既存のファイルを削除: {file_path}")
-            except Exception as rm_err:
-                print(f"既存ファイル削除エラー（無視して続行）: {str(rm_err)}")
-        
-        # まず元のフォーマットで一時ファイルに保存
-        with open(temp_file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-            
-        # 可能であれば、FFmpegを使用して適切なWAV形式に変換を試みる
+        # FFmpegによるWAV変換をジョブとして登録
         try:
-            import subprocess
-            
-            # 入力と出力が同じ場合は一時的な変換先ファイルを作成
-            # エラーを防ぐために、違うパスを使用
-            if temp_file_path == file_path:
-                print(f"警告: 入力と出力が同じファイルのため、一時ファイルを作成します")
-                intermediate_path = os.path.join(AUDIO_DIR, f"temp_{uuid.uuid4().hex}.wav")
-            else:
-                intermediate_path = file_path
-                
-            # FFmpegコマンドを構築 - PCM 16bitのWAV形式に変換
-            cmd = [
-                'ffmpeg',
-                '-y',  # 既存ファイルを上書き
-                '-i', temp_file_path,  # 入力ファイル
-                '-acodec', 'pcm_s16le',  # 16-bit PCM
-                '-ar', '44100',  # サンプリングレート
-                '-ac', '1',      # モノラル
-                intermediate_path  # 出力ファイル
-            ]
-            
-            print(f"FFmpeg変換コマンド: {' '.join(cmd)}")
-            
-            # FFmpegを実行
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
-            )
-            stdout, stderr = process.communicate()
-            
-            if process.returncode == 0:
-                print(f"FFmpegによる変換成功: {temp_file_path} -> {intermediate_path}")
-                # 中間ファイルが最終ファイルと違う場合は、最終ファイルにコピー
-                if intermediate_path != file_path:
-                    shutil.copy(intermediate_path, file_path)
-                    os.remove(intermediate_path)
-                # 元の一時ファイルと最終ファイルが違う場合のみ削除
-                if temp_file_path != file_path and os.path.exists(temp_file_path):
-                    os.remove(temp_file_path)
-            else:
-                print(f"FFmpegによる変換失敗: {stderr.decode()}")
-                # 変換失敗した場合は元のファイルをコピー（入出力が別の場合のみ）
-                if temp_file_path != file_path:
-                    shutil.copy(temp_file_path, file_path)
-                    print(f"元のファイルをコピー: {temp_file_path} -> {file_path}")
-        except Exception as conv_err:
-            print(f"音声変換エラー（FFmpegが利用できないかも）: {str(conv_err)}")
-            # 変換失敗した場合は元のファイルをコピー（入出力が別の場合のみ）
-            if temp_file_path != file_path and not os.path.exists(file_path):
-                shutil.copy(temp_file_path, file_path)
-                print(f"元のファイルをコピー: {temp_file_path} -> {file_path}")
-        
-        # 外部音声サービスにもアップロード
-        try:
-            print(f"外部音声合成サービスにアップロード中: {VOICE_SYNTHESIS_URL}/upload")
-            
-            # ファイルを再度読み込んで外部サービスに送信
-            with open(file_path, "rb") as audio_file:
-                upload_files = {
-                    'file': (filename, audio_file, 'audio/wav')
-                }
-                
-                upload_data = {
-                    'filename': agent_id
-                }
-                
-                upload_response = requests.post(
-                    f"{VOICE_SYNTHESIS_URL}/upload",
-                    files=upload_files,
-                    data=upload_data
-                )
-                
-                if upload_response.status_code != 200:
-                    print(f"外部サービスへのアップロード警告: {upload_response.status_code} {upload_response.reason}")
-                    print(f"レスポンス内容: {upload_response.text}")
-                    print(f"アプリケーションは動作を継続します")
-                else:
-                    print(f"外部サービスへのアップロード成功: {upload_response.status_code}")
-                    print(f"レスポンス内容: {upload_response.text}")
-                
-        except Exception as upload_err:
-            # 外部サービスへのアップロードに失敗しても、ローカルには保存されているため処理を続行
-            print(f"外部音声合成サービスへのアップロードエラー（無視して続行）: {str(upload_err)}")
-            
-        # エージェントのカスタム音声フラグを更新
-        db_agent = crud.get_agent(db, agent_id=agent_id)
-        if db_agent:
-            # エージェントのvoice_typeとhas_custom_voiceを更新
-            update_data = {"has_custom_voice": True, "voice_type": "custom"}
-            for key, value in update_data.items():
-                setattr(db_agent, key, value)
-            db.commit()
+            job = voice_conversion.submit(agent_id, temp_file_path, file_path, on_complete=finish_voice_upload)
+        except ConversionQueueFull as queue_err:
+            os.remove(temp_file_path)
+            raise HTTPException(status_code=503, detail=str(queue_err))
         
         return {
-            "message": "音声ファイルのアップロードが完了しました",
+            "message": "音声ファイルを受け付けました。変換完了後に利用可能になります",
             "filename": filename,
-            "agent_id": agent_id
+            "agent_id": agent_id,
+            "job_id": job.job_id,
+            "status": job.status,
+            "status_url": f"/voice/jobs/{job.job_id}"
         }
     
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"ファイルアップロードエラー: {str(e)}")
 
+async def finish_voice_upload(job):
+    """変換完了後に外部サービスへのアップロードとエージェント設定の更新を行う"""
+    agent_id = job.agent_id
+    
+    # 外部音声サービスの全インスタンスにもアップロード（ファイルはストリーミングで送信）
+    for url, upload_response in await tts_registry.custom.upload_reference(agent_id, job.output_path):
+        if isinstance(upload_response, Exception):
+            # 外部サービスへのアップロードに失敗しても、ローカルには保存されているため処理を続行
+            # （合成時に未アップロードのインスタンスへは改めてアップロードされる）
+            print(f"外部音声合成サービスへのアップロードエラー（無視して続行）: {url} {str(upload_response)}")
+        elif upload_response.status_code != 200:
+            print(f"外部サービスへのアップロード警告: {url} {upload_response.status_code} {upload_response.reason_phrase}")
+            print(f"レスポンス内容: {upload_response.text}")
+            print(f"アプリケーションは動作を継続します")
+        else:
+            print(f"外部サービスへのアップロード成功: {url} {upload_response.status_code}")
+            print(f"レスポンス内容: {upload_response.text}")
+    
+    # エージェントのカスタム音声フラグを更新
+    async with AsyncSessionLocal() as db:
+        # エージェントのvoice_typeとhas_custom_voiceを更新
+        await async_crud.update_agent_voice(db, agent_id, has_custom_voice=True, voice_type="custom")
+    await agent_cache.invalidate(agent_id)
+
+@router.get("/jobs/{job_id}")
+async def get_voice_job(job_id: str):
+    """音声変換ジョブの状態を取得"""
+    job = voice_conversion.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="ジョブが見つかりません")
+    return job.to_dict()
+
 @router.post("/synthesize")
 async def synthesize_voice(
     text: str = Form(...),
@@ -196,15 +150,10 @@ async def synthesize_voice(
                 voice_type = "voicevox"
                 
                 # エージェント情報も更新
-                from app.db.database import get_db
-                db = next(get_db())
-                from app.crud import crud
-                
-                db_agent = crud.get_agent(db, agent_id=agent_id)
+                async with AsyncSessionLocal() as db:
+                    db_agent = await async_crud.update_agent_voice(db, agent_id, voice_type="voicevox", has_custom_voice=False)
+                await agent_cache.invalidate(agent_id)
                 if db_agent:
-                    db_agent.voice_type = "voicevox"
-                    db_agent.has_custom_voice = False
-                    db.commit()
                     print(f"エージェント {agent_id} の音声設定をVoiceVoxに更新しました")
         
         # 最終的な音声タイプに基づいて処理
@@ -237,73 +186,39 @@ async def synthesize_custom_voice(text: str, agent_id: str):
         # VoiceVoxでのフォールバックを自動的に適用
         return await synthesize_voicevox(text, agent_id, 1)
     
+    # 同じ参照音声で同じテキストを合成済みならキャッシュを返す
+    cache_key = audio_cache.make_key(text, agent_id, "custom", reference_fingerprint(agent_id))
+    cached_path = audio_cache.lookup(cache_key)
+    if cached_path:
+        cached_filename = os.path.basename(cached_path)
+        audio_lifecycle.register(cached_path, owner=agent_id)
+        print(f"音声キャッシュヒット: {cached_filename}")
+        return {
+            "message": "カスタム音声合成が完了しました",
+            "audio_url": f"/audio/{cached_filename}",
+            "filename": cached_filename
+        }
+    
     try:
         print(f"カスタム音声合成開始: agent_id={agent_id}, reference_audio={reference_audio}")
         
-        # ファイルを再度アップロード処理してから合成を実行（フォーマット問題を解決するため）
+        # 外部音声合成APIを使用して合成（参照音声は変更があった場合のみ再アップロード）
         try:
-            print(f"音声ファイル再アップロード中: {VOICE_SYNTHESIS_URL}/upload")
-            with open(reference_path, "rb") as audio_file:
-                upload_files = {
-                    'file': (reference_audio, audio_file, 'audio/wav')
-                }
-                upload_data = {
-                    'filename': agent_id
-                }
-                
-                upload_response = requests.post(
-                    f"{VOICE_SYNTHESIS_URL}/upload",
-                    files=upload_files,
-                    data=upload_data
+            async def produce():
+                content = await tts_registry.custom.synthesize(
+                    text,
+                    agent_id,
+                    timeout=120  # タイムアウトを120秒（2分）に延長
                 )
                 
-                if upload_response.status_code != 200:
-                    print(f"警告: 音声ファイル再アップロードでエラー: {upload_response.status_code} {upload_response.reason}")
-                    print(f"合成処理を継続します")
-                else:
-                    print(f"音声ファイル再アップロード成功: {upload_response.status_code}")
-        except Exception as reupload_err:
-            print(f"音声ファイル再アップロード中にエラー（無視して続行）: {str(reupload_err)}")
-        
-        # 外部音声合成APIを使用して合成
-        generate_url = f"{VOICE_SYNTHESIS_URL}/generate"
-        print(f"音声生成リクエスト: {generate_url}")
-        
-        # 新しい音声合成リクエスト形式 
-        synthesis_data = {
-            'text': text,
-            'wav_filename': f"{agent_id}.wav",  # 保存済みのエージェントIDを使用
-            'language': 'ja'
-        }
-        
-        print(f"音声合成パラメータ: {synthesis_data}")
-        
-        print(f"音声合成リクエスト送信中: {generate_url}")
-        try:
-            synthesis_response = requests.post(
-                generate_url,
-                data=synthesis_data,
-                timeout=120  # タイムアウトを120秒（2分）に延長
-            )
-            
-            if synthesis_response.status_code != 200:
-                error_detail = f"音声合成リクエストエラー: {synthesis_response.status_code} {synthesis_response.reason}"
-                try:
-                    error_detail += f" {synthesis_response.text}"
-                except:
-                    pass
-                print(f"合成エラー: {error_detail}")
-                
-                # VoiceVoxでのフォールバック処理を試行
-                print("カスタム音声での合成に失敗しました。VoiceVoxでのフォールバックを試行します。")
-                return await synthesize_voicevox(text, agent_id, 1)  # VoiceVoxのデフォルトスピーカーで合成
-            
-            # 合成された音声ファイルを保存
-            output_filename = f"generated_{agent_id}_{uuid.uuid4().hex[:8]}.wav"
-            output_path = os.path.join(AUDIO_DIR, output_filename)
+                # 合成された音声ファイルをキャッシュに保存
+                output_path = await audio_cache.store(cache_key, content)
+                return await transcode_cached(cache_key, output_path)
             
-            with open(output_path, 'wb') as f:
-                f.write(synthesis_response.content)
+            # 同じ参照音声・テキストの合成が実行中の場合はその結果を共有する
+            output_path = await synthesis_flight.do(("voice", cache_key), produce)
+            output_filename = os.path.basename(output_path)
+            audio_lifecycle.register(output_path, owner=agent_id)
             
             print(f"音声合成完了: {output_filename}")
             return {
@@ -311,8 +226,16 @@ async def synthesize_custom_voice(text: str, agent_id: str):
                 "audio_url": f"/audio/{output_filename}",
                 "filename": output_filename
             }
+        
+        except (TTSError, CircuitOpenError) as synthesis_err:
+            # サーキットが開いている場合は待たずにすぐVoiceVoxへ切り替える
+            print(f"合成エラー: 音声合成リクエストエラー: {str(synthesis_err)}")
             
-        except requests.RequestException as req_err:
+            # VoiceVoxでのフォールバック処理を試行
+            print("カスタム音声での合成に失敗しました。VoiceVoxでのフォールバックを試行します。")
+            return await synthesize_voicevox(text, agent_id, 1)  # VoiceVoxのデフォルトスピーカーで合成
+            
+        except httpx.HTTPError as req_err:
             print(f"音声合成API接続エラー: {str(req_err)}")
             # VoiceVoxでのフォールバック処理を試行
             print("カスタム音声での合成に失敗しました。VoiceVoxでのフォールバックを試行します。")
@@ -325,13 +248,14 @@ async def synthesize_custom_voice(text: str, agent_id: str):
                 with open(empty_audio_path, 'wb') as f:
                     # 最小限のWAVヘッダーを書き込む（無音の短いファイル）
                     f.write(b'RIFF\x1c\x00\x00\x00WAVEfmt \x10\x00\x00\x00\x01\x00\x01\x00\x44\xac\x00\x00\x88\x58\x01\x00\x02\x00\x10\x00data\x00\x00\x00\x00')
+                audio_lifecycle.register(empty_audio_path, owner=agent_id)
                 return {
                     "message": "音声合成は失敗しましたが、テキスト応答は利用可能です",
                     "audio_url": f"/audio/{os.path.basename(empty_audio_path)}",
                     "filename": os.path.basename(empty_audio_path)
                 }
     
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         error_message = f"音声合成サービスとの通信エラー: {str(e)}"
         print(f"リクエストエラー: {error_message}")
         raise HTTPException(status_code=500, detail=error_message)
@@ -339,72 +263,48 @@ async def synthesize_custom_voice(text: str, agent_id: str):
 async def synthesize_voicevox(text: str, agent_id: str, speaker_id_param: int = None):
     """VoiceVoxによる音声合成"""
     try:
-        # エージェントのスピーカーIDを取得
-        from app.db.database import get_db
-        db = next(get_db())
-        from app.crud import crud
-        
-        db_agent = crud.get_agent(db, agent_id=agent_id)
-        speaker_id = 1  # デフォルト値
-        
-        print(f"Agent for voice synthesis: {db_agent.name if db_agent else 'Not found'}")
         print(f"Requested speaker_id from param: {speaker_id_param}")
         
-        if db_agent:
-            print(f"Agent voice_speaker_id: {db_agent.voice_speaker_id}")
-            print(f"Agent voice_speaker_id type: {type(db_agent.voice_speaker_id)}")
-        
-        # パラメータとして渡されたspeaker_idがあれば優先して使用
+        # パラメータとして渡されたspeaker_idがあれば優先して使用（DBは引かない）
         if speaker_id_param is not None:
             speaker_id = speaker_id_param
             print(f"Using provided speaker_id: {speaker_id}")
-        # エージェントのスピーカーIDがあればそれを使用
-        elif db_agent and db_agent.voice_speaker_id:
-            # speaker_idが文字列の場合は整数に変換
-            if isinstance(db_agent.voice_speaker_id, str):
-                try:
-                    speaker_id = int(db_agent.voice_speaker_id)
-                    print(f"Converted string speaker_id '{db_agent.voice_speaker_id}' to int: {speaker_id}")
-                except ValueError:
-                    print(f"Failed to convert speaker_id '{db_agent.voice_speaker_id}' to int, using default")
-            else:
-                speaker_id = db_agent.voice_speaker_id
+        else:
+            # エージェントのスピーカーIDを取得
+            async with AsyncSessionLocal() as db:
+                db_agent = await agent_cache.get(db, agent_id)
+            print(f"Agent for voice synthesis: {db_agent.name if db_agent else 'Not found'}")
+            speaker_id = VoiceSettings.from_agent(db_agent).speaker_id
             
         print(f"Using speaker_id: {speaker_id} (type: {type(speaker_id)}) for voice synthesis")
         
-        # VoiceVoxのAPIエンドポイント（ローカル）
-        voicevox_url = "http://localhost:50021"
-        
-        # 音声クエリを作成
-        query_url = f"{voicevox_url}/audio_query"
-        query_params = {'text': text, 'speaker': speaker_id}
-        print(f"Calling audio_query API: {query_url} with params: {query_params}")
-        
-        audio_query_response = requests.post(
-            query_url,
-            params=query_params
-        )
-        audio_query_response.raise_for_status()
-        audio_query = audio_query_response.json()
-        
-        # 音声合成を実行
-        synthesis_url = f"{voicevox_url}/synthesis"
-        synthesis_params = {'speaker': speaker_id}
-        print(f"Calling synthesis API: {synthesis_url} with params: {synthesis_params}")
-        
-        synthesis_response = requests.post(
-            synthesis_url,
-            params=synthesis_params,
-            json=audio_query
-        )
-        synthesis_response.raise_for_status()
+        # 同じスピーカーで同じテキストを合成済みならキャッシュを返す
+        cache_key = audio_cache.make_key(text, speaker_id, "voicevox")
+        cached_path = audio_cache.lookup(cache_key)
+        if cached_path:
+            cached_filename = os.path.basename(cached_path)
+            # VoiceVoxのキャッシュはエージェント間で共有するため所有者を付けない
+            audio_lifecycle.register(cached_path)
+            print(f"音声キャッシュヒット: {cached_filename}")
+            return {
+                "message": "VoiceVox音声合成が完了しました",
+                "audio_url": f"/audio/{cached_filename}",
+                "filename": cached_filename
+            }
         
-        # 合成された音声ファイルを保存
-        output_filename = f"voicevox_{agent_id}_{uuid.uuid4().hex[:8]}.wav"
-        output_path = os.path.join(AUDIO_DIR, output_filename)
+        async def produce():
+            # VoiceVoxバックエンドのインスタンスに振り分けて合成
+            print(f"Calling VoiceVox backend with speaker: {speaker_id}")
+            content = await tts_registry.voicevox.synthesize(text, speaker_id)
+            
+            # 合成された音声ファイルをキャッシュに保存
+            output_path = await audio_cache.store(cache_key, content)
+            return await transcode_cached(cache_key, output_path)
         
-        with open(output_path, 'wb') as f:
-            f.write(synthesis_response.content)
+        # 同じスピーカー・テキストの合成が実行中の場合はその結果を共有する
+        output_path = await synthesis_flight.do(("voice", cache_key), produce)
+        output_filename = os.path.basename(output_path)
+        audio_lifecycle.register(output_path)
         
         return {
             "message": "VoiceVox音声合成が完了しました",
@@ -412,19 +312,19 @@ async def synthesize_voicevox(text: str, agent_id: str, speaker_id_param: int =
             "filename": output_filename
         }
     
-    except requests.exceptions.RequestException as e:
+    except (httpx.HTTPError, TTSError, CircuitOpenError) as e:
         # VoiceVoxが利用できない場合はエラー
         raise HTTPException(status_code=503, detail=f"VoiceVoxサービスが利用できません: {str(e)}")
 
 @router.get("/file/{filename}")
-async def get_voice_file(filename: str):
-    """音声ファイルを取得"""
-    file_path = os.path.join(AUDIO_DIR, filename)
-    
-    if not os.path.exists(file_path):
+async def get_voice_file(filename: str, request: Request):
+    """音声ファイルを取得（Range・ETag に対応し、合成中のWAVは書き込まれた分から順に返す）"""
+    response = audio_response(request, filename, AUDIO_DIR)
+    if response is None:
         raise HTTPException(status_code=404, detail="音声ファイルが見つかりません")
     
-    return FileResponse(file_path, media_type="audio/wav")
+    audio_lifecycle.touch(filename)
+    return response
 
 @router.delete("/{agent_id}")
 async def delete_voice_files(agent_id: str):
@@ -432,22 +332,24 @@ async def delete_voice_files(agent_id: str):
     try:
         deleted_files = []
         
-        # エージェントIDで始まる音声ファイルを削除
-        for file in os.listdir(AUDIO_DIR):
-            if file.startswith(agent_id):
-                file_path = os.path.join(AUDIO_DIR, file)
+        # 参照音声と変換待ちの一時ファイルを削除（ディレクトリ全体は走査しない）
+        candidates = [f"{agent_id}.wav"] + [os.path.basename(path) for path in voice_conversion.pending_sources(agent_id)]
+        for file in candidates:
+            file_path = os.path.join(AUDIO_DIR, file)
+            if os.path.exists(file_path):
                 os.remove(file_path)
                 deleted_files.append(file)
+        
+        # インデックスからエージェントが生成した音声ファイルを削除
+        custom_voice.forget(agent_id)
+        owned_files = audio_lifecycle.files_for_agent(agent_id)
+        await audio_lifecycle.delete_files(owned_files)
+        deleted_files.extend(owned_files)
                 
         # カスタム音声フラグを更新
-        from app.db.database import get_db
-        db = next(get_db())
-        from app.crud import crud
-        
-        db_agent = crud.get_agent(db, agent_id=agent_id)
-        if db_agent:
-            db_agent.has_custom_voice = False
-            db.commit()
+        async with AsyncSessionLocal() as db:
+            await async_crud.update_agent_voice(db, agent_id, has_custom_voice=False)
+        await agent_cache.invalidate(agent_id)
         
         return {
             "message": "音声ファイルが正常に削除されました",
@@ -459,29 +361,22 @@ async def delete_voice_files(agent_id: str):
 
 @router.get("/voicevox/speakers")
 async def get_voicevox_speakers():
-    """VoiceVoxの利用可能なスピーカー一覧を取得"""
-    try:
-        # VoiceVoxのAPIエンドポイント（ローカル）
-        voicevox_url = "http://localhost:50021"
-        
-        # スピーカー一覧を取得
-        response = requests.get(f"{voicevox_url}/speakers")
-        response.raise_for_status()
-        
+    """VoiceVoxの利用可能なスピーカー一覧を取得（起動時に取得してキャッシュした一覧を返す）"""
+    speakers = await speaker_catalog.get()
+    if speakers is not None:
         return {
-            "speakers": response.json()
+            "speakers": speakers
         }
     
-    except requests.exceptions.RequestException as e:
-        # VoiceVoxが利用できない場合はモック応答を返す
-        mock_speakers = [
-            {"id": 1, "name": "四国めたん", "styles": [{"id": 2, "name": "ノーマル"}]},
-            {"id": 2, "name": "ずんだもん", "styles": [{"id": 3, "name": "ノーマル"}]},
-            {"id": 3, "name": "春日部つむぎ", "styles": [{"id": 8, "name": "ノーマル"}]},
-            {"id": 8, "name": "波音リツ", "styles": [{"id": 9, "name": "ノーマル"}]},
-            {"id": 10, "name": "玄野武宏", "styles": [{"id": 11, "name": "ノーマル"}]},
-        ]
-        return {
-            "speakers": mock_speakers,
-            "info": "VoiceVoxサービスが利用できないため、モックデータを表示しています"
-        }
+    # VoiceVoxが利用できない場合はモック応答を返す
+    mock_speakers = [
+        {"id": 1, "name": "四国めたん", "styles": [{"id": 2, "name": "ノーマル"}]},
+        {"id": 2, "name": "ずんだもん", "styles": [{"id": 3, "name": "ノーマル"}]},
+        {"id": 3, "name": "春日部つむぎ", "styles": [{"id": 8, "name": "ノーマル"}]},
+        {"id": 8, "name": "波音リツ", "styles": [{"id": 9, "name": "ノーマル"}]},
+        {"id": 10, "name": "玄野武宏", "styles": [{"id": 11, "name": "ノーマル"}]},
+    ]
+    return {
+        "speakers": mock_speakers,
+        "info": "VoiceVoxサービスが利用できないため、モックデータを表示しています"
+    }
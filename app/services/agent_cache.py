@@ -0,0 +1,161 @@
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from typing import Optional
+from dotenv import load_dotenv
+from app.crud import async_crud
+
+# 環境変数の読み込み
+load_dotenv()
+
+AGENT_CACHE_TTL = float(os.getenv("AGENT_CACHE_TTL", "300"))
+AGENT_CACHE_MAX_ENTRIES = int(os.getenv("AGENT_CACHE_MAX_ENTRIES", "1000"))
+
+def build_system_prompt(agent):
+    """エージェントの性格と口調からシステムプロンプトを作成する"""
+    system_prompt = f"あなたは{agent.personality1}"
+    if agent.personality2:
+        system_prompt += f"かつ{agent.personality2}"
+    system_prompt += f"なAIです。{agent.tone}な口調で話してください。"
+    return system_prompt
+
+@dataclass(frozen=True)
+class AgentSnapshot:
+    """
+    キャッシュに載せるエージェントの読み取り専用コピー
+    セッションに紐づかないため、リクエストをまたいで共有できる
+    """
+    agent_id: str
+    user_id: Optional[str]
+    name: str
+    tone: str
+    personality1: str
+    personality2: Optional[str]
+    voice_type: Optional[str]
+    has_custom_voice: int
+    voice_speaker_id: Optional[int]
+    system_prompt: str
+
+    @classmethod
+    def from_agent(cls, agent):
+        return cls(
+            agent_id=agent.agent_id,
+            user_id=agent.user_id,
+            name=agent.name,
+            tone=agent.tone,
+            personality1=agent.personality1,
+            personality2=agent.personality2,
+            voice_type=agent.voice_type,
+            has_custom_voice=agent.has_custom_voice,
+            voice_speaker_id=agent.voice_speaker_id,
+            system_prompt=build_system_prompt(agent),
+        )
+
+    def to_dict(self):
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+class CacheBackend(ABC):
+    """
+    エージェントキャッシュの保存先インターフェース
+    複数ワーカーで共有する場合はプロセス外のストア（Redisなど）で実装する
+    値は AgentSnapshot.to_dict() の辞書
+    """
+
+    @abstractmethod
+    async def get(self, key):
+        ...
+
+    @abstractmethod
+    async def set(self, key, value):
+        ...
+
+    @abstractmethod
+    async def delete(self, key):
+        ...
+
+    def stats(self):
+        return {}
+
+class InMemoryCacheBackend(CacheBackend):
+    """プロセス内の TTL + LRU キャッシュ"""
+
+    def __init__(self, ttl=AGENT_CACHE_TTL, max_entries=AGENT_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (有効期限, 値)
+
+    async def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            self._entries.pop(key, None)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def delete(self, key):
+        self._entries.pop(key, None)
+
+    def stats(self):
+        return {"entries": len(self._entries), "ttl": self.ttl, "max_entries": self.max_entries}
+
+class AgentCache:
+    """
+    crud.get_agent の前段に置くエージェントとシステムプロンプトのキャッシュ
+    エージェントを更新・削除する処理から invalidate を呼んで整合性を保つ（ライトスルー無効化）
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or InMemoryCacheBackend()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _key(agent_id):
+        return f"agent:{agent_id}"
+
+    async def get(self, db, agent_id):
+        """キャッシュからエージェントを取得する（なければDBから読み込んで保存）"""
+        data = await self.backend.get(self._key(agent_id))
+        if data is not None:
+            self.hits += 1
+            return AgentSnapshot.from_dict(data)
+        self.misses += 1
+        agent = await async_crud.get_agent(db, agent_id=agent_id)
+        if agent is None:
+            return None
+        snapshot = AgentSnapshot.from_agent(agent)
+        await self.backend.set(self._key(agent_id), snapshot.to_dict())
+        return snapshot
+
+    async def invalidate(self, agent_id):
+        self.invalidations += 1
+        await self.backend.delete(self._key(agent_id))
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": self.hits / total if total else 0.0,
+            **self.backend.stats(),
+        }
+
+# アプリケーション全体で共有するキャッシュ
+agent_cache = AgentCache()
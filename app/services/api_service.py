@@ -1,40 +1,67 @@
 import os
 import json
+import base64
+import hashlib
 import httpx
 from dotenv import load_dotenv
-import base64
 import uuid
+import asyncio
 import aiofiles
 from fastapi import HTTPException
+from app.services import http_clients
+from app.services.tts_backends import tts_registry, TTSError
+from app.services.circuit_breaker import get_breaker, CircuitOpenError
+from app.services.text_segmenter import pop_sentences, split_sentences, group_sentences
+from app.services.wav_utils import concat_wav
+from app.services.audio_cache import audio_cache, normalize_text
+from app.services.audio_writes import audio_writes
+from app.services.single_flight import audio_query_flight, synthesis_flight
+from app.services.voice_settings import VoiceSettings
+from app.services.audio_lifecycle import audio_lifecycle
+from app.services.transcoder import transcode, transcode_cached, concat_encoded, output_extension
 
 # 環境変数の読み込み
 load_dotenv()
 
 # APIエンドポイント
+# VoiceVox とカスタム音声合成のURLは tts_backends で管理する
 CHAT_API_URL = os.getenv("CHAT_API_URL")
-AUDIO_QUERY_API_URL = os.getenv("AUDIO_QUERY_API_URL")
-SYNTHESIS_API_URL = os.getenv("SYNTHESIS_API_URL")
 
 # 音声ファイル保存用のディレクトリ
 AUDIO_DIR = "audio_files"
 os.makedirs(AUDIO_DIR, exist_ok=True)
 
+# 複数文の応答を文ごとに並行して合成する際の同時実行数の上限（全リクエスト共通）
+TTS_SEGMENT_CONCURRENCY = int(os.getenv("TTS_SEGMENT_CONCURRENCY", "4"))
+# これより短い文は次の文とまとめて合成する
+TTS_SEGMENT_MIN_CHARS = int(os.getenv("TTS_SEGMENT_MIN_CHARS", "8"))
+
+_segment_semaphore = None
+
+def _get_segment_semaphore():
+    global _segment_semaphore
+    if _segment_semaphore is None:
+        _segment_semaphore = asyncio.Semaphore(TTS_SEGMENT_CONCURRENCY)
+    return _segment_semaphore
+
 async def create_chat_response(messages):
     """
     チャットAPIを呼び出して応答を取得する
     """
     try:
-        async with httpx.AsyncClient() as client:
-            payload = {
-                "model": "elyza:jp8b",
-                "messages": messages,
-                "stream": False
-            }
-            headers = {
-                "Content-Type": "application/json",
-                "Expect": ""
-            }
-            
+        client = http_clients.get_client(http_clients.LLM)
+        payload = {
+            "model": "elyza:jp8b",
+            "messages": messages,
+            "stream": False
+        }
+        headers = {
+            "Content-Type": "application/json",
+            "Expect": ""
+        }
+        
+        # LLMが障害中（サーキットが開いている）の場合は待たずに失敗する
+        async with get_breaker(http_clients.LLM).guard():
             response = await client.post(
                 CHAT_API_URL, 
                 json=payload, 
@@ -44,192 +71,467 @@ async def create_chat_response(messages):
             
             if response.status_code != 200:
                 raise HTTPException(status_code=response.status_code, detail=f"Chat API error: {response.text}")
-                
-            return response.json()
             
+        return response.json()
+    
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=f"チャットAPIが一時的に利用できません: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to call chat API: {str(e)}")
 
-async def create_audio_query(text, speaker):
+async def stream_chat_response(messages):
     """
-    テキストから音声クエリを生成する
+    チャットAPIをストリーミングモードで呼び出し、テキストの差分を順に返す
     """
-    print(f"Creating audio query with speaker ID: {speaker}")
+    client = http_clients.get_client(http_clients.LLM)
+    payload = {
+        "model": "elyza:jp8b",
+        "messages": messages,
+        "stream": True
+    }
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{AUDIO_QUERY_API_URL}?text={text}&speaker={speaker}",
-                headers={"accept": "application/json"},
-                timeout=60.0  # 音声クエリAPIのタイムアウトを延長（1分）
-            )
-            
+        async with get_breaker(http_clients.LLM).guard(), client.stream(
+            "POST",
+            CHAT_API_URL,
+            json=payload,
+            headers={"Content-Type": "application/json", "Expect": ""},
+            timeout=120.0
+        ) as response:
             if response.status_code != 200:
-                raise HTTPException(status_code=response.status_code, detail=f"Audio query API error: {response.text}")
-                
-            return response.json()
+                body = await response.aread()
+                raise HTTPException(status_code=response.status_code, detail=f"Chat API error: {body.decode(errors='replace')}")
             
+            # Ollama形式: 1行ごとにJSONオブジェクトが届く
+            async for line in response.aiter_lines():
+                if not line.strip():
+                    continue
+                chunk = json.loads(line)
+                delta = chunk.get("message", {}).get("content", "")
+                if delta:
+                    yield delta
+                if chunk.get("done"):
+                    break
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=f"チャットAPIが一時的に利用できません: {str(e)}")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to call chat API: {str(e)}")
+
+async def create_audio_query(text, speaker):
+    """
+    テキストから音声クエリを生成する（VoiceVoxバックエンドのインスタンスに振り分ける）
+    同じテキスト・スピーカーの生成が実行中の場合はその結果を共有する
+    """
+    key = (normalize_text(text), str(speaker))
+    return await audio_query_flight.do(key, lambda: _create_audio_query(text, speaker))
+
+async def _create_audio_query(text, speaker):
+    print(f"Creating audio query with speaker ID: {speaker}")
+    try:
+        return await tts_registry.voicevox.audio_query(text, speaker, timeout=60.0)  # 音声クエリAPIのタイムアウトを延長（1分）
+    except TTSError as e:
+        raise HTTPException(status_code=e.status_code or 500, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to call audio query API: {str(e)}")
 
-async def synthesize_speech(audio_query, speaker=1):
+async def synthesize_speech(audio_query, speaker=1, cache_key=None):
     """
     音声クエリから音声を合成する
+    cache_key が指定された場合は音声キャッシュに保存する
+    同じ内容の合成が実行中の場合はその結果を共有する
     """
+    if cache_key:
+        key = ("voicevox", cache_key)
+    else:
+        query_digest = hashlib.sha256(json.dumps(audio_query, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+        key = ("voicevox", query_digest, str(speaker))
+    # 呼び出し元で結果の辞書に書き足すため、共有の結果はコピーして返す
+    return dict(await synthesis_flight.do(key, lambda: _synthesize_speech(audio_query, speaker, cache_key)))
+
+async def _synthesize_speech(audio_query, speaker, cache_key):
     try:
         print(f"Synthesizing speech with speaker_id: {speaker}")
-        async with httpx.AsyncClient() as client:
-            synthesis_url = f"{SYNTHESIS_API_URL}?speaker={speaker}&enable_interrogative_upspeak=true"
-            print(f"Calling synthesis API: {synthesis_url}")
-            
-            response = await client.post(
-                synthesis_url,
-                headers={
-                    "accept": "audio/wav",
-                    "Content-Type": "application/json"
-                },
-                json=audio_query,
-                timeout=60.0  # 音声合成APIのタイムアウトを延長（1分）
+        # 音声ファイルを保存
+        if cache_key:
+            # 受信しながら書き込み、書き込み中のファイルも配信できるようにする
+            filepath = await audio_cache.store_stream(
+                cache_key,
+                tts_registry.voicevox.synthesis_stream(audio_query, speaker, timeout=60.0)  # 音声合成APIのタイムアウトを延長（1分）
             )
-            
-            if response.status_code != 200:
-                raise HTTPException(status_code=response.status_code, detail=f"Synthesis API error: {response.text}")
-            
-            # 音声ファイルを保存
-            filename = f"{uuid.uuid4()}.wav"
+        else:
+            content = await tts_registry.voicevox.synthesis(audio_query, speaker, timeout=60.0)
+            filename = f"speech_{uuid.uuid4()}.wav"
             filepath = f"{AUDIO_DIR}/{filename}"
             
             async with aiofiles.open(filepath, 'wb') as f:
-                await f.write(response.content)
-            
-            # Base64エンコードされた音声データを返す
-            audio_data_base64 = base64.b64encode(response.content).decode('utf-8')
-            
-            return {
-                "filepath": filepath,
-                "audio_data": audio_data_base64
-            }
-            
+                await f.write(content)
+        
+        # 音声データはファイルとして参照する（インライン化は呼び出し側で必要な場合のみ行う）
+        return {
+            "filepath": filepath
+        }
+    
+    except TTSError as e:
+        raise HTTPException(status_code=e.status_code or 500, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to call synthesis API: {str(e)}")
 
-async def process_chat_and_voice(messages, user_id=None, agent_id=None):
+async def synthesize_custom_speech(text, agent_id, cache_key=None):
     """
-    チャット応答を生成し、それを音声に変換する
+    カスタム音声合成サービスでエージェントの参照音声を使って合成する
+    cache_key が指定された場合は音声キャッシュに保存し、同じキーの合成が実行中ならその結果を共有する
     """
-    # チャット応答を生成
-    chat_response = await create_chat_response(messages)
+    if cache_key:
+        return dict(await synthesis_flight.do(("custom", cache_key), lambda: _synthesize_custom_speech(text, agent_id, cache_key)))
+    return await _synthesize_custom_speech(text, agent_id, cache_key)
+
+async def _synthesize_custom_speech(text, agent_id, cache_key):
+    try:
+        content = await tts_registry.custom.synthesize(
+            text,
+            agent_id,
+            timeout=120.0  # カスタム音声合成のタイムアウトを延長（2分）
+        )
+        
+        # 音声ファイルを保存
+        if cache_key:
+            filepath = await audio_cache.store(cache_key, content)
+        else:
+            filepath = os.path.join(AUDIO_DIR, f"generated_{agent_id}_{uuid.uuid4().hex[:8]}.wav")
+            
+            async with aiofiles.open(filepath, 'wb') as f:
+                await f.write(content)
+        output_filename = os.path.basename(filepath)
+        
+        print(f"音声合成完了: {output_filename}")
+        print(f"カスタム音声合成成功: {filepath}")
+        return {
+            "filepath": filepath
+        }
+    except TTSError as synthesis_err:
+        print(f"カスタム音声合成エラー: {str(synthesis_err)}")
+        raise Exception(str(synthesis_err))
+    except httpx.TimeoutException as timeout_err:
+        print(f"音声合成API接続エラー: {str(timeout_err)}")
+        raise Exception(f"音声合成タイムアウト: {str(timeout_err)}")
+    except Exception as req_err:
+        print(f"リクエスト例外: {str(req_err)}")
+        raise Exception(f"リクエスト例外: {str(req_err)}")
+
+async def encode_audio_base64(filepath):
+    """
+    音声ファイルをBase64文字列にする（response_mode=inline の場合のみ使用）
+    """
+    async with aiofiles.open(filepath, 'rb') as f:
+        content = await f.read()
+    return base64.b64encode(content).decode('utf-8')
+
+async def load_cached_audio(cache_key):
+    """
+    音声キャッシュにヒットした場合は合成結果と同じ形式で返す（なければ None）
+    """
+    filepath = audio_cache.lookup(cache_key)
+    if filepath is None:
+        return None
+    print(f"音声キャッシュヒット: {filepath}")
+    return {
+        "filepath": filepath,
+        "cache_key": cache_key
+    }
+
+async def synthesize_text(text, voice_settings=None):
+    """
+    テキストを音声に変換する
+    複数の文からなる場合は文ごとに並行して合成し、順番どおりに1つのWAVへ連結する
+    カスタム音声 → VoiceVox の順に試し、すべて失敗した場合は None を返す
+    戻り値の segments は文ごとの音声ファイル（1文の場合は空）
+    """
+    voice_settings = voice_settings or VoiceSettings()
+    sentences = group_sentences(split_sentences(text), TTS_SEGMENT_MIN_CHARS)
+    if len(sentences) > 1:
+        audio_result = await _synthesize_segments(text, sentences, voice_settings)
+    else:
+        audio_result = await _synthesize_text(text, voice_settings)
+    if audio_result is None:
+        return None
     
-    # レスポンスのテキスト部分を取得
-    response_text = chat_response.get("message", {}).get("content", "")
-    if not response_text:
-        raise HTTPException(status_code=500, detail="No response text received from chat API")
+    # 連結が終わってから変換する（変換後は元のWAVが削除されるため）
+    segments = audio_result.pop("segments", None) or []
+    converted = await asyncio.gather(
+        _finalize_audio(audio_result, voice_settings),
+        *(_finalize_audio(segment, voice_settings) for segment in segments)
+    )
+    audio_result["filepath"] = converted[0]
+    audio_result["segments"] = list(converted[1:])
+    return audio_result
+
+async def synthesize_text_streaming(text, voice_settings, on_audio_start):
+    """
+    synthesize_text と同じく合成し、文ごとのVoiceVoxのWAVの書き込みが始まった時点で
+    await on_audio_start(index, filename) を呼ぶ（index は文の番号）
+    書き込み中のファイルは /chat/audio/{filename} から書き込まれた分を受け取れる
+    """
+    voice_settings = voice_settings or VoiceSettings()
+    sentences = group_sentences(split_sentences(text), TTS_SEGMENT_MIN_CHARS) or [text]
     
-    # エージェントの音声タイプとスピーカーIDを取得
-    speaker_id = 1  # デフォルト値
-    voice_type = "voicevox"  # デフォルト値
-    use_custom_voice = False
-    
-    if agent_id:
-        from app.db.database import get_db
-        from app.crud import crud
-        db = next(get_db())
-        db_agent = crud.get_agent(db, agent_id=agent_id)
-        if db_agent:
-            # 音声タイプとカスタム音声設定を取得
-            if db_agent.voice_speaker_id:
-                speaker_id = db_agent.voice_speaker_id
-            if db_agent.voice_type:
-                voice_type = db_agent.voice_type
-            if db_agent.has_custom_voice:
-                use_custom_voice = bool(db_agent.has_custom_voice)
-            
-            print(f"Agent voice settings: type={voice_type}, custom={use_custom_voice}, speaker_id={speaker_id}")
+    async def watch(index, sentence):
+        # カスタム音声からVoiceVoxにフォールバックした場合も書き込みは同じ名前になる
+        cache_key = dict(_engine_keys(sentence, voice_settings))["voicevox"]
+        write = await audio_writes.wait_started(audio_cache.filename_for(cache_key))
+        await on_audio_start(index, write.filename)
+    
+    watchers = [asyncio.create_task(watch(index, sentence)) for index, sentence in enumerate(sentences)]
+    try:
+        return await synthesize_text(text, voice_settings)
+    finally:
+        # キャッシュにヒットした文は書き込みが始まらないため、合成が終わったら待つのをやめる
+        for watcher in watchers:
+            watcher.cancel()
+        await asyncio.gather(*watchers, return_exceptions=True)
+
+async def _finalize_audio(audio_result, voice_settings):
+    """設定された出力形式に変換し、ライフサイクル管理に登録したファイルパスを返す"""
+    # イベントループをブロックしないffmpegワーカーで実行
+    cache_key = audio_result.get("cache_key")
+    if cache_key:
+        filepath = await transcode_cached(cache_key, audio_result["filepath"])
+    else:
+        filepath = await transcode(audio_result["filepath"])
+    # 生成・再利用したファイルをライフサイクル管理に登録
+    # VoiceVoxのキャッシュはエージェント間で共有するため、エージェント固有のファイルだけ所有者を付ける
+    shared = cache_key and audio_result.get("engine") != "custom"
+    audio_lifecycle.register(filepath, owner=None if shared else voice_settings.agent_id)
+    return filepath
+
+def _engine_keys(text, voice_settings):
+    """試す順にエンジン名と音声キャッシュのキーを返す"""
+    keys = []
+    if voice_settings.wants_custom_voice:
+        keys.append(("custom", audio_cache.make_key(text, voice_settings.agent_id, "custom", voice_settings.reference_fingerprint)))
+    keys.append(("voicevox", audio_cache.make_key(text, voice_settings.speaker_id, "voicevox")))
+    return keys
+
+async def _synthesize_segments(text, sentences, voice_settings):
+    """
+    文ごとに並行して合成し、PCMのデータ部をそのまま順番に連結する（デコードしない）
+    変換済みのキャッシュを含む場合は出力形式のまま連結する
+    """
+    # 全文の音声がキャッシュ済みなら文ごとの合成は不要
+    for engine, cache_key in _engine_keys(text, voice_settings):
+        cached = await load_cached_audio(cache_key)
+        if cached:
+            cached["engine"] = engine
+            # 文ごとの音声もキャッシュに残っていれば合わせて返す
+            segment_keys = [dict(_engine_keys(sentence, voice_settings))[engine] for sentence in sentences]
+            segment_paths = [audio_cache.peek(segment_key) for segment_key in segment_keys]
+            if all(segment_paths):
+                cached["segments"] = [
+                    {"filepath": path, "cache_key": segment_key, "engine": engine}
+                    for path, segment_key in zip(segment_paths, segment_keys)
+                ]
+            return cached
+    
+    semaphore = _get_segment_semaphore()
     
-    # カスタム音声を使用するか判断
-    audio_result = None
-    if voice_type == "custom" and use_custom_voice:
+    async def synthesize_segment(sentence):
+        async with semaphore:
+            return await _synthesize_text(sentence, voice_settings)
+    
+    print(f"{len(sentences)}文を並行して音声合成します")
+    segments = await asyncio.gather(*(synthesize_segment(sentence) for sentence in sentences))
+    if any(segment is None for segment in segments):
+        print("一部の文の音声合成に失敗したため、全文をまとめて合成します")
+        return await _synthesize_text(text, voice_settings)
+    
+    # 文ごとに別のエンジンにフォールバックした場合は、連結結果をキャッシュしない
+    engines = {segment["engine"] for segment in segments}
+    engine = engines.pop() if len(engines) == 1 else None
+    cache_key = dict(_engine_keys(text, voice_settings)).get(engine) if engine else None
+    if all(segment["filepath"].endswith(".wav") for segment in segments):
+        extension = ".wav"
+    else:
+        # 変換済みのキャッシュが混ざる場合は、残りの文も出力形式に変換してから連結する
+        extension = output_extension()
+        encoded = await asyncio.gather(*(_transcode_segment(segment) for segment in segments))
+        for segment, filepath in zip(segments, encoded):
+            segment["filepath"] = filepath
+    if cache_key:
+        output_path = audio_cache.path_for(cache_key, extension)
+    else:
+        output_path = os.path.join(AUDIO_DIR, f"speech_{uuid.uuid4()}{extension}")
+    try:
+        if extension == ".wav":
+            await asyncio.to_thread(concat_wav, [segment["filepath"] for segment in segments], output_path)
+        else:
+            await concat_encoded([segment["filepath"] for segment in segments], output_path)
+    except Exception as e:
+        # 形式が揃わない（別エンジン・変換の失敗など）場合は全文をまとめて合成する
+        print(f"音声の連結に失敗したため、全文をまとめて合成します: {str(e)}")
+        return await _synthesize_text(text, voice_settings)
+    if cache_key:
+        audio_cache.replace(cache_key, output_path)
+    return {
+        "filepath": output_path,
+        "cache_key": cache_key,
+        "engine": engine,
+        "segments": segments
+    }
+
+async def _transcode_segment(segment):
+    if segment.get("cache_key"):
+        return await transcode_cached(segment["cache_key"], segment["filepath"])
+    return await transcode(segment["filepath"])
+
+async def _synthesize_text(text, voice_settings):
+    agent_id = voice_settings.agent_id
+    speaker_id = voice_settings.speaker_id
+    engine_keys = dict(_engine_keys(text, voice_settings))
+    if "custom" in engine_keys:
         print(f"カスタム音声合成を使用: agent_id={agent_id}")
+        cache_key = engine_keys["custom"]
+        cached = await load_cached_audio(cache_key)
+        if cached:
+            cached["engine"] = "custom"
+            return cached
         try:
-            # 外部音声合成サービスを呼び出す
-            import uuid
-            import aiofiles
-            import base64
-            import asyncio
-            
-            AUDIO_DIR = "audio_files"
-            VOICE_SYNTHESIS_URL = os.getenv("CUSTOM_VOICE_API_URL", "http://localhost:8000")
-            
-            # カスタム音声合成リクエスト
-            synthesis_data = {
-                'text': response_text,
-                'wav_filename': f"{agent_id}.wav",
-                'language': 'ja'
-            }
-            
-            generate_url = f"{VOICE_SYNTHESIS_URL}/generate"
-            print(f"カスタム音声合成リクエスト: {generate_url}")
-            print(f"音声合成パラメータ: {synthesis_data}")
-            
-            # 非同期HTTPクライアントを使用
-            async with httpx.AsyncClient() as client:
-                try:
-                    print(f"音声合成リクエスト送信中: {generate_url}")
-                    synthesis_response = await client.post(
-                        generate_url,
-                        data=synthesis_data,
-                        timeout=120.0  # カスタム音声合成のタイムアウトを延長（2分）
-                    )
-                    
-                    if synthesis_response.status_code == 200:
-                        # 音声ファイルを保存
-                        output_filename = f"generated_{agent_id}_{uuid.uuid4().hex[:8]}.wav"
-                        filepath = os.path.join(AUDIO_DIR, output_filename)
-                        
-                        async with aiofiles.open(filepath, 'wb') as f:
-                            await f.write(synthesis_response.content)
-                        
-                        # Base64エンコードされた音声データを返す
-                        audio_data_base64 = base64.b64encode(synthesis_response.content).decode('utf-8')
-                        
-                        audio_result = {
-                            "filepath": filepath,
-                            "audio_data": audio_data_base64
-                        }
-                        print(f"音声合成完了: {output_filename}")
-                        print(f"カスタム音声合成成功: {filepath}")
-                    else:
-                        print(f"カスタム音声合成エラー: {synthesis_response.status_code}")
-                        raise Exception(f"カスタム音声合成エラー: {synthesis_response.status_code} {synthesis_response.text}")
-                except httpx.TimeoutException as timeout_err:
-                    print(f"音声合成API接続エラー: {str(timeout_err)}")
-                    raise Exception(f"音声合成タイムアウト: {str(timeout_err)}")
-                except Exception as req_err:
-                    print(f"リクエスト例外: {str(req_err)}")
-                    raise Exception(f"リクエスト例外: {str(req_err)}")
+            audio_result = await synthesize_custom_speech(text, agent_id, cache_key=cache_key)
+            audio_result["cache_key"] = cache_key
+            audio_result["engine"] = "custom"
+            return audio_result
         except Exception as custom_err:
             print(f"カスタム音声合成例外: {str(custom_err)}。VoiceVoxにフォールバックを試行します。")
     
     # カスタム音声合成に失敗したか、そもそもカスタム音声を使用しない場合はVoiceVoxを使用
+    cache_key = engine_keys["voicevox"]
+    cached = await load_cached_audio(cache_key)
+    if cached:
+        cached["engine"] = "voicevox"
+        return cached
+    try:
+        print(f"VoiceVox音声合成を使用: speaker_id={speaker_id}")
+        # 音声クエリを生成
+        audio_query = await create_audio_query(text, speaker=speaker_id)
+        
+        # 音声を合成
+        audio_result = await synthesize_speech(audio_query, speaker=speaker_id, cache_key=cache_key)
+        audio_result["cache_key"] = cache_key
+        audio_result["engine"] = "voicevox"
+        return audio_result
+    except Exception as voicevox_err:
+        print(f"VoiceVox合成エラー: {str(voicevox_err)}")
+        return None
+
+async def generate_chat_text(messages):
+    """
+    チャット応答を生成し、テキスト部分を返す
+    """
+    # チャット応答を生成
+    chat_response = await create_chat_response(messages)
+    
+    # レスポンスのテキスト部分を取得
+    response_text = chat_response.get("message", {}).get("content", "")
+    if not response_text:
+        raise HTTPException(status_code=500, detail="No response text received from chat API")
+    return response_text
+
+async def process_chat_and_voice(messages, voice_settings=None):
+    """
+    チャット応答を生成し、それを音声に変換する
+    voice_settings は呼び出し側で読み込んだエージェントから作った VoiceSettings
+    """
+    response_text = await generate_chat_text(messages)
+    
+    audio_result = await synthesize_text(response_text, voice_settings)
     if audio_result is None:
-        try:
-            print(f"VoiceVox音声合成を使用: speaker_id={speaker_id}")
-            # 音声クエリを生成
-            audio_query = await create_audio_query(response_text, speaker=speaker_id)
-            
-            # 音声を合成
-            audio_result = await synthesize_speech(audio_query, speaker=speaker_id)
-        except Exception as voicevox_err:
-            print(f"VoiceVox合成エラー: {str(voicevox_err)}")
-            # 最終的なフォールバック: 音声なしでテキストだけ返す
-            return {
-                "text": response_text,
-                "audio_path": "",
-                "audio_data": ""  # 音声データなし
-            }
+        # 最終的なフォールバック: 音声なしでテキストだけ返す
+        return {
+            "text": response_text,
+            "audio_path": "",  # 音声データなし
+            "segment_paths": []
+        }
     
     # 結果を返す
     return {
         "text": response_text,
         "audio_path": audio_result["filepath"],
-        "audio_data": audio_result["audio_data"]
-    }
\ No newline at end of file
+        "segment_paths": audio_result["segments"]
+    }
+
+async def stream_chat_and_voice(messages, voice_settings=None):
+    """
+    LLMのトークンを文単位に区切り、生成と並行して音声合成を進める
+    テキスト差分と文ごとの音声URLを準備できた順にイベントとして返す
+
+    イベント:
+        {"type": "text", "delta": str}
+        {"type": "audio_start", "index": int, "text": str, "audio_url": str}
+            合成中のWAVを書き込まれた分から受け取れるURL（キャッシュにヒットした文では送らない）
+        {"type": "audio", "index": int, "text": str, "audio_url": str, "filepath": str}
+        {"type": "done", "text": str}
+        {"type": "error", "detail": str, "text": str}
+    filepath は変換・連結後に確定したファイルのパス（サーバー内で使い、クライアントには返さない）
+    """
+    events = asyncio.Queue()
+    
+    async def synthesize_sentence(index, sentence, previous):
+        async def on_audio_start(segment_index, filename):
+            # 文がさらに分割された場合は先頭の部分だけ知らせる
+            if segment_index == 0:
+                await events.put({"type": "audio_start", "index": index, "text": sentence, "audio_url": f"/chat/audio/{filename}"})
+        
+        audio_result = await synthesize_text_streaming(sentence, voice_settings, on_audio_start)
+        filepath = audio_result["filepath"] if audio_result else ""
+        audio_url = f"/audio/{os.path.basename(filepath)}" if filepath else ""
+        # 文の順序を保つため、前の文の音声イベントを送ってから送信する
+        if previous is not None:
+            await previous
+        await events.put({"type": "audio", "index": index, "text": sentence, "audio_url": audio_url, "filepath": filepath})
+    
+    async def produce():
+        full_text = ""
+        buffer = ""
+        last_task = None
+        tasks = []
+        
+        def schedule(sentence):
+            nonlocal last_task
+            last_task = asyncio.create_task(synthesize_sentence(len(tasks), sentence, last_task))
+            tasks.append(last_task)
+        
+        try:
+            async for delta in stream_chat_response(messages):
+                full_text += delta
+                buffer += delta
+                await events.put({"type": "text", "delta": delta})
+                sentences, buffer = pop_sentences(buffer)
+                for sentence in sentences:
+                    schedule(sentence)
+            if buffer.strip():
+                schedule(buffer.strip())
+            if tasks:
+                await tasks[-1]
+            await events.put({"type": "done", "text": full_text})
+        except asyncio.CancelledError:
+            for task in tasks:
+                task.cancel()
+            raise
+        except Exception as e:
+            for task in tasks:
+                task.cancel()
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            await events.put({"type": "error", "detail": detail, "text": full_text})
+        finally:
+            await events.put(None)
+    
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            event = await events.get()
+            if event is None:
+                break
+            yield event
+    finally:
+        # クライアントが切断した場合は生成と合成を中断する
+        if not producer.done():
+            producer.cancel()
@@ -0,0 +1,186 @@
+import os
+import re
+import hashlib
+import unicodedata
+import uuid
+from collections import OrderedDict
+import aiofiles
+from dotenv import load_dotenv
+from app.services.audio_writes import audio_writes
+
+# 環境変数の読み込み
+load_dotenv()
+
+AUDIO_DIR = "audio_files"
+AUDIO_CACHE_ENABLED = os.getenv("AUDIO_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+AUDIO_CACHE_MAX_ENTRIES = int(os.getenv("AUDIO_CACHE_MAX_ENTRIES", "2000"))
+AUDIO_CACHE_MAX_BYTES = int(os.getenv("AUDIO_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# キャッシュファイルの接頭辞（tts_{ハッシュ}.{拡張子}）
+CACHE_FILE_PREFIX = "tts_"
+CACHE_FILE_PATTERN = re.compile(r"^tts_([0-9a-f]{64})\.(wav|opus|mp3|m4a)$")
+
+def normalize_text(text):
+    """キャッシュキー用にテキストを正規化する（NFKC・前後空白除去・空白の圧縮）"""
+    text = unicodedata.normalize("NFKC", text or "")
+    return re.sub(r"\s+", " ", text).strip()
+
+def reference_fingerprint(agent_id):
+    """
+    エージェントの参照音声（{agent_id}.wav）の指紋を返す
+    参照音声が差し替えられるとキャッシュキーも変わる
+    """
+    if not agent_id:
+        return ""
+    try:
+        st = os.stat(os.path.join(AUDIO_DIR, f"{agent_id}.wav"))
+    except OSError:
+        return ""
+    return f"{st.st_size}-{st.st_mtime_ns}"
+
+class AudioCache:
+    """
+    (テキスト, スピーカー, エンジン, 参照音声) をキーにした合成音声のコンテンツアドレスキャッシュ
+    インデックスはメモリ上のLRU、実体は audio_files/ 以下のファイル
+    """
+
+    def __init__(self, directory=AUDIO_DIR, max_entries=AUDIO_CACHE_MAX_ENTRIES, max_bytes=AUDIO_CACHE_MAX_BYTES, enabled=AUDIO_CACHE_ENABLED):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._index = OrderedDict()  # key -> (ファイル名, ファイルサイズ)
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(text, speaker_id, engine, reference=""):
+        raw = "\x1f".join([normalize_text(text), str(speaker_id), engine, reference or ""])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def filename_for(self, key, extension=".wav"):
+        return f"{CACHE_FILE_PREFIX}{key}{extension}"
+
+    def path_for(self, key, extension=".wav"):
+        return os.path.join(self.directory, self.filename_for(key, extension))
+
+    def load_index(self):
+        """起動時に既存のキャッシュファイルからインデックスを再構築する（古い順）"""
+        if not self.enabled:
+            return
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                match = CACHE_FILE_PATTERN.match(entry.name)
+                if match and entry.is_file():
+                    st = entry.stat()
+                    entries.append((st.st_mtime, match.group(1), entry.name, st.st_size))
+        for _, key, filename, size in sorted(entries):
+            # 同じキーで複数形式がある場合（WAVを残す設定）は新しい方を使う
+            self.discard(key)
+            self._add(key, filename, size)
+        self._evict()
+        print(f"音声キャッシュを読み込みました: {len(self._index)}件, {self._total_bytes}バイト")
+
+    def lookup(self, key):
+        """キャッシュ済みのファイルパスを返す（なければ None）"""
+        if not self.enabled:
+            return None
+        if key in self._index:
+            path = os.path.join(self.directory, self._index[key][0])
+            if os.path.exists(path):
+                self._index.move_to_end(key)
+                self.hits += 1
+                return path
+            # ファイルが外部で削除されていた場合はインデックスから外す
+            self.discard(key)
+        self.misses += 1
+        return None
+
+    def peek(self, key):
+        """ヒット率やLRUの順序に影響させずに、キャッシュ済みのファイルパスを返す（なければ None）"""
+        if not self.enabled or key not in self._index:
+            return None
+        path = os.path.join(self.directory, self._index[key][0])
+        return path if os.path.exists(path) else None
+
+    async def store(self, key, content):
+        """合成結果を保存してファイルパスを返す"""
+        path = self.path_for(key)
+        # 同じキーの同時書き込みに備えて一時ファイルから置き換える
+        temp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        async with aiofiles.open(temp_path, "wb") as f:
+            await f.write(content)
+        os.replace(temp_path, path)
+        if self.enabled:
+            self.discard(key)
+            self._add(key, os.path.basename(path), len(content))
+            self._evict()
+        return path
+
+    async def store_stream(self, key, chunks):
+        """
+        合成結果を受信したチャンクから順に保存してファイルパスを返す
+        書き込み中も audio_writes から配信できる
+        """
+        path = self.path_for(key)
+        size = await audio_writes.write(path, chunks)
+        if self.enabled:
+            self.discard(key)
+            self._add(key, os.path.basename(path), size)
+            self._evict()
+        return path
+
+    def replace(self, key, path):
+        """変換後のファイルなど、キーが指すファイルを差し替える"""
+        if not self.enabled:
+            return
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        self.discard(key)
+        self._add(key, os.path.basename(path), size)
+        self._evict()
+
+    def discard_file(self, filename):
+        """ファイルが外部で削除された場合に、そのファイルを指すエントリだけを外す"""
+        match = CACHE_FILE_PATTERN.match(filename)
+        if match and self._index.get(match.group(1), (None,))[0] == filename:
+            self.discard(match.group(1))
+
+    def discard(self, key):
+        entry = self._index.pop(key, None)
+        if entry is not None:
+            self._total_bytes -= entry[1]
+
+    def _add(self, key, filename, size):
+        self._index[key] = (filename, size)
+        self._total_bytes += size
+
+    def _evict(self):
+        while self._index and (len(self._index) > self.max_entries or self._total_bytes > self.max_bytes):
+            key, (filename, size) = self._index.popitem(last=False)
+            self._total_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(os.path.join(self.directory, filename))
+            except OSError:
+                pass
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._index),
+            "bytes": self._total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+# アプリケーション全体で共有するキャッシュ
+audio_cache = AudioCache()
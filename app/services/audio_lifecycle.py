@@ -0,0 +1,280 @@
+import os
+import re
+import json
+import time
+import asyncio
+from dataclasses import dataclass
+from typing import Optional
+from dotenv import load_dotenv
+from app.services.audio_cache import audio_cache
+
+# 環境変数の読み込み
+load_dotenv()
+
+AUDIO_DIR = "audio_files"
+AUDIO_TTL_SECONDS = int(os.getenv("AUDIO_TTL_SECONDS", str(7 * 24 * 3600)))
+AUDIO_AGENT_QUOTA_BYTES = int(os.getenv("AUDIO_AGENT_QUOTA_BYTES", str(200 * 1024 * 1024)))
+AUDIO_GLOBAL_QUOTA_BYTES = int(os.getenv("AUDIO_GLOBAL_QUOTA_BYTES", str(2 * 1024 * 1024 * 1024)))
+AUDIO_GC_INTERVAL = float(os.getenv("AUDIO_GC_INTERVAL", "300"))
+AUDIO_GC_BATCH_SIZE = int(os.getenv("AUDIO_GC_BATCH_SIZE", "100"))
+# ファイル名から所有者がわからない音声ファイル（カスタム音声の合成キャッシュ tts_* など）の所有者の保存先
+# 配信ディレクトリの外に置く（/audio から見えないようにする）
+AUDIO_OWNERS_PATH = os.getenv("AUDIO_OWNERS_PATH", "audio_owners.json")
+
+# 生成ファイル名から所有エージェントを取り出すパターン
+_OWNED_FILE_PATTERN = re.compile(r"^(?:voicevox|generated)_(.+)_[0-9a-f]{8}\.\w+$")
+# エージェントIDのみのファイル名（参照音声、または旧形式の合成結果）
+_BARE_WAV_PATTERN = re.compile(r"^([0-9a-fA-F-]{36})\.wav$")
+
+@dataclass
+class AudioFileRecord:
+    filename: str
+    size: int
+    created_at: float
+    last_served_at: float
+    owner: Optional[str] = None
+
+    @property
+    def last_used_at(self):
+        return max(self.created_at, self.last_served_at)
+
+class AudioLifecycleManager:
+    """
+    生成した音声ファイルのインデックスを持ち、TTLと容量上限に従ってバックグラウンドで削除する
+    参照音声（{agent_id}.wav）はインデックスに載せず、削除対象にしない
+    """
+
+    def __init__(
+        self,
+        directory=AUDIO_DIR,
+        owners_path=AUDIO_OWNERS_PATH,
+        ttl_seconds=AUDIO_TTL_SECONDS,
+        agent_quota_bytes=AUDIO_AGENT_QUOTA_BYTES,
+        global_quota_bytes=AUDIO_GLOBAL_QUOTA_BYTES,
+        gc_interval=AUDIO_GC_INTERVAL,
+        batch_size=AUDIO_GC_BATCH_SIZE,
+    ):
+        self.directory = directory
+        self.owners_path = owners_path
+        self.ttl_seconds = ttl_seconds
+        self.agent_quota_bytes = agent_quota_bytes
+        self.global_quota_bytes = global_quota_bytes
+        self.gc_interval = gc_interval
+        self.batch_size = batch_size
+        self._records = {}
+        self._owners_dirty = False
+        self._task = None
+        self.deleted_files = 0
+        self.deleted_bytes = 0
+
+    def load_index(self, reference_ids=()):
+        """起動時にディレクトリを一度だけ走査してインデックスを作る"""
+        reference_ids = set(reference_ids)
+        owners = self._load_owners()
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.is_file() or self.is_pinned(entry.name, reference_ids):
+                    continue
+                st = entry.stat()
+                self._records[entry.name] = AudioFileRecord(
+                    filename=entry.name,
+                    size=st.st_size,
+                    created_at=st.st_mtime,
+                    last_served_at=st.st_atime,
+                    owner=owners.get(entry.name) or self.owner_of(entry.name),
+                )
+        print(f"音声ファイルインデックスを作成しました: {len(self._records)}件, {self.total_bytes()}バイト")
+
+    @staticmethod
+    def is_pinned(filename, reference_ids=()):
+        """参照音声や変換中の一時ファイルは削除対象にしない"""
+        match = _BARE_WAV_PATTERN.match(filename)
+        if match and match.group(1) in reference_ids:
+            return True
+        return "_temp" in filename
+
+    @staticmethod
+    def owner_of(filename):
+        match = _OWNED_FILE_PATTERN.match(filename)
+        return match.group(1) if match else None
+
+    def _has_stored_owner(self, record):
+        """ファイル名からはわからない所有者を持つか（再起動後も使えるよう保存する）"""
+        return record is not None and record.owner is not None and record.owner != self.owner_of(record.filename)
+
+    def _load_owners(self):
+        try:
+            with open(self.owners_path, encoding="utf-8") as f:
+                owners = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            print(f"音声ファイルの所有者を読み込めませんでした: {str(e)}")
+            return {}
+        return owners if isinstance(owners, dict) else {}
+
+    async def save_owners(self):
+        """変更があれば、ファイル名からわからない所有者を保存する（GCのたびと停止時に呼ぶ）"""
+        if not self._owners_dirty:
+            return
+        owners = {r.filename: r.owner for r in self._records.values() if self._has_stored_owner(r)}
+        self._owners_dirty = False
+        try:
+            await asyncio.to_thread(self._write_owners, owners)
+        except OSError as e:
+            self._owners_dirty = True
+            print(f"音声ファイルの所有者を保存できませんでした: {str(e)}")
+
+    def _write_owners(self, owners):
+        temp_path = f"{self.owners_path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(owners, f)
+        os.replace(temp_path, self.owners_path)
+
+    def register(self, path, owner=None):
+        """
+        新しく生成した音声ファイルをインデックスに登録する
+        owner を指定しないファイル（エージェント間で共有する合成キャッシュなど）は全体の上限だけで管理する
+        """
+        filename = os.path.basename(path)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        now = time.time()
+        owner = owner or self.owner_of(filename)
+        record = self._records.get(filename)
+        if record:
+            record.size = size
+            record.last_served_at = now
+            # 別のエージェントからも使われたファイルは共有として扱う
+            if record.owner != owner:
+                self._owners_dirty |= self._has_stored_owner(record)
+                record.owner = None
+            return
+        record = AudioFileRecord(
+            filename=filename,
+            size=size,
+            created_at=now,
+            last_served_at=now,
+            owner=owner,
+        )
+        self._records[filename] = record
+        self._owners_dirty |= self._has_stored_owner(record)
+
+    def touch(self, filename):
+        """配信やキャッシュヒットの時刻を記録する"""
+        record = self._records.get(os.path.basename(filename))
+        if record:
+            record.last_served_at = time.time()
+
+    def files_for_agent(self, agent_id):
+        return [r.filename for r in self._records.values() if r.owner == agent_id]
+
+    def forget(self, filename):
+        self._owners_dirty |= self._has_stored_owner(self._records.pop(filename, None))
+
+    def total_bytes(self, owner=None):
+        return sum(r.size for r in self._records.values() if owner is None or r.owner == owner)
+
+    def collect_candidates(self, now=None):
+        """TTL切れ → エージェント別上限 → 全体上限 の順に削除対象を選ぶ"""
+        now = now or time.time()
+        candidates = []
+        selected = set()
+
+        def select(record):
+            if record.filename not in selected:
+                selected.add(record.filename)
+                candidates.append(record)
+
+        records = sorted(self._records.values(), key=lambda r: r.last_used_at)
+        for record in records:
+            if now - record.last_used_at > self.ttl_seconds:
+                select(record)
+
+        # エージェントごとの容量上限
+        usage = {}
+        for record in records:
+            if record.owner and record.filename not in selected:
+                usage[record.owner] = usage.get(record.owner, 0) + record.size
+        for record in records:
+            if record.owner and usage.get(record.owner, 0) > self.agent_quota_bytes and record.filename not in selected:
+                usage[record.owner] -= record.size
+                select(record)
+
+        # 全体の容量上限（最後に使われた時刻が古い順）
+        remaining = sum(r.size for r in records if r.filename not in selected)
+        for record in records:
+            if remaining <= self.global_quota_bytes:
+                break
+            if record.filename not in selected:
+                remaining -= record.size
+                select(record)
+        return candidates
+
+    async def delete_files(self, filenames):
+        """ファイルを削除してインデックスから外す（ブロッキングI/Oはスレッドで実行）"""
+        for filename in filenames:
+            record = self._records.pop(filename, None)
+            self._owners_dirty |= self._has_stored_owner(record)
+            try:
+                await asyncio.to_thread(os.remove, os.path.join(self.directory, filename))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"音声ファイル削除エラー: {filename}: {str(e)}")
+                continue
+            audio_cache.discard_file(filename)
+            if record:
+                self.deleted_files += 1
+                self.deleted_bytes += record.size
+
+    async def gc_once(self):
+        """削除対象をバッチに分けて削除する"""
+        candidates = self.collect_candidates()
+        for i in range(0, len(candidates), self.batch_size):
+            batch = [r.filename for r in candidates[i:i + self.batch_size]]
+            await self.delete_files(batch)
+            # リクエスト処理を妨げないようバッチ間でイベントループに制御を返す
+            await asyncio.sleep(0)
+        if candidates:
+            print(f"音声ファイルGC: {len(candidates)}件を削除しました")
+        return len(candidates)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.gc_interval)
+            try:
+                await self.gc_once()
+            except Exception as e:
+                print(f"音声ファイルGCエラー: {str(e)}")
+            await self.save_owners()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.save_owners()
+
+    def stats(self):
+        return {
+            "files": len(self._records),
+            "bytes": self.total_bytes(),
+            "deleted_files": self.deleted_files,
+            "deleted_bytes": self.deleted_bytes,
+            "ttl_seconds": self.ttl_seconds,
+            "agent_quota_bytes": self.agent_quota_bytes,
+            "global_quota_bytes": self.global_quota_bytes,
+        }
+
+# アプリケーション全体で共有するマネージャー
+audio_lifecycle = AudioLifecycleManager()
@@ -0,0 +1,196 @@
+import os
+import re
+import asyncio
+import aiofiles
+from fastapi import HTTPException
+from fastapi.responses import RedirectResponse, Response, StreamingResponse
+from dotenv import load_dotenv
+from app.services.audio_cache import audio_cache, AUDIO_DIR, CACHE_FILE_PATTERN, CACHE_FILE_PREFIX
+from app.services.audio_writes import audio_writes
+from app.services.transcoder import media_type_for
+from app.services.wav_utils import parse_wav_header, build_streaming_wav_header, WavFormatError
+
+# 環境変数の読み込み
+load_dotenv()
+
+# コンテンツアドレスの合成音声（tts_{ハッシュ}.*）をブラウザ・CDNにキャッシュさせる時間（秒）
+AUDIO_CACHE_MAX_AGE = int(os.getenv("AUDIO_CACHE_MAX_AGE", "31536000"))
+# 書き込み中のファイルを配信するとき、次の書き込みを待つ最大時間（秒）
+AUDIO_STREAM_IDLE_TIMEOUT = float(os.getenv("AUDIO_STREAM_IDLE_TIMEOUT", "30"))
+AUDIO_STREAM_CHUNK_SIZE = 64 * 1024
+# WAVヘッダーの読み取りに使う先頭部分の最大サイズ
+WAV_HEADER_MAX_BYTES = 4096
+
+def is_content_addressed(filename):
+    return CACHE_FILE_PATTERN.match(os.path.basename(filename)) is not None
+
+def cache_control_for(filename):
+    """合成音声のキャッシュファイルは内容が変わらないため immutable、それ以外は毎回検証させる"""
+    if is_content_addressed(filename):
+        return f"public, max-age={AUDIO_CACHE_MAX_AGE}, immutable"
+    return "no-cache"
+
+def etag_for(filename, stat):
+    if is_content_addressed(filename):
+        key = os.path.splitext(os.path.basename(filename))[0][len(CACHE_FILE_PREFIX):]
+        return f'"{key[:32]}-{stat.st_size:x}"'
+    return f'W/"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+def etag_matches(header, etag):
+    """If-None-Match の値が ETag に一致するか（弱い比較）"""
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(",")]
+    return "*" in tags or etag.removeprefix("W/") in (tag.removeprefix("W/") for tag in tags)
+
+def parse_range(range_header, size):
+    """
+    Range ヘッダーを (先頭, 末尾) のバイト位置に変換する
+    複数範囲など対応しない形式は None（全体を返す）、範囲外は 416
+    """
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", range_header.strip())
+    if not match or not (match.group(1) or match.group(2)):
+        return None
+    start, end = match.groups()
+    if start:
+        start = int(start)
+        end = min(int(end), size - 1) if end else size - 1
+        if end < start and start < size:
+            return None
+    else:
+        # 末尾から n バイト
+        suffix = int(end)
+        if suffix == 0:
+            start = size
+        else:
+            start, end = max(size - suffix, 0), size - 1
+    if start >= size:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    return start, end
+
+async def iter_file_range(path, start, end):
+    """ファイルの start から end（含む）までをチャンク単位で読み出す"""
+    async with aiofiles.open(path, "rb") as f:
+        await f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = await f.read(min(AUDIO_STREAM_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+async def iter_growing_wav(write, final_path):
+    """
+    書き込み中のWAVを、サイズを未確定にしたヘッダーを付けて書き込まれた分から順に返す
+    書き込みが終わると（ヘッダーのサイズは未確定のまま）末尾まで返して終わる
+    """
+    try:
+        f = await aiofiles.open(write.temp_path, "rb")
+    except FileNotFoundError:
+        # 開く前に書き込みが終わった場合は完成したファイルを返す
+        if not write.failed and os.path.exists(final_path):
+            async for chunk in iter_file_range(final_path, 0, os.path.getsize(final_path) - 1):
+                yield chunk
+        return
+
+    # aiofiles.open の戻り値は async with に対応しないため、開いたファイルは finally で閉じる
+    try:
+        # fmt チャンクと data チャンクの先頭が書き込まれるまで待つ
+        while True:
+            await f.seek(0)
+            header = await f.read(min(write.size, WAV_HEADER_MAX_BYTES))
+            try:
+                info = parse_wav_header(header)
+                break
+            except WavFormatError:
+                if write.finished or len(header) >= WAV_HEADER_MAX_BYTES:
+                    print(f"書き込み中の音声ファイルのヘッダーを読み取れませんでした: {write.filename}")
+                    return
+                await write.wait_for_data(write.size, AUDIO_STREAM_IDLE_TIMEOUT)
+
+        yield build_streaming_wav_header(info.fmt)
+        position = info.data_offset
+        await f.seek(position)
+        while True:
+            if position < write.size:
+                chunk = await f.read(min(AUDIO_STREAM_CHUNK_SIZE, write.size - position))
+                if not chunk:
+                    break
+                position += len(chunk)
+                yield chunk
+            elif write.finished:
+                break
+            else:
+                try:
+                    await write.wait_for_data(position, AUDIO_STREAM_IDLE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    print(f"音声ファイルの書き込みが止まったため配信を終了します: {write.filename}")
+                    break
+    finally:
+        await f.close()
+
+def audio_file_response(request, path):
+    """Range・ETag・Cache-Control に対応した音声ファイルのレスポンス"""
+    filename = os.path.basename(path)
+    stat = os.stat(path)
+    size = stat.st_size
+    etag = etag_for(filename, stat)
+    headers = {
+        "ETag": etag,
+        "Cache-Control": cache_control_for(filename),
+        "Accept-Ranges": "bytes",
+    }
+    media_type = media_type_for(filename)
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range == etag):
+        byte_range = parse_range(range_header, size)
+        if byte_range is not None:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            headers["Content-Length"] = str(end - start + 1)
+            return StreamingResponse(
+                iter_file_range(path, start, end),
+                status_code=206,
+                media_type=media_type,
+                headers=headers
+            )
+
+    headers["Content-Length"] = str(size)
+    return StreamingResponse(iter_file_range(path, 0, size - 1), media_type=media_type, headers=headers)
+
+def audio_response(request, filename, directory=AUDIO_DIR):
+    """
+    音声ファイルを配信する
+    完成したファイルは Range・条件付きリクエストに対応し、合成中のWAVは書き込まれた分から返す
+    合成中に知らせたWAVが変換済みの場合は、変換後のファイルにリダイレクトする
+    ファイルがない場合は None
+    """
+    filename = os.path.basename(filename)
+    path = os.path.join(directory, filename)
+    if os.path.exists(path):
+        return audio_file_response(request, path)
+    write = audio_writes.get(filename)
+    if write is not None and filename.endswith(".wav"):
+        # 長さが未確定のため範囲指定には対応せず、先頭から返す
+        return StreamingResponse(
+            iter_growing_wav(write, path),
+            media_type="audio/wav",
+            headers={"Cache-Control": "no-store", "Accept-Ranges": "none"}
+        )
+    match = CACHE_FILE_PATTERN.match(filename)
+    if match:
+        current = audio_cache.peek(match.group(1))
+        if current is not None and os.path.basename(current) != filename:
+            # 同じディレクトリの相対パスで返す（/audio・/chat/audio のどちらからでも使える）
+            return RedirectResponse(os.path.basename(current), status_code=307)
+    return None
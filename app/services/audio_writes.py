@@ -0,0 +1,107 @@
+import os
+import uuid
+import asyncio
+import aiofiles
+
+class AudioWrite:
+    """書き込み中の音声ファイル（書き込まれたバイト数と完了を待機できる）"""
+
+    def __init__(self, filename, temp_path):
+        self.filename = filename
+        self.temp_path = temp_path
+        self.size = 0
+        self.finished = False
+        self.failed = False
+        self._event = asyncio.Event()
+
+    def _notify(self):
+        event, self._event = self._event, asyncio.Event()
+        event.set()
+
+    async def wait_for_data(self, size, timeout):
+        """size バイトより多く書き込まれるか、書き込みが終わるまで待つ（timeout 秒で asyncio.TimeoutError）"""
+        while self.size <= size and not self.finished:
+            await asyncio.wait_for(self._event.wait(), timeout)
+
+class AudioWriteRegistry:
+    """
+    合成中の音声ファイルを一時ファイルに書き込みながら公開するレジストリ
+    配信側は書き込み中のファイルを見つけると、完了を待たずに書き込まれた分から返す
+    """
+
+    def __init__(self):
+        self._writes = {}
+        # ファイル名 -> 書き込みの開始を待っている Future
+        self._waiters = {}
+        self.started = 0
+        self.failed = 0
+
+    def get(self, filename):
+        return self._writes.get(os.path.basename(filename))
+
+    async def wait_started(self, filename):
+        """filename への書き込みが始まるまで待ち、AudioWrite を返す（書き込み中ならすぐに返す）"""
+        filename = os.path.basename(filename)
+        write = self._writes.get(filename)
+        if write is not None:
+            return write
+        future = asyncio.get_running_loop().create_future()
+        waiters = self._waiters.setdefault(filename, set())
+        waiters.add(future)
+        try:
+            return await future
+        finally:
+            waiters.discard(future)
+            if not waiters and self._waiters.get(filename) is waiters:
+                del self._waiters[filename]
+
+    async def write(self, path, chunks):
+        """
+        非同期イテレータ chunks を一時ファイルに書き込み、完了したら path に置き換える
+        戻り値: 書き込んだバイト数
+        """
+        filename = os.path.basename(path)
+        # 同じファイルへの同時書き込みに備えて一時ファイルから置き換える
+        write = AudioWrite(filename, f"{path}.{uuid.uuid4().hex[:8]}.tmp")
+        self._writes[filename] = write
+        self.started += 1
+        for future in self._waiters.pop(filename, ()):
+            if not future.done():
+                future.set_result(write)
+        try:
+            async with aiofiles.open(write.temp_path, "wb") as f:
+                async for chunk in chunks:
+                    if not chunk:
+                        continue
+                    await f.write(chunk)
+                    # 配信側が読めるように書き込むたびにフラッシュする
+                    await f.flush()
+                    write.size += len(chunk)
+                    write._notify()
+            os.replace(write.temp_path, path)
+            return write.size
+        except BaseException:
+            write.failed = True
+            self.failed += 1
+            if os.path.exists(write.temp_path):
+                os.remove(write.temp_path)
+            raise
+        finally:
+            # 途中で失敗した場合も上流の受信を閉じる
+            aclose = getattr(chunks, "aclose", None)
+            if aclose is not None:
+                await aclose()
+            write.finished = True
+            write._notify()
+            if self._writes.get(filename) is write:
+                del self._writes[filename]
+
+    def stats(self):
+        return {
+            "in_progress": len(self._writes),
+            "started": self.started,
+            "failed": self.failed,
+        }
+
+# アプリケーション全体で共有するレジストリ
+audio_writes = AudioWriteRegistry()
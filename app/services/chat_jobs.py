@@ -0,0 +1,382 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Optional, List
+from fastapi import HTTPException
+from dotenv import load_dotenv
+from app.crud import async_crud
+from app.db.database import AsyncSessionLocal
+from app.services import api_service
+from app.services.agent_cache import agent_cache
+from app.services.context_builder import context_builder
+from app.services.history_cache import save_conversation
+from app.services.voice_settings import VoiceSettings
+
+# 環境変数の読み込み
+load_dotenv()
+
+# 同時に処理するジョブ数（LLM・音声合成の同時呼び出し数の上限）
+CHAT_JOB_WORKERS = int(os.getenv("CHAT_JOB_WORKERS", "4"))
+# 待機できるジョブの総数と、ユーザーごとの上限
+CHAT_JOB_QUEUE_SIZE = int(os.getenv("CHAT_JOB_QUEUE_SIZE", "200"))
+CHAT_JOB_MAX_PER_USER = int(os.getenv("CHAT_JOB_MAX_PER_USER", "5"))
+# ジョブ1件の処理時間の上限（秒）
+CHAT_JOB_TIMEOUT = float(os.getenv("CHAT_JOB_TIMEOUT", "300"))
+# 完了したジョブをメモリに保持する時間（秒）、以降はDBから読み込む
+CHAT_JOB_TTL = float(os.getenv("CHAT_JOB_TTL", "600"))
+
+QUEUED = "queued"
+RUNNING = "running"
+TEXT_READY = "text_ready"
+DONE = "done"
+FAILED = "failed"
+FINISHED = (DONE, FAILED)
+
+class ChatJobQueueFull(Exception):
+    """ジョブキューが満杯（全体またはユーザーごとの上限）"""
+
+def audio_url_for(path):
+    return f"/audio/{os.path.basename(path)}" if path else ""
+
+@dataclass
+class ChatJob:
+    job_id: str
+    agent_id: str
+    user_id: Optional[str]
+    user_message: str
+    status: str = QUEUED
+    text: Optional[str] = None
+    audio_path: Optional[str] = None
+    audio_segments: List[str] = field(default_factory=list)
+    # 合成中のWAVを書き込まれた分から受け取れるURL（先頭の文、メモリにだけ保持する）
+    audio_stream_url: Optional[str] = None
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    # 段階ごとのイベント（long-poll / WebSocket では after 以降の差分を返す）
+    events: list = field(default_factory=list)
+    changed: asyncio.Condition = field(default_factory=asyncio.Condition, repr=False)
+
+    @classmethod
+    def from_row(cls, row):
+        """DBの行からジョブを復元する（完了済みの段階のイベントも作り直す）"""
+        job = cls(
+            job_id=row.job_id,
+            agent_id=row.agent_id,
+            user_id=row.user_id,
+            user_message=row.user_message,
+            status=row.status,
+            text=row.response_text,
+            audio_path=row.audio_path,
+            audio_segments=json.loads(row.audio_segments) if row.audio_segments else [],
+            error=row.error,
+            created_at=row.created_at.timestamp() if row.created_at else time.time(),
+        )
+        if job.text is not None:
+            job.events.append({"type": "text", "text": job.text})
+        if job.status == DONE:
+            job.events.append(job._audio_event())
+            job.events.append({"type": "done"})
+        elif job.status == FAILED:
+            job.events.append({"type": "error", "detail": job.error})
+        if job.status in FINISHED:
+            job.finished_at = row.updated_at.timestamp() if row.updated_at else time.time()
+        return job
+
+    def _audio_event(self):
+        return {
+            "type": "audio",
+            "audio_url": audio_url_for(self.audio_path),
+            "audio_segments": [audio_url_for(path) for path in self.audio_segments],
+        }
+
+    @property
+    def finished(self):
+        return self.status in FINISHED
+
+    def to_dict(self, after=0):
+        return {
+            "job_id": self.job_id,
+            "agent_id": self.agent_id,
+            "user_id": self.user_id,
+            "status": self.status,
+            "text": self.text,
+            "audio_url": audio_url_for(self.audio_path),
+            "audio_segments": [audio_url_for(path) for path in self.audio_segments],
+            "audio_stream_url": self.audio_stream_url,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "version": len(self.events),
+            "events": self.events[after:],
+        }
+
+class ChatJobScheduler:
+    """
+    チャットのLLM生成と音声合成をジョブとして処理するスケジューラー
+    ワーカー数で同時実行を制限し、待機中のジョブはユーザーごとのキューから順番に取り出す（ラウンドロビン）
+    ジョブの状態はDBにも保存し、再起動後は未完了のジョブを続きから再開する
+    """
+
+    def __init__(self, workers=CHAT_JOB_WORKERS, max_queue=CHAT_JOB_QUEUE_SIZE,
+                 max_per_user=CHAT_JOB_MAX_PER_USER, timeout=CHAT_JOB_TIMEOUT):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_per_user = max_per_user
+        self.timeout = timeout
+        self._jobs = {}
+        # ユーザー -> 待機中のジョブ（先頭のユーザーから順に1件ずつ取り出す）
+        self._queues = OrderedDict()
+        self._queued = 0
+        self._wakeup = None
+        self._tasks = []
+        self._background = set()
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._wakeup = asyncio.Condition()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        await self._recover()
+
+    async def stop(self):
+        for task in self._tasks + list(self._background):
+            task.cancel()
+        for task in self._tasks + list(self._background):
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        self._background.clear()
+
+    async def submit(self, agent_id, user_id, user_message):
+        """ジョブを登録する（キューが満杯なら ChatJobQueueFull）"""
+        return await self._submit(agent_id, user_id, user_message)
+
+    async def submit_synthesis(self, agent_id, user_id, user_message, text):
+        """
+        テキスト生成済みのターンの音声合成だけをジョブとして登録する（テキスト先行の応答用）
+        会話履歴は呼び出し元で保存済みとする
+        """
+        return await self._submit(agent_id, user_id, user_message, text=text)
+
+    async def _submit(self, agent_id, user_id, user_message, text=None):
+        self._prune()
+        user_key = user_id or ""
+        if self._queued >= self.max_queue:
+            self.rejected += 1
+            raise ChatJobQueueFull("チャットジョブのキューが満杯です")
+        if len(self._queues.get(user_key, ())) >= self.max_per_user:
+            self.rejected += 1
+            raise ChatJobQueueFull("処理待ちのメッセージが多すぎます")
+        job = ChatJob(job_id=uuid.uuid4().hex, agent_id=agent_id, user_id=user_id, user_message=user_message)
+        if text is not None:
+            job.status = TEXT_READY
+            job.text = text
+            job.events.append({"type": "text", "text": text})
+        async with AsyncSessionLocal() as db:
+            await async_crud.create_chat_job(
+                db, job.job_id, user_id, agent_id, user_message,
+                status=job.status, response_text=text
+            )
+        self._jobs[job.job_id] = job
+        await self._enqueue(job)
+        return job
+
+    async def get(self, job_id):
+        """ジョブを取得する（メモリにない完了済みのジョブはDBから読み込む）"""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job
+        async with AsyncSessionLocal() as db:
+            row = await async_crud.get_chat_job(db, job_id)
+        if row is None:
+            return None
+        job = ChatJob.from_row(row)
+        if job.finished:
+            self._jobs[job.job_id] = job
+        return job
+
+    async def wait(self, job, after, timeout):
+        """after より新しいイベントが届くか、ジョブが終わるか、timeout 秒たつまで待つ（long-poll）"""
+        async with job.changed:
+            try:
+                await asyncio.wait_for(
+                    job.changed.wait_for(lambda: len(job.events) > after or job.finished),
+                    timeout
+                )
+            except asyncio.TimeoutError:
+                pass
+        return job
+
+    async def _enqueue(self, job):
+        self._queues.setdefault(job.user_id or "", deque()).append(job)
+        self._queued += 1
+        async with self._wakeup:
+            self._wakeup.notify()
+
+    async def _next_job(self):
+        async with self._wakeup:
+            await self._wakeup.wait_for(lambda: self._queued > 0)
+            user_key, queue = next(iter(self._queues.items()))
+            job = queue.popleft()
+            self._queued -= 1
+            # 次は別のユーザーのジョブを取り出す
+            if queue:
+                self._queues.move_to_end(user_key)
+            else:
+                del self._queues[user_key]
+            return job
+
+    async def _recover(self):
+        """前回の実行で完了しなかったジョブを再開する"""
+        try:
+            async with AsyncSessionLocal() as db:
+                rows = await async_crud.get_unfinished_chat_jobs(db)
+        except Exception as e:
+            print(f"チャットジョブの復元に失敗しました: {str(e)}")
+            return
+        for row in rows:
+            job = ChatJob.from_row(row)
+            if job.status != TEXT_READY:
+                # テキスト生成前に止まったジョブは最初からやり直す
+                job.status = QUEUED
+            self._jobs[job.job_id] = job
+            await self._enqueue(job)
+        if rows:
+            print(f"未完了のチャットジョブ {len(rows)} 件を再開します")
+
+    async def _save(self, job, fields):
+        columns = dict(fields)
+        if "text" in columns:
+            columns["response_text"] = columns.pop("text")
+        if "audio_segments" in columns:
+            columns["audio_segments"] = json.dumps(columns["audio_segments"])
+        columns.pop("finished_at", None)
+        columns.pop("audio_stream_url", None)
+        if not columns:
+            return
+        async with AsyncSessionLocal() as db:
+            await async_crud.update_chat_job(db, job.job_id, **columns)
+
+    async def _emit(self, job, events, **fields):
+        """
+        ジョブの状態をDBに保存してから反映し、イベントを追加して待機中のクライアントに知らせる
+        （クライアントから見える状態は常に保存済みのもの）
+        """
+        await self._save(job, fields)
+        async with job.changed:
+            for key, value in fields.items():
+                setattr(job, key, value)
+            job.events.extend(events)
+            job.changed.notify_all()
+
+    async def _worker(self):
+        while True:
+            job = await self._next_job()
+            try:
+                await asyncio.wait_for(self._process(job), timeout=self.timeout)
+                self.completed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                if isinstance(e, asyncio.TimeoutError):
+                    detail = "処理に時間がかかりすぎています。もう少し短いメッセージでお試しください。"
+                elif isinstance(e, HTTPException):
+                    detail = e.detail
+                else:
+                    detail = str(e)
+                print(f"チャットジョブエラー: {job.job_id}: {detail}")
+                try:
+                    await self._save(job, {"status": FAILED, "error": detail})
+                except Exception as db_err:
+                    print(f"チャットジョブの状態を保存できませんでした: {job.job_id}: {str(db_err)}")
+                async with job.changed:
+                    job.status = FAILED
+                    job.error = detail
+                    job.finished_at = time.time()
+                    job.events.append({"type": "error", "detail": detail})
+                    job.changed.notify_all()
+
+    async def _process(self, job):
+        async with AsyncSessionLocal() as db:
+            agent = await agent_cache.get(db, job.agent_id)
+            if agent is None:
+                raise HTTPException(status_code=404, detail="Agent not found")
+            if job.status != TEXT_READY:
+                messages = await context_builder.build_messages(db, agent, job.user_id, job.user_message)
+
+        if job.status != TEXT_READY:
+            await self._emit(job, [{"type": "status", "status": RUNNING}], status=RUNNING)
+
+            text = await api_service.generate_chat_text(messages)
+
+            # テキストができた時点で返し、会話履歴も保存する（音声合成の完了を待たない）
+            await self._emit(job, [{"type": "text", "text": text}], status=TEXT_READY, text=text)
+            if job.user_id:
+                await save_conversation(job.user_id, job.agent_id, job.user_message, text)
+
+        async def on_audio_start(index, filename):
+            # 合成の完了を待たずに、書き込み中の音声を受け取れるURLを知らせる
+            audio_stream_url = f"/chat/audio/{filename}"
+            fields = {} if job.audio_stream_url else {"audio_stream_url": audio_stream_url}
+            await self._emit(job, [{"type": "audio_start", "index": index, "audio_url": audio_stream_url}], **fields)
+        
+        audio_path, segments = None, []
+        audio_result = await api_service.synthesize_text_streaming(
+            job.text, VoiceSettings.from_agent(agent), on_audio_start
+        )
+        if audio_result is not None:
+            audio_path, segments = audio_result["filepath"], audio_result["segments"]
+        audio_event = {
+            "type": "audio",
+            "audio_url": audio_url_for(audio_path),
+            "audio_segments": [audio_url_for(path) for path in segments],
+        }
+        await self._emit(
+            job,
+            [audio_event, {"type": "done"}],
+            status=DONE,
+            audio_path=audio_path,
+            audio_segments=segments,
+            finished_at=time.time(),
+        )
+
+        if job.user_id:
+            # 予算からあふれた古い会話の要約はワーカーを占有せずに行う
+            task = asyncio.create_task(context_builder.summarize(job.user_id, job.agent_id))
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+
+    def _prune(self):
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished_at and now - job.finished_at > CHAT_JOB_TTL
+        ]
+        for job_id in expired:
+            self._jobs.pop(job_id, None)
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "queued": self._queued,
+            "users_waiting": len(self._queues),
+            "running": sum(1 for job in self._jobs.values() if job.status in (RUNNING, TEXT_READY)),
+            "in_memory": len(self._jobs),
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
+
+# アプリケーション全体で共有するスケジューラー
+chat_jobs = ChatJobScheduler()
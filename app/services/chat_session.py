@@ -0,0 +1,98 @@
+import uuid
+import asyncio
+from collections import deque
+from app.db.database import AsyncSessionLocal
+from app.services import api_service
+from app.services.agent_cache import agent_cache
+from app.services.context_builder import context_builder, build_system_message, SummaryState
+from app.services.history_cache import history_cache, save_conversation, ConversationTurn, HISTORY_WINDOW
+from app.services.voice_settings import VoiceSettings
+
+# 接続が閉じた後も実行中の要約を最後まで続けるため、タスクへの参照を保持する
+_background_tasks = set()
+
+class ChatSession:
+    """
+    WebSocket接続ごとの会話セッション
+    エージェント設定・要約・直近の会話ターンを接続中はメモリに保持し、メッセージごとの読み込みをしない
+    上流への接続は http_clients の共有クライアントを使う
+    """
+
+    def __init__(self, agent, user_id):
+        self.session_id = uuid.uuid4().hex
+        self.agent = agent
+        self.user_id = user_id
+        self.voice_settings = VoiceSettings.from_agent(agent)
+        self.summary = SummaryState()
+        self.turns = deque(maxlen=HISTORY_WINDOW)
+        self.turn_count = 0
+        self._summarize_task = None
+
+    @classmethod
+    async def open(cls, agent_id, user_id=None):
+        """エージェントと会話履歴を読み込んでセッションを作る（エージェントがなければ None）"""
+        async with AsyncSessionLocal() as db:
+            agent = await agent_cache.get(db, agent_id)
+            if agent is None:
+                return None
+            session = cls(agent, user_id)
+            if user_id:
+                session.summary = await context_builder.get_summary(db, user_id, agent_id)
+                turns = await history_cache.get_recent(db, user_id=user_id, agent_id=agent_id, limit=HISTORY_WINDOW)
+                session.turns.extend(session._unsummarized(turns))
+        return session
+
+    def _unsummarized(self, turns):
+        return [turn for turn in turns if not self.summary.covers(turn)]
+
+    async def _refresh_summary(self):
+        """バックグラウンドの要約が終わっていれば、新しい要約を取り込む"""
+        if self._summarize_task is None or not self._summarize_task.done():
+            return
+        self._summarize_task = None
+        async with AsyncSessionLocal() as db:
+            state = await context_builder.get_summary(db, self.user_id, self.agent.agent_id)
+        if state.covered_until_id != self.summary.covered_until_id:
+            self.summary = state
+            self.turns = deque(self._unsummarized(self.turns), maxlen=HISTORY_WINDOW)
+
+    async def build_messages(self, user_message):
+        """保持している要約と会話ターンから、トークン予算に収まるメッセージを組み立てる"""
+        await self._refresh_summary()
+        system_message = build_system_message(self.agent.system_prompt, self.summary.summary)
+        selected = context_builder.fit_turns(
+            list(self.turns),
+            context_builder.history_budget(system_message, user_message)
+        )
+        messages = [system_message]
+        for turn in selected:
+            messages.append({"role": "user", "content": turn.user_message})
+            messages.append({"role": "assistant", "content": turn.agent_response})
+        messages.append({"role": "user", "content": user_message})
+        return messages
+
+    async def stream_turn(self, user_message):
+        """
+        1ターン分のテキスト差分と文ごとの音声のイベントを返す（イベントは stream_chat_and_voice と同じ）
+        応答が完了したら会話ターンを保持し、ユーザーIDがあれば保存する
+        """
+        self.turn_count += 1
+        messages = await self.build_messages(user_message)
+        async for event in api_service.stream_chat_and_voice(messages, self.voice_settings):
+            if event["type"] == "done" and event["text"]:
+                await self._record(user_message, event["text"])
+            yield event
+
+    async def _record(self, user_message, text):
+        created_at = None
+        if self.user_id:
+            conversation = await save_conversation(self.user_id, self.agent.agent_id, user_message, text)
+            created_at = conversation.created_at
+            # 予算からあふれた古い会話の要約は次のメッセージを待たずに進める
+            if self._summarize_task is None:
+                self._summarize_task = asyncio.create_task(
+                    context_builder.summarize(self.user_id, self.agent.agent_id)
+                )
+                _background_tasks.add(self._summarize_task)
+                self._summarize_task.add_done_callback(_background_tasks.discard)
+        self.turns.append(ConversationTurn(user_message, text, created_at))
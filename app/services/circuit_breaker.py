@@ -0,0 +1,169 @@
+import os
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+import httpx
+from fastapi import HTTPException
+from dotenv import load_dotenv
+from app.services import http_clients
+
+# 環境変数の読み込み
+load_dotenv()
+
+# 直近何回の呼び出しでエラー率・低速率を判定するか
+CIRCUIT_WINDOW_SIZE = int(os.getenv("CIRCUIT_WINDOW_SIZE", "20"))
+# 判定に必要な最小の呼び出し回数
+CIRCUIT_MIN_CALLS = int(os.getenv("CIRCUIT_MIN_CALLS", "5"))
+# これ以上のエラー率・低速率でサーキットを開く
+CIRCUIT_FAILURE_RATE = float(os.getenv("CIRCUIT_FAILURE_RATE", "0.5"))
+CIRCUIT_SLOW_CALL_RATE = float(os.getenv("CIRCUIT_SLOW_CALL_RATE", "0.8"))
+# サーキットを開いてから試行（半開）に移るまでの時間（秒）
+CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", "30"))
+# 半開状態で同時に通す試行の数
+CIRCUIT_HALF_OPEN_CALLS = int(os.getenv("CIRCUIT_HALF_OPEN_CALLS", "1"))
+
+# 上流ごとの「遅い呼び出し」とみなす時間（秒）
+CIRCUIT_SLOW_SECONDS = {
+    http_clients.LLM: float(os.getenv("CIRCUIT_LLM_SLOW_SECONDS", "90")),
+    http_clients.VOICEVOX: float(os.getenv("CIRCUIT_VOICEVOX_SLOW_SECONDS", "20")),
+    http_clients.CUSTOM_VOICE: float(os.getenv("CIRCUIT_CUSTOM_VOICE_SLOW_SECONDS", "60")),
+}
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class CircuitOpenError(Exception):
+    """サーキットが開いているため上流を呼ばずに失敗した"""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} のサーキットが開いています（{retry_after:.0f}秒後に再試行）")
+        self.name = name
+        self.retry_after = retry_after
+
+def is_upstream_failure(error):
+    """
+    上流の障害とみなすエラーか
+    接続エラー・タイムアウト・5xx は障害、4xx などリクエスト側の誤りは含めない
+    """
+    if isinstance(error, (httpx.TransportError, asyncio.TimeoutError)):
+        return True
+    status_code = getattr(error, "status_code", None)
+    if isinstance(error, HTTPException) or status_code is not None:
+        return status_code is None or status_code >= 500
+    return True
+
+class CircuitBreaker:
+    """
+    上流ごとのサーキットブレーカー
+    直近の呼び出しのエラー率か低速率がしきい値を超えると開き（即座に失敗させる）、
+    一定時間後に半開で少数の試行を通して、成功すれば閉じる
+    """
+
+    def __init__(self, name, slow_seconds, window_size=CIRCUIT_WINDOW_SIZE, min_calls=CIRCUIT_MIN_CALLS,
+                 failure_rate=CIRCUIT_FAILURE_RATE, slow_call_rate=CIRCUIT_SLOW_CALL_RATE,
+                 open_seconds=CIRCUIT_OPEN_SECONDS, half_open_calls=CIRCUIT_HALF_OPEN_CALLS):
+        self.name = name
+        self.slow_seconds = slow_seconds
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self.state = CLOSED
+        self._window = deque(maxlen=window_size)  # (失敗したか, 遅かったか)
+        self._opened_at = 0.0
+        self._half_open_in_flight = 0
+        self.rejected = 0
+        self.opened = 0
+
+    def _transition(self, state):
+        if self.state != state:
+            print(f"サーキットブレーカー {self.name}: {self.state} -> {state}")
+        self.state = state
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+            self.opened += 1
+        self._window.clear()
+        self._half_open_in_flight = 0
+
+    def retry_after(self):
+        return max(self._opened_at + self.open_seconds - time.monotonic(), 0.0)
+
+    def allow(self):
+        """
+        呼び出しを通すか判定する（通さない場合は CircuitOpenError）
+        戻り値: 半開状態の試行として通した場合は True
+        """
+        if self.state == OPEN:
+            if self.retry_after() > 0:
+                self.rejected += 1
+                raise CircuitOpenError(self.name, self.retry_after())
+            self._transition(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            if self._half_open_in_flight >= self.half_open_calls:
+                self.rejected += 1
+                raise CircuitOpenError(self.name, self.open_seconds)
+            self._half_open_in_flight += 1
+            return True
+        return False
+
+    def record(self, failed, duration, probe=False):
+        slow = duration >= self.slow_seconds
+        if probe:
+            # 試行が失敗・低速なら再び開き、成功すれば閉じる
+            if self.state == HALF_OPEN:
+                self._transition(OPEN if failed or slow else CLOSED)
+            return
+        # 開く前に始まった呼び出しの結果は、状態が変わった後には数えない
+        if self.state != CLOSED:
+            return
+        self._window.append((failed, slow))
+        calls = len(self._window)
+        if calls < self.min_calls:
+            return
+        failures = sum(1 for f, _ in self._window if f)
+        slows = sum(1 for _, s in self._window if s)
+        if failures / calls >= self.failure_rate or slows / calls >= self.slow_call_rate:
+            self._transition(OPEN)
+
+    @asynccontextmanager
+    async def guard(self):
+        """上流の呼び出しを囲み、結果と所要時間を記録する"""
+        probe = self.allow()
+        start = time.monotonic()
+        try:
+            yield self
+        except (asyncio.CancelledError, GeneratorExit):
+            # キャンセルや読み込みの中断は成否に数えない（半開の試行枠だけ戻す）
+            if probe and self.state == HALF_OPEN:
+                self._half_open_in_flight = max(self._half_open_in_flight - 1, 0)
+            raise
+        except Exception as e:
+            self.record(is_upstream_failure(e), time.monotonic() - start, probe)
+            raise
+        else:
+            self.record(False, time.monotonic() - start, probe)
+
+    def stats(self):
+        calls = len(self._window)
+        return {
+            "state": self.state,
+            "calls": calls,
+            "failure_rate": sum(1 for f, _ in self._window if f) / calls if calls else 0.0,
+            "slow_call_rate": sum(1 for _, s in self._window if s) / calls if calls else 0.0,
+            "slow_seconds": self.slow_seconds,
+            "retry_after": self.retry_after() if self.state == OPEN else 0.0,
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
+
+# 上流ごとのサーキットブレーカー
+breakers = {name: CircuitBreaker(name, CIRCUIT_SLOW_SECONDS[name]) for name in http_clients.UPSTREAMS}
+
+def get_breaker(name):
+    return breakers[name]
+
+def stats():
+    return {name: breaker.stats() for name, breaker in breakers.items()}
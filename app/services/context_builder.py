@@ -0,0 +1,251 @@
+import os
+import re
+import math
+import asyncio
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+from dotenv import load_dotenv
+from app.crud import async_crud
+from app.db.database import AsyncSessionLocal
+from app.services import api_service
+from app.services.agent_cache import agent_cache
+from app.services.history_cache import history_cache, HISTORY_WINDOW, HISTORY_CACHE_MAX_KEYS
+
+# 環境変数の読み込み
+load_dotenv()
+
+# LLMに送るプロンプト（システムプロンプト・要約・履歴・ユーザーメッセージ）のトークン数の上限
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2048"))
+# 日本語（かな・漢字・全角文字）1文字あたりのトークン数の見積もり
+CONTEXT_CJK_TOKENS_PER_CHAR = float(os.getenv("CONTEXT_CJK_TOKENS_PER_CHAR", "1.0"))
+# 要約の最大文字数
+SUMMARY_MAX_CHARS = int(os.getenv("SUMMARY_MAX_CHARS", "400"))
+# 一度の要約に含める会話ターン数の上限
+SUMMARY_BATCH_TURNS = int(os.getenv("SUMMARY_BATCH_TURNS", "10"))
+# 予算からあふれたターンがこの数以上たまったら要約する
+SUMMARY_MIN_TURNS = int(os.getenv("SUMMARY_MIN_TURNS", "2"))
+
+# メッセージ1件ごとの役割・区切りのトークン数
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# 全角記号・かな・漢字・全角英数
+_CJK_PATTERN = re.compile("[\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]")
+
+SUMMARY_SYSTEM_PROMPT = (
+    "あなたは会話の要約を作成するアシスタントです。"
+    "ユーザーの名前・好み・約束・話題など、今後の会話に必要な事実を残して簡潔に要約してください。"
+)
+
+def estimate_tokens(text):
+    """
+    テキストのトークン数を概算する
+    日本語は1文字あたり CONTEXT_CJK_TOKENS_PER_CHAR、それ以外は空白を除く4文字で1トークンとして数える
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    other = len(re.sub(r"\s", "", text)) - cjk
+    return math.ceil(cjk * CONTEXT_CJK_TOKENS_PER_CHAR + other / 4)
+
+def estimate_message_tokens(message):
+    return estimate_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+def estimate_turn_tokens(turn):
+    return (
+        estimate_tokens(turn.user_message)
+        + estimate_tokens(turn.agent_response)
+        + MESSAGE_OVERHEAD_TOKENS * 2
+    )
+
+def build_system_message(system_prompt, summary):
+    """システムプロンプトに会話の要約を付け加える"""
+    if not summary:
+        return {"role": "system", "content": system_prompt}
+    return {"role": "system", "content": f"{system_prompt}\n\nこれまでの会話の要約:\n{summary}"}
+
+@dataclass(frozen=True)
+class SummaryState:
+    summary: str = ""
+    covered_until_id: int = 0
+    # 要約した最後のターンの作成時刻
+    covered_until_at: Optional[datetime] = None
+
+    def covers(self, turn):
+        """ターンが要約に含まれているか"""
+        if turn.id is not None:
+            return turn.id <= self.covered_until_id
+        # 書き込み待ちでIDのないターンは、要約した最後のターンの作成時刻と比べる
+        return (
+            self.covered_until_at is not None
+            and turn.created_at is not None
+            and turn.created_at <= self.covered_until_at
+        )
+
+class ContextBuilder:
+    """
+    トークン予算の範囲でLLMに送るメッセージを組み立てる
+    予算に収まらない古い会話はバックグラウンドで要約し、(ユーザー, エージェント) ごとに保存する
+    """
+
+    def __init__(self, budget=CONTEXT_TOKEN_BUDGET, max_keys=HISTORY_CACHE_MAX_KEYS):
+        self.budget = budget
+        self.max_keys = max_keys
+        self._summaries = OrderedDict()  # (user_id, agent_id) -> SummaryState
+        self._locks = {}
+        self.summaries_created = 0
+        self.turns_dropped = 0
+
+    async def get_summary(self, db, user_id, agent_id):
+        key = (user_id, agent_id)
+        state = self._summaries.get(key)
+        if state is not None:
+            self._summaries.move_to_end(key)
+            return state
+        db_summary = await async_crud.get_conversation_summary(db, user_id, agent_id)
+        if db_summary is None:
+            state = SummaryState()
+        else:
+            covered = await async_crud.get_conversation(db, db_summary.covered_until_id)
+            state = SummaryState(
+                db_summary.summary,
+                db_summary.covered_until_id,
+                covered.created_at if covered else None
+            )
+        self._store_summary(key, state)
+        return state
+
+    def _store_summary(self, key, state):
+        self._summaries[key] = state
+        self._summaries.move_to_end(key)
+        while len(self._summaries) > self.max_keys:
+            self._summaries.popitem(last=False)
+
+    def history_budget(self, system_message, user_message):
+        """履歴に使えるトークン数（システムメッセージとユーザーメッセージを除いた残り）"""
+        used = estimate_message_tokens(system_message) + estimate_tokens(user_message) + MESSAGE_OVERHEAD_TOKENS
+        return max(self.budget - used, 0)
+
+    @staticmethod
+    def fit_turns(turns, budget):
+        """新しいターンから順に予算に収まるだけ選び、古い順で返す"""
+        selected = []
+        used = 0
+        for turn in reversed(turns):
+            tokens = estimate_turn_tokens(turn)
+            if used + tokens > budget:
+                break
+            selected.append(turn)
+            used += tokens
+        selected.reverse()
+        return selected
+
+    async def build_messages(self, db, agent, user_id, user_message):
+        """
+        システムプロンプト・要約・会話履歴・ユーザーメッセージからLLMへのメッセージを組み立てる
+        """
+        if not user_id:
+            return [
+                build_system_message(agent.system_prompt, ""),
+                {"role": "user", "content": user_message},
+            ]
+
+        state = await self.get_summary(db, user_id, agent.agent_id)
+        system_message = build_system_message(agent.system_prompt, state.summary)
+
+        # 要約済みのターンは除き、新しいものから予算に収まるだけ使う
+        turns = await history_cache.get_recent(db, user_id=user_id, agent_id=agent.agent_id, limit=HISTORY_WINDOW)
+        turns = [turn for turn in turns if not state.covers(turn)]
+        selected = self.fit_turns(turns, self.history_budget(system_message, user_message))
+        self.turns_dropped += len(turns) - len(selected)
+
+        messages = [system_message]
+        for turn in selected:
+            messages.append({"role": "user", "content": turn.user_message})
+            messages.append({"role": "assistant", "content": turn.agent_response})
+        messages.append({"role": "user", "content": user_message})
+        return messages
+
+    async def summarize(self, user_id, agent_id):
+        """
+        予算からあふれた古い会話を要約に畳み込む（レスポンス送信後のバックグラウンド処理）
+        同じ (ユーザー, エージェント) の要約は同時に1つだけ実行する
+        """
+        if not user_id:
+            return
+        key = (user_id, agent_id)
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        if lock.locked():
+            return
+        try:
+            async with lock:
+                async with AsyncSessionLocal() as db:
+                    while await self._summarize_batch(db, user_id, agent_id):
+                        pass
+        except Exception as e:
+            print(f"会話の要約に失敗しました: {str(e)}")
+        finally:
+            self._locks.pop(key, None)
+
+    async def _summarize_batch(self, db, user_id, agent_id):
+        """要約が必要なターンを1回分要約する。要約した場合は True を返す"""
+        agent = await agent_cache.get(db, agent_id)
+        if agent is None:
+            return False
+        state = await self.get_summary(db, user_id, agent_id)
+
+        # 未要約の会話が大量にある場合（導入前からの履歴など）は、最新の範囲だけを対象にする
+        turns = await async_crud.get_conversations_after(
+            db, user_id, agent_id, state.covered_until_id, limit=SUMMARY_BATCH_TURNS + HISTORY_WINDOW
+        )
+        if not turns:
+            return False
+        # 次のリクエストで履歴に使える予算（ユーザーメッセージ分は最新ターンと同程度と見積もる）
+        system_message = build_system_message(agent.system_prompt, state.summary)
+        budget = self.history_budget(system_message, turns[-1].user_message)
+        kept = self.fit_turns(turns, budget)
+        overflow = turns[:len(turns) - len(kept)][:SUMMARY_BATCH_TURNS]
+        if len(overflow) < SUMMARY_MIN_TURNS:
+            return False
+
+        summary = await self._generate_summary(state.summary, overflow)
+        if not summary:
+            return False
+        covered_until_id = overflow[-1].id
+        await async_crud.save_conversation_summary(db, user_id, agent_id, summary, covered_until_id)
+        self._store_summary((user_id, agent_id), SummaryState(summary, covered_until_id, overflow[-1].created_at))
+        self.summaries_created += 1
+        print(f"会話を要約しました: user={user_id}, agent={agent_id}, turns={len(overflow)}, covered_until={covered_until_id}")
+        return True
+
+    async def _generate_summary(self, previous_summary, turns):
+        transcript = "\n".join(
+            f"ユーザー: {turn.user_message}\nアシスタント: {turn.agent_response}" for turn in turns
+        )
+        content = ""
+        if previous_summary:
+            content += f"これまでの要約:\n{previous_summary}\n\n"
+        content += f"続きの会話:\n{transcript}\n\n上記をまとめて{SUMMARY_MAX_CHARS}文字以内で要約してください。"
+        response = await api_service.create_chat_response([
+            {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+            {"role": "user", "content": content},
+        ])
+        summary = response.get("message", {}).get("content", "").strip()
+        # 指示より長い要約は次回のプロンプトを圧迫するため切り詰める
+        return summary[:SUMMARY_MAX_CHARS * 2]
+
+    def invalidate(self, user_id, agent_id):
+        self._summaries.pop((user_id, agent_id), None)
+
+    def stats(self):
+        return {
+            "budget": self.budget,
+            "summaries_cached": len(self._summaries),
+            "summaries_created": self.summaries_created,
+            "turns_dropped": self.turns_dropped,
+            "summarizing": len(self._locks),
+        }
+
+# アプリケーション全体で共有するコンテキストビルダー
+context_builder = ContextBuilder()
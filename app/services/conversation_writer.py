@@ -0,0 +1,159 @@
+import os
+import asyncio
+from datetime import datetime
+from dataclasses import dataclass, field, asdict
+from dotenv import load_dotenv
+from app.crud import async_crud
+from app.db.database import AsyncSessionLocal
+
+# 環境変数の読み込み
+load_dotenv()
+
+# 1回の書き込みでまとめる会話の最大件数
+CONVERSATION_WRITE_BATCH_SIZE = int(os.getenv("CONVERSATION_WRITE_BATCH_SIZE", "50"))
+# 最初の会話がキューに入ってから書き込むまでの最大待ち時間（秒）
+CONVERSATION_FLUSH_INTERVAL = float(os.getenv("CONVERSATION_FLUSH_INTERVAL", "0.5"))
+CONVERSATION_WRITE_QUEUE_SIZE = int(os.getenv("CONVERSATION_WRITE_QUEUE_SIZE", "10000"))
+# 書き込みに失敗したバッチを再試行する回数
+CONVERSATION_WRITE_RETRIES = int(os.getenv("CONVERSATION_WRITE_RETRIES", "3"))
+
+@dataclass(frozen=True)
+class PendingConversation:
+    user_id: str
+    agent_id: str
+    user_message: str
+    agent_response: str
+    # 保存順と履歴の並び順を一致させるため、キューに入れた時刻を created_at にする（UTC）
+    created_at: datetime = field(default_factory=datetime.utcnow)
+
+    def to_row(self):
+        return asdict(self)
+
+class ConversationWriter:
+    """
+    会話履歴を追記専用で書き込むライター
+    リクエストはキューに入れるだけで返り、バックグラウンドのタスクが件数・時間のしきい値か
+    停止時にまとめて1トランザクションで保存する
+    保存前の会話は pending_for で参照できる（履歴キャッシュの読み込み時に合流させる）
+    """
+
+    def __init__(self, batch_size=CONVERSATION_WRITE_BATCH_SIZE, flush_interval=CONVERSATION_FLUSH_INTERVAL,
+                 max_queue=CONVERSATION_WRITE_QUEUE_SIZE, retries=CONVERSATION_WRITE_RETRIES):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.retries = retries
+        self._queue = None
+        self._task = None
+        # (user_id, agent_id) -> まだコミットされていない会話
+        self._pending = {}
+        self.written = 0
+        self.batches = 0
+        self.failures = 0
+        self.dropped = 0
+
+    def start(self):
+        if self._task:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._task = asyncio.create_task(self._worker())
+
+    async def stop(self):
+        """キューに残っている会話をすべて書き込んでから停止する"""
+        if not self._task:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    async def submit(self, user_id, agent_id, user_message, agent_response):
+        """会話を書き込みキューに入れる（キューが満杯の間は待つ）"""
+        conversation = PendingConversation(user_id, agent_id, user_message, agent_response)
+        self._pending.setdefault((user_id, agent_id), []).append(conversation)
+        if self._task is None:
+            # ワーカーが動いていない場合（スクリプトからの利用など）はその場で書き込む
+            await self._flush([conversation])
+            return conversation
+        await self._queue.put(conversation)
+        return conversation
+
+    def pending_for(self, user_id, agent_id):
+        """まだコミットされていない会話を古い順に返す"""
+        return list(self._pending.get((user_id, agent_id), ()))
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+        # 停止要求の後に入った会話も書き込む
+        remaining = []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not None:
+                remaining.append(item)
+        for start in range(0, len(remaining), self.batch_size):
+            await self._flush(remaining[start:start + self.batch_size])
+
+    async def _flush(self, batch):
+        for attempt in range(1, self.retries + 1):
+            try:
+                async with AsyncSessionLocal() as db:
+                    await async_crud.create_conversations(db, [conversation.to_row() for conversation in batch])
+                self.written += len(batch)
+                break
+            except Exception as e:
+                self.failures += 1
+                print(f"会話履歴の書き込みに失敗しました（{attempt}/{self.retries}）: {str(e)}")
+                if attempt < self.retries:
+                    await asyncio.sleep(self.flush_interval * attempt)
+        else:
+            self.dropped += len(batch)
+            print(f"会話履歴 {len(batch)} 件を破棄しました")
+        self.batches += 1
+        self._remove_pending(batch)
+
+    def _remove_pending(self, batch):
+        for conversation in batch:
+            key = (conversation.user_id, conversation.agent_id)
+            pending = self._pending.get(key)
+            if not pending:
+                continue
+            try:
+                pending.remove(conversation)
+            except ValueError:
+                pass
+            if not pending:
+                self._pending.pop(key, None)
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize() if self._queue else 0,
+            "pending": sum(len(pending) for pending in self._pending.values()),
+            "written": self.written,
+            "batches": self.batches,
+            "average_batch": self.written / self.batches if self.batches else 0.0,
+            "failures": self.failures,
+            "dropped": self.dropped,
+        }
+
+# アプリケーション全体で共有するライター
+conversation_writer = ConversationWriter()
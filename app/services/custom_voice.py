@@ -0,0 +1,166 @@
+import os
+import uuid
+import asyncio
+import hashlib
+import aiofiles
+from dotenv import load_dotenv
+from app.services import http_clients
+
+# 環境変数の読み込み
+load_dotenv()
+
+# カスタム音声合成サービスのURL
+VOICE_SYNTHESIS_URL = os.getenv("CUSTOM_VOICE_API_URL", "http://localhost:8000")
+AUDIO_DIR = "audio_files"
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# 参照音声が外部サービスに存在しないことを示すエラーメッセージ
+_MISSING_REFERENCE_MARKERS = ("not found", "no such file", "does not exist", "見つかりません")
+
+# (サービスのURL, エージェントID) ごとにアップロード済みの参照音声 (sha256, mtime_ns)
+_uploaded = {}
+# 参照音声のハッシュ値キャッシュ: path -> (mtime_ns, size, sha256)
+_digests = {}
+
+def reference_path(agent_id):
+    """エージェントの参照音声のパス"""
+    return os.path.join(AUDIO_DIR, f"{agent_id}.wav")
+
+async def _iter_file(path):
+    async with aiofiles.open(path, "rb") as f:
+        while True:
+            chunk = await f.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+def _multipart_parts(boundary, fields, file_field, filename, content_type):
+    """multipart/form-data のファイル部以外（前後）のバイト列を作る"""
+    head = b""
+    for name, value in fields.items():
+        head += (
+            f"--{boundary}\r\n"
+            f"Content-Disposition: form-data; name=\"{name}\"\r\n\r\n"
+            f"{value}\r\n"
+        ).encode()
+    head += (
+        f"--{boundary}\r\n"
+        f"Content-Disposition: form-data; name=\"{file_field}\"; filename=\"{filename}\"\r\n"
+        f"Content-Type: {content_type}\r\n\r\n"
+    ).encode()
+    tail = f"\r\n--{boundary}--\r\n".encode()
+    return head, tail
+
+def _sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+async def reference_digest(path):
+    """
+    参照音声の (sha256, mtime_ns) を返す
+    mtime とサイズが変わっていなければハッシュは再計算しない
+    """
+    st = os.stat(path)
+    cached = _digests.get(path)
+    if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+        return cached[2], st.st_mtime_ns
+    sha256 = await asyncio.to_thread(_sha256_file, path)
+    _digests[path] = (st.st_mtime_ns, st.st_size, sha256)
+    return sha256, st.st_mtime_ns
+
+def forget(agent_id):
+    """すべてのサービスについてアップロード済みの記録を消す（参照音声の削除時など）"""
+    for key in [key for key in _uploaded if key[1] == agent_id]:
+        _uploaded.pop(key, None)
+    _digests.pop(reference_path(agent_id), None)
+
+def is_missing_reference(response):
+    """外部サービスが参照音声を持っていないことを示す応答か判定する"""
+    if response.status_code == 404:
+        return True
+    if response.status_code in (400, 422, 500):
+        body = response.text.lower()
+        return any(marker in body for marker in _MISSING_REFERENCE_MARKERS)
+    return False
+
+async def upload_reference(agent_id, path=None, timeout=120.0, base_url=VOICE_SYNTHESIS_URL):
+    """
+    参照音声をカスタム音声合成サービスにアップロードする
+    ファイル全体をメモリに読み込まず、チャンク単位でストリーミング送信する
+    """
+    path = path or reference_path(agent_id)
+    fingerprint = await reference_digest(path)
+    boundary = uuid.uuid4().hex
+    head, tail = _multipart_parts(boundary, {"filename": agent_id}, "file", f"{agent_id}.wav", "audio/wav")
+    content_length = len(head) + os.path.getsize(path) + len(tail)
+
+    async def body():
+        yield head
+        async for chunk in _iter_file(path):
+            yield chunk
+        yield tail
+
+    client = http_clients.get_client(http_clients.CUSTOM_VOICE)
+    print(f"外部音声合成サービスにアップロード中: {base_url}/upload")
+    response = await client.post(
+        f"{base_url}/upload",
+        content=body(),
+        headers={
+            "Content-Type": f"multipart/form-data; boundary={boundary}",
+            "Content-Length": str(content_length),
+        },
+        timeout=timeout
+    )
+    if response.status_code == 200:
+        _uploaded[(base_url, agent_id)] = fingerprint
+    else:
+        _uploaded.pop((base_url, agent_id), None)
+    return response
+
+async def ensure_uploaded(agent_id, force=False, base_url=VOICE_SYNTHESIS_URL):
+    """
+    参照音声が未アップロード、または前回のアップロード後に変更された場合のみアップロードする
+    戻り値: アップロードを行った場合はそのレスポンス、不要だった場合は None
+    """
+    path = reference_path(agent_id)
+    if not force and _uploaded.get((base_url, agent_id)) == await reference_digest(path):
+        return None
+    return await upload_reference(agent_id, path, base_url=base_url)
+
+async def generate(text, agent_id, timeout=120.0, base_url=VOICE_SYNTHESIS_URL):
+    """
+    参照音声を使ってカスタム音声合成を実行する
+    """
+    synthesis_data = {
+        'text': text,
+        'wav_filename': f"{agent_id}.wav",  # 保存済みのエージェントIDを使用
+        'language': 'ja'
+    }
+    generate_url = f"{base_url}/generate"
+    print(f"音声合成リクエスト送信中: {generate_url}")
+    print(f"音声合成パラメータ: {synthesis_data}")
+
+    client = http_clients.get_client(http_clients.CUSTOM_VOICE)
+    return await client.post(generate_url, data=synthesis_data, timeout=timeout)
+
+async def generate_with_reference(text, agent_id, timeout=120.0, base_url=VOICE_SYNTHESIS_URL):
+    """
+    必要な場合だけ参照音声をアップロードしてから合成する
+    外部サービスが参照音声を持っていない（再起動など）と応答した場合は、再アップロードして1回だけ再試行する
+    """
+    try:
+        upload_response = await ensure_uploaded(agent_id, base_url=base_url)
+        if upload_response is not None and upload_response.status_code != 200:
+            print(f"警告: 参照音声のアップロードでエラー: {upload_response.status_code} {upload_response.reason_phrase}")
+    except Exception as upload_err:
+        print(f"参照音声のアップロード中にエラー（無視して続行）: {str(upload_err)}")
+
+    response = await generate(text, agent_id, timeout=timeout, base_url=base_url)
+    if is_missing_reference(response):
+        print(f"外部サービスに参照音声がないため再アップロードします: agent_id={agent_id}")
+        await ensure_uploaded(agent_id, force=True, base_url=base_url)
+        response = await generate(text, agent_id, timeout=timeout, base_url=base_url)
+    return response
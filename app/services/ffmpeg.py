@@ -0,0 +1,52 @@
+import os
+import asyncio
+from dotenv import load_dotenv
+
+# 環境変数の読み込み
+load_dotenv()
+
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")
+FFMPEG_MAX_WORKERS = int(os.getenv("FFMPEG_MAX_WORKERS", "2"))
+FFMPEG_TIMEOUT = float(os.getenv("FFMPEG_TIMEOUT", "60"))
+
+class FFmpegError(Exception):
+    """ffmpeg の実行に失敗した"""
+
+# 同時に実行する ffmpeg プロセス数の上限（ワーカープール）
+_semaphore = None
+
+def _get_semaphore():
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(FFMPEG_MAX_WORKERS)
+    return _semaphore
+
+async def run_ffmpeg(args, timeout=FFMPEG_TIMEOUT, input_data=None):
+    """
+    ffmpeg を非同期サブプロセスとして実行する（イベントループをブロックしない）
+    失敗・タイムアウト時は FFmpegError を送出する
+    """
+    cmd = [FFMPEG_BINARY, "-hide_banner", "-loglevel", "error", "-y", *args]
+    async with _get_semaphore():
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdin=asyncio.subprocess.PIPE if input_data is not None else asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+        except FileNotFoundError as e:
+            raise FFmpegError(f"ffmpegが見つかりません: {str(e)}")
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(input_data), timeout=timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise FFmpegError(f"ffmpegがタイムアウトしました（{timeout}秒）")
+        except asyncio.CancelledError:
+            process.kill()
+            await process.wait()
+            raise
+    if process.returncode != 0:
+        raise FFmpegError(f"ffmpegの実行に失敗しました: {stderr.decode(errors='replace').strip()}")
+    return stdout
@@ -0,0 +1,126 @@
+import os
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+from dotenv import load_dotenv
+from app.crud import async_crud
+from app.services.conversation_writer import conversation_writer
+
+# 環境変数の読み込み
+load_dotenv()
+
+# (ユーザー, エージェント) ごとに保持する直近の会話ターン数
+HISTORY_WINDOW = int(os.getenv("HISTORY_WINDOW", "20"))
+# メモリに保持する (ユーザー, エージェント) の組の上限
+HISTORY_CACHE_MAX_KEYS = int(os.getenv("HISTORY_CACHE_MAX_KEYS", "5000"))
+
+@dataclass(frozen=True)
+class ConversationTurn:
+    user_message: str
+    agent_response: str
+    created_at: Optional[datetime] = None
+    id: Optional[int] = None
+
+class ConversationHistoryCache:
+    """
+    (ユーザー, エージェント) ごとの直近の会話ターンを保持するリングバッファ
+    一度DBから読み込んだ後は会話を保存するたびに追記し、履歴の組み立てにDBを使わない
+    """
+
+    def __init__(self, window=HISTORY_WINDOW, max_keys=HISTORY_CACHE_MAX_KEYS):
+        self.window = window
+        self.max_keys = max_keys
+        self._buffers = OrderedDict()
+        # DBから読み込み中の組に届いた追記（読み込み完了後に反映する）
+        self._loading = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get_recent(self, db, user_id, agent_id, limit=None):
+        """直近の会話ターンを古い順に返す"""
+        limit = limit or self.window
+        key = (user_id, agent_id)
+        buffer = self._buffers.get(key)
+        if buffer is None:
+            self.misses += 1
+            pending = self._loading.setdefault(key, [])
+            # 書き込みキューにあってまだコミットされていない会話（DBの読み込みと合流させる）
+            unwritten = conversation_writer.pending_for(user_id, agent_id)
+            try:
+                conversations = await async_crud.get_conversations(db, user_id=user_id, agent_id=agent_id, limit=self.window)
+            finally:
+                self._loading.pop(key, None)
+            buffer = deque(
+                (
+                    ConversationTurn(conv.user_message, conv.agent_response, conv.created_at, conv.id)
+                    for conv in reversed(conversations)
+                ),
+                maxlen=self.window
+            )
+            # 読み込み中にコミットされた会話は二重にならないよう内容と時刻で突き合わせる
+            loaded = {(turn.created_at, turn.user_message, turn.agent_response) for turn in buffer}
+            loaded_ids = {turn.id for turn in buffer}
+            for conversation in unwritten:
+                if (conversation.created_at, conversation.user_message, conversation.agent_response) not in loaded:
+                    buffer.append(ConversationTurn(conversation.user_message, conversation.agent_response, conversation.created_at))
+                    loaded.add((conversation.created_at, conversation.user_message, conversation.agent_response))
+            for turn in pending:
+                if (turn.created_at, turn.user_message, turn.agent_response) in loaded or (turn.id is not None and turn.id in loaded_ids):
+                    continue
+                buffer.append(turn)
+            self._store(key, buffer)
+        else:
+            self.hits += 1
+            self._buffers.move_to_end(key)
+        return list(buffer)[-limit:]
+
+    def append(self, user_id, agent_id, user_message, agent_response, created_at=None, id=None):
+        """
+        保存した会話ターンを追記する
+        まだ読み込んでいない組は、次回の get_recent でDBから読み込むため何もしない
+        """
+        key = (user_id, agent_id)
+        turn = ConversationTurn(user_message, agent_response, created_at, id)
+        buffer = self._buffers.get(key)
+        if buffer is not None:
+            buffer.append(turn)
+        elif key in self._loading:
+            self._loading[key].append(turn)
+
+    def invalidate(self, user_id, agent_id):
+        self._buffers.pop((user_id, agent_id), None)
+
+    def _store(self, key, buffer):
+        self._buffers[key] = buffer
+        self._buffers.move_to_end(key)
+        while len(self._buffers) > self.max_keys:
+            self._buffers.popitem(last=False)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "keys": len(self._buffers),
+            "window": self.window,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+# アプリケーション全体で共有するキャッシュ
+history_cache = ConversationHistoryCache()
+
+async def save_conversation(user_id, agent_id, user_message, agent_response):
+    """
+    会話履歴を書き込みキューに入れ、直近履歴のリングバッファにも追記する
+    DBへの保存はバックグラウンドでまとめて行うため、呼び出し元はコミットを待たない
+    """
+    conversation = await conversation_writer.submit(user_id, agent_id, user_message, agent_response)
+    history_cache.append(
+        user_id,
+        agent_id,
+        user_message,
+        agent_response,
+        created_at=conversation.created_at
+    )
+    return conversation
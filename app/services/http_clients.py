@@ -0,0 +1,68 @@
+import os
+import httpx
+from dotenv import load_dotenv
+
+# 環境変数の読み込み
+load_dotenv()
+
+# 接続プール設定（上流ごとに共通）
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# 上流サービス名
+LLM = "llm"
+VOICEVOX = "voicevox"
+CUSTOM_VOICE = "custom_voice"
+UPSTREAMS = (LLM, VOICEVOX, CUSTOM_VOICE)
+
+# アプリケーション全体で共有するクライアント
+_clients = {}
+
+def _http2_available():
+    """HTTP/2 が有効かつ h2 パッケージが利用可能か確認する"""
+    if not HTTP2_ENABLED:
+        return False
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        print("h2 パッケージが見つからないため HTTP/1.1 で接続します")
+        return False
+
+def _build_client():
+    limits = httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+    # 読み取りタイムアウトは呼び出しごとに指定する
+    timeout = httpx.Timeout(60.0, connect=HTTP_CONNECT_TIMEOUT)
+    return httpx.AsyncClient(limits=limits, timeout=timeout, http2=_http2_available())
+
+async def init_clients():
+    """上流ごとの共有クライアントを作成する（lifespan の起動時に呼ぶ）"""
+    for name in UPSTREAMS:
+        if name not in _clients:
+            _clients[name] = _build_client()
+    print(f"共有HTTPクライアントを作成しました: {', '.join(_clients)}")
+
+async def close_clients():
+    """共有クライアントを閉じる（lifespan の終了時に呼ぶ）"""
+    while _clients:
+        name, client = _clients.popitem()
+        await client.aclose()
+    print("共有HTTPクライアントを閉じました")
+
+def get_client(name):
+    """
+    上流名に対応する共有クライアントを取得する
+    lifespan 外（スクリプトなど）から呼ばれた場合はその場で作成する
+    """
+    client = _clients.get(name)
+    if client is None or client.is_closed:
+        client = _build_client()
+        _clients[name] = client
+    return client
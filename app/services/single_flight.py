@@ -0,0 +1,55 @@
+import asyncio
+
+class SingleFlight:
+    """
+    同じキーの処理が実行中の場合は新たに実行せず、その結果を共有する（single-flight）
+    処理は呼び出し元とは別のタスクで実行するため、一部の呼び出し元が切断しても他の待機者には結果が届く
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.errors = 0
+
+    async def do(self, key, factory):
+        """
+        key の処理が実行中ならその結果を待ち、なければ factory() を実行する
+        結果のオブジェクトは待機者全員で共有されるため、呼び出し元で変更しないこと
+        """
+        task = self._calls.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(factory())
+            self._calls[key] = task
+            task.add_done_callback(lambda done, key=key: self._finish(key, done))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _finish(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # 待機者がいなくなった場合も例外を取り出しておく（未取得の警告を出さない）
+        if not task.cancelled() and task.exception() is not None:
+            self.errors += 1
+
+    def stats(self):
+        total = self.leaders + self.coalesced
+        return {
+            "in_flight": len(self._calls),
+            "calls": total,
+            "upstream_calls": self.leaders,
+            "coalesced": self.coalesced,
+            "coalescing_rate": self.coalesced / total if total else 0.0,
+            "errors": self.errors,
+        }
+
+# 音声合成の経路ごとのグループ
+audio_query_flight = SingleFlight("audio_query")
+synthesis_flight = SingleFlight("synthesis")
+transcode_flight = SingleFlight("transcode")
+
+def stats():
+    return {flight.name: flight.stats() for flight in (audio_query_flight, synthesis_flight, transcode_flight)}
@@ -0,0 +1,162 @@
+import os
+import time
+import asyncio
+from dotenv import load_dotenv
+from app.services.tts_backends import tts_registry
+
+# 環境変数の読み込み
+load_dotenv()
+
+# スピーカー一覧を新しいとみなす時間（秒）。過ぎた後は古い一覧を返しつつバックグラウンドで取り直す
+SPEAKER_CATALOG_TTL = float(os.getenv("SPEAKER_CATALOG_TTL", "3600"))
+# 取得に失敗した後、次に取得を試みるまでの時間（秒）
+SPEAKER_CATALOG_RETRY_SECONDS = float(os.getenv("SPEAKER_CATALOG_RETRY_SECONDS", "30"))
+# エージェントが使うスピーカーのモデルを起動時に読み込んでおくか
+SPEAKER_WARMUP = os.getenv("SPEAKER_WARMUP", "true").lower() in ("1", "true", "yes")
+
+class SpeakerCatalog:
+    """
+    VoiceVoxのスピーカー一覧のキャッシュ
+    起動時に取得し、TTLを過ぎたら古い一覧を返しながらバックグラウンドで取り直す（stale-while-revalidate）
+    エージェントのスピーカーIDの検証と、使われるスピーカーのウォームアップ（/initialize_speaker）を行う
+    """
+
+    def __init__(self, ttl=SPEAKER_CATALOG_TTL, retry_seconds=SPEAKER_CATALOG_RETRY_SECONDS):
+        self.ttl = ttl
+        self.retry_seconds = retry_seconds
+        self._speakers = None
+        self._style_ids = frozenset()
+        self._fetched_at = 0.0
+        self._failed_at = None
+        self._refresh_task = None
+        self._tasks = set()
+        self._warmed = set()
+        self.refreshes = 0
+        self.failures = 0
+        self.stale_served = 0
+
+    def start(self, speaker_ids=()):
+        """スピーカー一覧の取得と、指定したスピーカーのウォームアップをバックグラウンドで始める（起動を待たせない）"""
+        self._spawn(self._start(speaker_ids))
+
+    async def _start(self, speaker_ids):
+        await self.refresh()
+        if SPEAKER_WARMUP:
+            await self.warm(sorted({int(speaker_id) for speaker_id in speaker_ids if speaker_id is not None}))
+
+    async def stop(self):
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks.clear()
+        self._refresh_task = None
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def refresh(self):
+        """スピーカー一覧を取得し直す（同時に1つだけ実行する）。成功した場合は True"""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = self._spawn(self._refresh())
+        return await asyncio.shield(self._refresh_task)
+
+    async def _refresh(self):
+        try:
+            speakers = await tts_registry.voicevox.speakers()
+        except Exception as e:
+            self.failures += 1
+            self._failed_at = time.monotonic()
+            print(f"VoiceVoxのスピーカー一覧を取得できませんでした: {str(e)}")
+            return False
+        if not speakers:
+            # 空の一覧（スタブのバックエンドなど）は検証に使わない
+            self._failed_at = time.monotonic()
+            return False
+        self._speakers = speakers
+        self._style_ids = frozenset(
+            style["id"] for speaker in speakers for style in speaker.get("styles", []) if "id" in style
+        )
+        self._fetched_at = time.monotonic()
+        self._failed_at = None
+        self.refreshes += 1
+        print(f"VoiceVoxのスピーカー一覧を取得しました: {len(speakers)}人, {len(self._style_ids)}スタイル")
+        return True
+
+    def _retry_allowed(self):
+        return self._failed_at is None or time.monotonic() - self._failed_at >= self.retry_seconds
+
+    async def get(self):
+        """
+        スピーカー一覧を返す（取得できない場合は None）
+        TTLを過ぎた一覧はそのまま返し、取り直しはバックグラウンドで行う
+        """
+        if self._speakers is None:
+            if self._retry_allowed():
+                await self.refresh()
+            return self._speakers
+        if time.monotonic() - self._fetched_at > self.ttl:
+            self.stale_served += 1
+            if self._retry_allowed() and (self._refresh_task is None or self._refresh_task.done()):
+                self._refresh_task = self._spawn(self._refresh())
+        return self._speakers
+
+    def lookup(self, speaker_id):
+        """
+        取得済みの一覧でスピーカー（スタイル）IDを確認する（取得を待たない）
+        一覧がない場合は判定できないため None を返し、取得はバックグラウンドで行う
+        """
+        stale = self._speakers is None or time.monotonic() - self._fetched_at > self.ttl
+        if stale and self._retry_allowed() and (self._refresh_task is None or self._refresh_task.done()):
+            self._refresh_task = self._spawn(self._refresh())
+        if self._speakers is None:
+            return None
+        if stale:
+            self.stale_served += 1
+        return speaker_id in self._style_ids
+
+    def schedule_warmup(self, speaker_ids):
+        """まだ読み込んでいないスピーカーのウォームアップをバックグラウンドで行う"""
+        pending = sorted({int(speaker_id) for speaker_id in speaker_ids if speaker_id is not None} - self._warmed)
+        if pending:
+            self._spawn(self.warm(pending))
+
+    async def warm(self, speaker_ids):
+        for speaker_id in speaker_ids:
+            if speaker_id in self._warmed:
+                continue
+            if self._style_ids and speaker_id not in self._style_ids:
+                continue
+            # 同じスピーカーを重ねて読み込まないよう先に記録し、失敗したら戻す
+            self._warmed.add(speaker_id)
+            try:
+                warmed = await tts_registry.voicevox.initialize_speaker(speaker_id)
+            except Exception as e:
+                warmed = 0
+                print(f"スピーカー {speaker_id} のウォームアップに失敗しました: {str(e)}")
+            if warmed:
+                print(f"スピーカー {speaker_id} をウォームアップしました（{warmed}インスタンス）")
+            else:
+                self._warmed.discard(speaker_id)
+
+    def stats(self):
+        return {
+            "speakers": len(self._speakers) if self._speakers else 0,
+            "styles": len(self._style_ids),
+            "age": time.monotonic() - self._fetched_at if self._speakers else None,
+            "ttl": self.ttl,
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+            "stale_served": self.stale_served,
+            "warmed": sorted(self._warmed),
+        }
+
+# アプリケーション全体で共有するカタログ
+speaker_catalog = SpeakerCatalog()
@@ -0,0 +1,48 @@
+import re
+
+# 日本語の文末記号（全角・半角）と改行で文を区切る
+SENTENCE_END_CHARS = "。！？!?\n"
+# 文末記号の直後に続く閉じ括弧類は同じ文に含める
+_SENTENCE_PATTERN = re.compile(r"[^。！？!?\n]*[。！？!?\n]+[」』）)]*")
+
+def split_sentences(text):
+    """
+    テキストを文単位に分割する（末尾の未完了部分も1文として返す）
+    """
+    sentences, rest = pop_sentences(text)
+    if rest.strip():
+        sentences.append(rest.strip())
+    return sentences
+
+def pop_sentences(buffer):
+    """
+    バッファから完結した文を取り出す
+    戻り値: (完結した文のリスト, 未完了の残りテキスト)
+    """
+    sentences = []
+    end = 0
+    for match in _SENTENCE_PATTERN.finditer(buffer):
+        sentence = match.group().strip()
+        if sentence:
+            sentences.append(sentence)
+        end = match.end()
+    return sentences, buffer[end:]
+
+def group_sentences(sentences, min_chars):
+    """
+    短すぎる文を次の文とまとめる（細切れの合成リクエストを避ける）
+    最後の文が短い場合は直前のまとまりに加える
+    """
+    groups = []
+    current = ""
+    for sentence in sentences:
+        current += sentence
+        if len(current) >= min_chars:
+            groups.append(current)
+            current = ""
+    if current:
+        if groups:
+            groups[-1] += current
+        else:
+            groups.append(current)
+    return groups
@@ -0,0 +1,113 @@
+import os
+import uuid
+import mimetypes
+import asyncio
+from dotenv import load_dotenv
+from app.services.ffmpeg import run_ffmpeg, FFmpegError
+from app.services.audio_cache import audio_cache
+from app.services.single_flight import transcode_flight
+
+# 環境変数の読み込み
+load_dotenv()
+
+# 合成音声の出力形式（wav / opus / mp3 / aac）
+AUDIO_OUTPUT_CODEC = os.getenv("AUDIO_OUTPUT_CODEC", "wav").lower()
+AUDIO_OUTPUT_BITRATE = os.getenv("AUDIO_OUTPUT_BITRATE", "32k")
+# 変換後も元のWAVを残すか
+AUDIO_KEEP_WAV = os.getenv("AUDIO_KEEP_WAV", "false").lower() in ("1", "true", "yes")
+
+# 出力形式ごとの拡張子と ffmpeg のエンコーダー引数
+CODECS = {
+    "wav": (".wav", []),
+    "opus": (".opus", ["-c:a", "libopus", "-application", "voip"]),
+    "mp3": (".mp3", ["-c:a", "libmp3lame"]),
+    "aac": (".m4a", ["-c:a", "aac", "-movflags", "+faststart"]),
+}
+
+MEDIA_TYPES = {
+    ".wav": "audio/wav",
+    ".opus": "audio/ogg",
+    ".mp3": "audio/mpeg",
+    ".m4a": "audio/mp4",
+}
+
+# StaticFiles など mimetypes で判定する配信でも正しい Content-Type を返す
+for _ext, _media_type in MEDIA_TYPES.items():
+    mimetypes.add_type(_media_type, _ext)
+
+if AUDIO_OUTPUT_CODEC not in CODECS:
+    print(f"未対応の出力形式 {AUDIO_OUTPUT_CODEC} が指定されたため wav を使用します")
+    AUDIO_OUTPUT_CODEC = "wav"
+
+def output_extension():
+    return CODECS[AUDIO_OUTPUT_CODEC][0]
+
+def media_type_for(filename):
+    """ファイル名の拡張子から Content-Type を返す"""
+    return MEDIA_TYPES.get(os.path.splitext(filename)[1].lower(), "application/octet-stream")
+
+async def transcode(wav_path, codec=None):
+    """
+    WAVを設定された形式に変換して新しいパスを返す
+    wav 設定時や変換に失敗した場合は元のパスをそのまま返す
+    """
+    codec = codec or AUDIO_OUTPUT_CODEC
+    extension, encoder_args = CODECS[codec]
+    if codec == "wav" or not wav_path.endswith(".wav"):
+        return wav_path
+
+    output_path = os.path.splitext(wav_path)[0] + extension
+    try:
+        await run_ffmpeg([
+            "-i", wav_path,
+            *encoder_args,
+            "-b:a", AUDIO_OUTPUT_BITRATE,
+            output_path
+        ])
+    except FFmpegError as e:
+        print(f"音声の変換に失敗したためWAVを使用します: {str(e)}")
+        return wav_path
+
+    if not AUDIO_KEEP_WAV:
+        await asyncio.to_thread(os.remove, wav_path)
+    return output_path
+
+async def concat_encoded(paths, output_path):
+    """
+    同じ形式に変換済みの音声ファイルを ffmpeg の concat demuxer で再エンコードせずに連結する
+    失敗時は FFmpegError を送出する
+    """
+    list_path = f"{output_path}.{uuid.uuid4().hex[:8]}.txt"
+    # concat demuxer のリストではシングルクォートをエスケープする
+    lines = "".join("file '{}'\n".format(os.path.abspath(path).replace("'", "'\\''")) for path in paths)
+    await asyncio.to_thread(_write_text, list_path, lines)
+    try:
+        await run_ffmpeg(["-f", "concat", "-safe", "0", "-i", list_path, "-c", "copy", output_path])
+    finally:
+        try:
+            os.remove(list_path)
+        except OSError:
+            pass
+    return output_path
+
+def _write_text(path, text):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+async def transcode_cached(cache_key, wav_path):
+    """
+    キャッシュに保存したWAVを変換し、キャッシュのインデックスを変換後のファイルに差し替える
+    同じキーの変換が実行中の場合はその結果を共有する（変換後に元のWAVが消えるため二重に変換しない）
+    """
+    return await transcode_flight.do(cache_key, lambda: _transcode_cached(cache_key, wav_path))
+
+async def _transcode_cached(cache_key, wav_path):
+    if not os.path.exists(wav_path):
+        # 先に変換されて元のWAVが削除されている場合は、インデックスが指す現在のファイルを返す
+        current = audio_cache.peek(cache_key)
+        if current is not None:
+            return current
+    output_path = await transcode(wav_path)
+    if output_path != wav_path:
+        audio_cache.replace(cache_key, output_path)
+    return output_path
@@ -0,0 +1,401 @@
+import os
+import time
+import random
+import asyncio
+import struct
+from contextlib import asynccontextmanager, AsyncExitStack
+from dataclasses import dataclass
+from typing import Optional
+import httpx
+from dotenv import load_dotenv
+from app.services import http_clients, custom_voice
+from app.services.circuit_breaker import get_breaker
+
+# 環境変数の読み込み
+load_dotenv()
+
+def _base_url(url, suffix):
+    """エンドポイントのURL（…/audio_query など）からベースURLを取り出す"""
+    if url and url.rstrip("/").endswith(suffix):
+        return url.rstrip("/")[:-len(suffix)].rstrip("/")
+    return url
+
+def _parse_urls(value):
+    urls = []
+    for url in (value or "").split(","):
+        url = url.strip().rstrip("/")
+        if url and url not in urls:
+            urls.append(url)
+    return urls
+
+# VoiceVoxエンジンのURL（カンマ区切りで複数指定可）
+# 未指定の場合は従来の AUDIO_QUERY_API_URL のベースURL、それもなければ VOICEVOX_URL を使う
+VOICEVOX_URLS = (
+    _parse_urls(os.getenv("VOICEVOX_URLS"))
+    or _parse_urls(_base_url(os.getenv("AUDIO_QUERY_API_URL"), "/audio_query"))
+    or _parse_urls(os.getenv("VOICEVOX_URL", "http://localhost:50021"))
+)
+# カスタム音声合成サービスのURL（カンマ区切りで複数指定可）
+CUSTOM_VOICE_URLS = _parse_urls(os.getenv("CUSTOM_VOICE_URLS")) or [custom_voice.VOICE_SYNTHESIS_URL.rstrip("/")]
+# true の場合は上流を呼ばずに無音のWAVを返すスタブを使う（開発・負荷試験用）
+TTS_NULL_BACKEND = os.getenv("TTS_NULL_BACKEND", "false").lower() in ("1", "true", "yes")
+
+# ヘルスチェックの間隔と、連続失敗で切り離す回数・期間（秒）
+TTS_HEALTH_INTERVAL = float(os.getenv("TTS_HEALTH_INTERVAL", "10"))
+TTS_HEALTH_TIMEOUT = float(os.getenv("TTS_HEALTH_TIMEOUT", "3"))
+TTS_EJECT_FAILURES = int(os.getenv("TTS_EJECT_FAILURES", "3"))
+TTS_EJECT_SECONDS = float(os.getenv("TTS_EJECT_SECONDS", "30"))
+
+class TTSError(Exception):
+    """音声合成エンジンがエラーを返した"""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+def _is_instance_failure(error):
+    """インスタンス自体の障害とみなすエラーか（リクエスト内容の誤りは含めない）"""
+    if isinstance(error, httpx.TransportError):
+        return True
+    if isinstance(error, TTSError):
+        return error.status_code is None or error.status_code >= 500
+    return False
+
+@dataclass
+class EngineInstance:
+    """バックエンドの1インスタンス（VoiceVoxのコンテナ1台など）"""
+    url: str
+    outstanding: int = 0
+    consecutive_failures: int = 0
+    ejected_until: float = 0.0
+    requests: int = 0
+    failures: int = 0
+    last_error: Optional[str] = None
+
+    @property
+    def available(self):
+        return self.ejected_until <= time.monotonic()
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+
+    def record_failure(self, error):
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.last_error = str(error)
+        if self.consecutive_failures >= TTS_EJECT_FAILURES:
+            if self.available:
+                print(f"音声合成エンジンを切り離します: {self.url}（{self.consecutive_failures}回連続で失敗）")
+            self.ejected_until = time.monotonic() + TTS_EJECT_SECONDS
+
+    def to_dict(self):
+        return {
+            "url": self.url,
+            "available": self.available,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "last_error": self.last_error,
+        }
+
+class TTSBackend:
+    """
+    音声合成バックエンドの基底クラス
+    複数のインスタンスに、処理中のリクエストが最も少ないものから振り分ける
+    """
+    name = ""
+    upstream = http_clients.VOICEVOX
+
+    def __init__(self, urls):
+        self.instances = [EngineInstance(url) for url in urls]
+        # 上流全体のサーキットブレーカー（開いている間はインスタンスを選ばずに即座に失敗する）
+        self.breaker = get_breaker(self.upstream)
+
+    def pick(self):
+        """処理中のリクエストが最も少ないインスタンスを選ぶ（同数ならランダム）"""
+        candidates = [instance for instance in self.instances if instance.available]
+        if not candidates:
+            # すべて切り離されている場合は、全インスタンスを対象にする（パニックモード）
+            candidates = self.instances
+        if not candidates:
+            raise TTSError(f"{self.name} のインスタンスが設定されていません")
+        fewest = min(instance.outstanding for instance in candidates)
+        return random.choice([instance for instance in candidates if instance.outstanding == fewest])
+
+    @asynccontextmanager
+    async def acquire(self):
+        """インスタンスを1つ借りる（成否を記録し、連続失敗したインスタンスを切り離す）"""
+        async with AsyncExitStack() as stack:
+            if self.breaker is not None:
+                await stack.enter_async_context(self.breaker.guard())
+            instance = self.pick()
+            instance.outstanding += 1
+            instance.requests += 1
+            try:
+                yield instance
+            except Exception as e:
+                if _is_instance_failure(e):
+                    instance.record_failure(e)
+                raise
+            else:
+                instance.record_success()
+            finally:
+                instance.outstanding -= 1
+
+    def client(self):
+        return http_clients.get_client(self.upstream)
+
+    async def probe(self, instance):
+        """インスタンスが応答するか確認する（例外を送出しなければ正常）"""
+        response = await self.client().get(instance.url, timeout=TTS_HEALTH_TIMEOUT)
+        if response.status_code >= 500:
+            raise TTSError(f"ヘルスチェックエラー: {response.status_code}", response.status_code)
+
+    async def health_check(self):
+        async def check(instance):
+            try:
+                await self.probe(instance)
+            except Exception as e:
+                instance.record_failure(e)
+                # ヘルスチェックの失敗は1回で切り離す
+                instance.ejected_until = time.monotonic() + TTS_EJECT_SECONDS
+            else:
+                if not instance.available:
+                    print(f"音声合成エンジンを復帰させます: {instance.url}")
+                instance.record_success()
+        await asyncio.gather(*(check(instance) for instance in self.instances))
+
+    def stats(self):
+        return {
+            "backend": type(self).__name__,
+            "instances": [instance.to_dict() for instance in self.instances],
+        }
+
+class VoiceVoxBackend(TTSBackend):
+    name = "voicevox"
+    upstream = http_clients.VOICEVOX
+
+    async def audio_query(self, text, speaker, timeout=60.0):
+        async with self.acquire() as instance:
+            response = await self.client().post(
+                f"{instance.url}/audio_query",
+                params={"text": text, "speaker": speaker},
+                headers={"accept": "application/json"},
+                timeout=timeout
+            )
+            if response.status_code != 200:
+                raise TTSError(f"Audio query API error: {response.text}", response.status_code)
+            return response.json()
+
+    async def synthesis(self, audio_query, speaker, timeout=60.0):
+        async with self.acquire() as instance:
+            response = await self.client().post(
+                f"{instance.url}/synthesis",
+                params={"speaker": speaker, "enable_interrogative_upspeak": "true"},
+                headers={"accept": "audio/wav", "Content-Type": "application/json"},
+                json=audio_query,
+                timeout=timeout
+            )
+            if response.status_code != 200:
+                raise TTSError(f"Synthesis API error: {response.text}", response.status_code)
+            return response.content
+
+    async def synthesis_stream(self, audio_query, speaker, timeout=60.0):
+        """合成したWAVを受信した分から順に返す（全体の受信を待たずにファイルへ書き込める）"""
+        async with self.acquire() as instance:
+            async with self.client().stream(
+                "POST",
+                f"{instance.url}/synthesis",
+                params={"speaker": speaker, "enable_interrogative_upspeak": "true"},
+                headers={"accept": "audio/wav", "Content-Type": "application/json"},
+                json=audio_query,
+                timeout=timeout
+            ) as response:
+                if response.status_code != 200:
+                    body = await response.aread()
+                    raise TTSError(f"Synthesis API error: {body.decode('utf-8', 'replace')}", response.status_code)
+                async for chunk in response.aiter_bytes():
+                    yield chunk
+
+    async def synthesize(self, text, speaker, timeout=60.0):
+        """テキストからWAVのバイト列を合成する"""
+        audio_query = await self.audio_query(text, speaker, timeout=timeout)
+        return await self.synthesis(audio_query, speaker, timeout=timeout)
+
+    async def speakers(self, timeout=10.0):
+        async with self.acquire() as instance:
+            response = await self.client().get(f"{instance.url}/speakers", timeout=timeout)
+            if response.status_code != 200:
+                raise TTSError(f"Speakers API error: {response.text}", response.status_code)
+            return response.json()
+
+    async def initialize_speaker(self, speaker, timeout=60.0):
+        """
+        全インスタンスでスピーカーのモデルを読み込んでおく（初回合成の読み込み待ちをなくす）
+        ウォームアップは利用者のリクエストではないため、サーキットブレーカーには記録しない
+        戻り値: 読み込みに成功したインスタンス数
+        """
+        async def initialize(instance):
+            try:
+                response = await self.client().post(
+                    f"{instance.url}/initialize_speaker",
+                    params={"speaker": speaker, "skip_reinit": "true"},
+                    timeout=timeout
+                )
+            except httpx.HTTPError as e:
+                print(f"スピーカー {speaker} の初期化に失敗しました（{instance.url}）: {str(e)}")
+                return False
+            if response.status_code not in (200, 204):
+                print(f"スピーカー {speaker} の初期化に失敗しました（{instance.url}）: {response.status_code}")
+                return False
+            return True
+        results = await asyncio.gather(*(initialize(instance) for instance in self.instances if instance.available))
+        return sum(results)
+
+    async def probe(self, instance):
+        response = await self.client().get(f"{instance.url}/version", timeout=TTS_HEALTH_TIMEOUT)
+        if response.status_code != 200:
+            raise TTSError(f"ヘルスチェックエラー: {response.status_code}", response.status_code)
+
+class CustomVoiceBackend(TTSBackend):
+    """
+    参照音声によるカスタム音声合成サービス
+    参照音声のアップロード状況はインスタンスごとに custom_voice が管理する
+    """
+    name = "custom"
+    upstream = http_clients.CUSTOM_VOICE
+
+    async def synthesize(self, text, agent_id, timeout=120.0):
+        """参照音声を使ってWAVのバイト列を合成する"""
+        async with self.acquire() as instance:
+            response = await custom_voice.generate_with_reference(text, agent_id, timeout=timeout, base_url=instance.url)
+            if response.status_code != 200:
+                raise TTSError(f"カスタム音声合成エラー: {response.status_code} {response.text}", response.status_code)
+            return response.content
+
+    async def upload_reference(self, agent_id, path=None):
+        """
+        参照音声を全インスタンスにアップロードする
+        戻り値: [(インスタンスのURL, レスポンスまたは例外)]
+        """
+        async def upload(instance):
+            try:
+                return instance.url, await custom_voice.upload_reference(agent_id, path, base_url=instance.url)
+            except Exception as e:
+                return instance.url, e
+        return await asyncio.gather(*(upload(instance) for instance in self.instances))
+
+# 無音WAV（24kHz, 16bit, モノラル, 0.1秒）
+_SILENT_SAMPLES = 2400
+_SILENT_WAV = (
+    struct.pack("<4sI4s", b"RIFF", 36 + _SILENT_SAMPLES * 2, b"WAVE")
+    + struct.pack("<4sIHHIIHH", b"fmt ", 16, 1, 1, 24000, 48000, 2, 16)
+    + struct.pack("<4sI", b"data", _SILENT_SAMPLES * 2)
+    + b"\x00" * (_SILENT_SAMPLES * 2)
+)
+
+class NullBackend(TTSBackend):
+    """上流を呼ばずに無音のWAVを返すスタブ（開発・負荷試験用）"""
+    name = "null"
+
+    def __init__(self):
+        super().__init__(["null://"])
+        self.breaker = None
+
+    async def audio_query(self, text, speaker, timeout=None):
+        return {"accent_phrases": [], "speedScale": 1.0, "kana": text}
+
+    async def synthesis(self, audio_query, speaker, timeout=None):
+        return _SILENT_WAV
+
+    async def synthesis_stream(self, audio_query, speaker, timeout=None):
+        yield _SILENT_WAV
+
+    async def synthesize(self, text, speaker_or_agent=None, timeout=None):
+        return _SILENT_WAV
+
+    async def speakers(self, timeout=None):
+        return []
+
+    async def initialize_speaker(self, speaker, timeout=None):
+        return 0
+
+    async def upload_reference(self, agent_id, path=None):
+        return []
+
+    async def health_check(self):
+        pass
+
+class TTSRegistry:
+    """
+    音声合成バックエンドのレジストリ
+    名前（voicevox / custom / null）でバックエンドを取得し、インスタンスのヘルスチェックを定期実行する
+    """
+
+    def __init__(self):
+        self._backends = {}
+        self._task = None
+
+    def register(self, backend, name=None):
+        self._backends[name or backend.name] = backend
+
+    def get(self, name):
+        backend = self._backends.get(name)
+        if backend is None:
+            raise KeyError(f"音声合成バックエンド {name} は登録されていません")
+        return backend
+
+    @property
+    def voicevox(self):
+        return self.get("voicevox")
+
+    @property
+    def custom(self):
+        return self.get("custom")
+
+    def start(self, interval=TTS_HEALTH_INTERVAL):
+        if self._task is None and interval > 0:
+            self._task = asyncio.create_task(self._health_loop(interval))
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _health_loop(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            # 同じバックエンドが複数の名前で登録されている場合も1回だけ確認する
+            backends = {id(backend): backend for backend in self._backends.values()}.values()
+            for backend in backends:
+                try:
+                    await backend.health_check()
+                except Exception as e:
+                    print(f"ヘルスチェック中にエラー: {str(e)}")
+
+    def stats(self):
+        return {name: backend.stats() for name, backend in self._backends.items()}
+
+def build_registry():
+    registry = TTSRegistry()
+    registry.register(NullBackend())
+    if TTS_NULL_BACKEND:
+        print("音声合成にスタブ（無音）を使用します")
+        registry.register(registry.get("null"), "voicevox")
+        registry.register(registry.get("null"), "custom")
+    else:
+        registry.register(VoiceVoxBackend(VOICEVOX_URLS))
+        registry.register(CustomVoiceBackend(CUSTOM_VOICE_URLS))
+        print(f"VoiceVoxエンジン: {', '.join(VOICEVOX_URLS)}")
+        print(f"カスタム音声合成サービス: {', '.join(CUSTOM_VOICE_URLS)}")
+    return registry
+
+# アプリケーション全体で共有するレジストリ
+tts_registry = build_registry()
@@ -0,0 +1,164 @@
+import os
+import time
+import uuid
+import shutil
+import asyncio
+from dataclasses import dataclass, field
+from typing import Optional
+from dotenv import load_dotenv
+from app.services.ffmpeg import run_ffmpeg, FFmpegError
+
+# 環境変数の読み込み
+load_dotenv()
+
+VOICE_CONVERSION_WORKERS = int(os.getenv("VOICE_CONVERSION_WORKERS", "2"))
+VOICE_CONVERSION_QUEUE_SIZE = int(os.getenv("VOICE_CONVERSION_QUEUE_SIZE", "100"))
+VOICE_CONVERSION_TIMEOUT = float(os.getenv("VOICE_CONVERSION_TIMEOUT", "120"))
+# 完了したジョブの状態を保持する時間（秒）
+VOICE_CONVERSION_JOB_TTL = float(os.getenv("VOICE_CONVERSION_JOB_TTL", "3600"))
+
+class ConversionQueueFull(Exception):
+    """変換キューが満杯"""
+
+@dataclass
+class ConversionJob:
+    job_id: str
+    agent_id: str
+    source_path: str
+    output_path: str
+    status: str = "queued"  # queued / running / done / failed
+    error: Optional[str] = None
+    converted: bool = False
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+
+    def to_dict(self):
+        return {
+            "job_id": self.job_id,
+            "agent_id": self.agent_id,
+            "status": self.status,
+            "error": self.error,
+            "converted": self.converted,
+            "filename": os.path.basename(self.output_path),
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+class VoiceConversionQueue:
+    """
+    アップロードされた参照音声を ffmpeg で 16bit PCM WAV に変換するジョブキュー
+    ワーカー数・キュー長・ジョブごとのタイムアウトで負荷を制限する
+    """
+
+    def __init__(self, workers=VOICE_CONVERSION_WORKERS, max_queue=VOICE_CONVERSION_QUEUE_SIZE, timeout=VOICE_CONVERSION_TIMEOUT):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._queue = None
+        self._tasks = []
+        self._jobs = {}
+        self._callbacks = {}
+
+    def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+    def submit(self, agent_id, source_path, output_path, on_complete=None):
+        """
+        変換ジョブを登録する（キューが満杯なら ConversionQueueFull）
+        on_complete は変換後に await されるコルーチン関数（引数はジョブ）
+        """
+        self.start()
+        self._prune()
+        job = ConversionJob(
+            job_id=uuid.uuid4().hex,
+            agent_id=agent_id,
+            source_path=source_path,
+            output_path=output_path,
+        )
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise ConversionQueueFull("音声変換キューが満杯です")
+        self._jobs[job.job_id] = job
+        if on_complete:
+            self._callbacks[job.job_id] = on_complete
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def pending_sources(self, agent_id):
+        """変換待ち・変換中のアップロードファイル"""
+        return [
+            job.source_path for job in self._jobs.values()
+            if job.agent_id == agent_id and job.status in ("queued", "running")
+        ]
+
+    def _prune(self):
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished_at and now - job.finished_at > VOICE_CONVERSION_JOB_TTL
+        ]
+        for job_id in expired:
+            self._jobs.pop(job_id, None)
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._process(job)
+            except Exception as e:
+                job.status = "failed"
+                job.error = str(e)
+                print(f"音声変換ジョブエラー: {job.job_id}: {str(e)}")
+            finally:
+                job.finished_at = time.time()
+                self._callbacks.pop(job.job_id, None)
+                self._queue.task_done()
+
+    async def _process(self, job):
+        job.status = "running"
+        # 変換結果は一時ファイルに書き出してから置き換える
+        intermediate_path = f"{job.output_path}.{job.job_id[:8]}.tmp.wav"
+        try:
+            await run_ffmpeg([
+                "-i", job.source_path,  # 入力ファイル
+                "-acodec", "pcm_s16le",  # 16-bit PCM
+                "-ar", "44100",  # サンプリングレート
+                "-ac", "1",      # モノラル
+                intermediate_path  # 出力ファイル
+            ], timeout=self.timeout)
+            os.replace(intermediate_path, job.output_path)
+            job.converted = True
+            print(f"FFmpegによる変換成功: {job.source_path} -> {job.output_path}")
+        except FFmpegError as conv_err:
+            print(f"音声変換エラー（FFmpegが利用できないかも）: {str(conv_err)}")
+            # 変換失敗した場合は元のファイルをそのまま使う
+            await asyncio.to_thread(shutil.copyfile, job.source_path, job.output_path)
+            print(f"元のファイルをコピー: {job.source_path} -> {job.output_path}")
+        finally:
+            for path in (intermediate_path, job.source_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+        callback = self._callbacks.pop(job.job_id, None)
+        if callback:
+            await callback(job)
+        job.status = "done"
+
+# アプリケーション全体で共有するキュー
+voice_conversion = VoiceConversionQueue()
@@ -0,0 +1,41 @@
+from dataclasses import dataclass
+from typing import Optional
+from app.services.audio_cache import reference_fingerprint
+
+@dataclass(frozen=True)
+class VoiceSettings:
+    """
+    音声合成に必要なエージェントの設定
+    ルーターで読み込んだエージェントから作り、サービス層に渡す（サービス層でDBを引き直さない）
+    """
+    agent_id: Optional[str] = None
+    speaker_id: int = 1
+    voice_type: str = "voicevox"
+    use_custom_voice: bool = False
+    reference_fingerprint: str = ""
+
+    @property
+    def wants_custom_voice(self):
+        return self.voice_type == "custom" and self.use_custom_voice and bool(self.agent_id)
+
+    @classmethod
+    def from_agent(cls, agent):
+        """エージェント（ORMオブジェクト）から音声設定を作る"""
+        if agent is None:
+            return cls()
+        speaker_id = 1  # デフォルト値
+        if agent.voice_speaker_id:
+            try:
+                speaker_id = int(agent.voice_speaker_id)
+            except (ValueError, TypeError):
+                print(f"Failed to convert speaker_id '{agent.voice_speaker_id}' to int, using default")
+        use_custom_voice = bool(agent.has_custom_voice)
+        settings = cls(
+            agent_id=agent.agent_id,
+            speaker_id=speaker_id,
+            voice_type=agent.voice_type or "voicevox",
+            use_custom_voice=use_custom_voice,
+            reference_fingerprint=reference_fingerprint(agent.agent_id) if use_custom_voice else "",
+        )
+        print(f"Agent voice settings: type={settings.voice_type}, custom={settings.use_custom_voice}, speaker_id={settings.speaker_id}")
+        return settings
@@ -0,0 +1,149 @@
+import os
+import struct
+import uuid
+from dataclasses import dataclass
+
+# PCM WAV（RIFF）をデコードせずに扱うユーティリティ
+# 連結はヘッダーの書き換えとデータ部のコピーだけで行う
+
+COPY_CHUNK_SIZE = 64 * 1024
+
+class WavFormatError(ValueError):
+    """WAVとして解釈できない、または連結できない形式"""
+
+@dataclass(frozen=True)
+class WavInfo:
+    fmt: bytes  # fmt チャンクの本体
+    data_offset: int  # データ部の先頭位置
+    data_size: int  # データ部のバイト数
+
+    @property
+    def format_key(self):
+        # フォーマットタグ・チャンネル数・サンプルレート・バイトレート・ブロックサイズ・ビット深度
+        return self.fmt[:16]
+
+    @property
+    def channels(self):
+        return struct.unpack("<H", self.fmt[2:4])[0]
+
+    @property
+    def sample_rate(self):
+        return struct.unpack("<I", self.fmt[4:8])[0]
+
+    @property
+    def bits_per_sample(self):
+        return struct.unpack("<H", self.fmt[14:16])[0]
+
+def read_wav_info(path):
+    """WAVファイルの fmt チャンクとデータ部の位置を読み取る"""
+    file_size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        header = f.read(12)
+        if len(header) < 12 or header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+            raise WavFormatError(f"WAVファイルではありません: {path}")
+        fmt = None
+        while True:
+            chunk_header = f.read(8)
+            if len(chunk_header) < 8:
+                raise WavFormatError(f"dataチャンクがありません: {path}")
+            chunk_id, chunk_size = struct.unpack("<4sI", chunk_header)
+            if chunk_id == b"fmt ":
+                fmt = f.read(chunk_size)
+                if len(fmt) < 16:
+                    raise WavFormatError(f"fmtチャンクが不正です: {path}")
+                if chunk_size % 2:
+                    f.seek(1, os.SEEK_CUR)
+            elif chunk_id == b"data":
+                if fmt is None:
+                    raise WavFormatError(f"fmtチャンクがdataチャンクより後にあります: {path}")
+                data_offset = f.tell()
+                # 書き込み途中などでサイズが実際より大きい場合はファイル末尾までとする
+                data_size = min(chunk_size, file_size - data_offset)
+                return WavInfo(fmt=fmt, data_offset=data_offset, data_size=data_size)
+            else:
+                f.seek(chunk_size + chunk_size % 2, os.SEEK_CUR)
+
+def parse_wav_header(data):
+    """
+    WAVの先頭部分のバイト列から fmt チャンクとデータ部の位置を読み取る（書き込み途中のファイル用）
+    dataチャンクの先頭まで含まれていない場合は WavFormatError
+    """
+    if len(data) < 12 or data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        raise WavFormatError("WAVのヘッダーが不完全です")
+    fmt = None
+    position = 12
+    while position + 8 <= len(data):
+        chunk_id, chunk_size = struct.unpack("<4sI", data[position:position + 8])
+        position += 8
+        if chunk_id == b"data":
+            if fmt is None:
+                raise WavFormatError("fmtチャンクがdataチャンクより後にあります")
+            return WavInfo(fmt=fmt, data_offset=position, data_size=chunk_size)
+        if chunk_id == b"fmt ":
+            fmt = data[position:position + chunk_size]
+            if len(fmt) < chunk_size:
+                break
+            if len(fmt) < 16:
+                raise WavFormatError("fmtチャンクが不正です")
+        position += chunk_size + chunk_size % 2
+    raise WavFormatError("WAVのヘッダーが不完全です")
+
+def build_wav_header(fmt, data_size):
+    """fmt チャンクとデータサイズから RIFF / fmt / data のヘッダーを作る"""
+    fmt_chunk = struct.pack("<4sI", b"fmt ", len(fmt)) + fmt + (b"\x00" if len(fmt) % 2 else b"")
+    riff_size = 4 + len(fmt_chunk) + 8 + data_size + data_size % 2
+    return (
+        struct.pack("<4sI4s", b"RIFF", riff_size, b"WAVE")
+        + fmt_chunk
+        + struct.pack("<4sI", b"data", data_size)
+    )
+
+# 長さが未確定のWAVを配信するときのサイズ欄（多くのプレーヤーは「末尾まで」として扱う）
+STREAMING_SIZE = 0xFFFFFFFF
+
+def build_streaming_wav_header(fmt):
+    """書き込み途中のWAVを配信するための、RIFF・dataのサイズを未確定にしたヘッダーを作る"""
+    fmt_chunk = struct.pack("<4sI", b"fmt ", len(fmt)) + fmt + (b"\x00" if len(fmt) % 2 else b"")
+    return (
+        struct.pack("<4sI4s", b"RIFF", STREAMING_SIZE, b"WAVE")
+        + fmt_chunk
+        + struct.pack("<4sI", b"data", STREAMING_SIZE)
+    )
+
+def concat_wav(paths, output_path):
+    """
+    同じ形式のPCM WAVを順に連結して output_path に書き出す
+    形式（サンプルレート・チャンネル数など）が異なる場合は WavFormatError
+    """
+    if not paths:
+        raise WavFormatError("連結するWAVがありません")
+    infos = [read_wav_info(path) for path in paths]
+    format_key = infos[0].format_key
+    for path, info in zip(paths, infos):
+        if info.format_key != format_key:
+            raise WavFormatError(f"WAVの形式が一致しません: {path}")
+
+    data_size = sum(info.data_size for info in infos)
+    # 同じファイルへの同時書き込みや読み込みに備えて一時ファイルから置き換える
+    temp_path = f"{output_path}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        with open(temp_path, "wb") as out:
+            out.write(build_wav_header(infos[0].fmt, data_size))
+            for path, info in zip(paths, infos):
+                with open(path, "rb") as f:
+                    f.seek(info.data_offset)
+                    remaining = info.data_size
+                    while remaining > 0:
+                        chunk = f.read(min(COPY_CHUNK_SIZE, remaining))
+                        if not chunk:
+                            break
+                        out.write(chunk)
+                        remaining -= len(chunk)
+            if data_size % 2:
+                out.write(b"\x00")
+        os.replace(temp_path, output_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return output_path
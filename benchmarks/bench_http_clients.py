@@ -0,0 +1,127 @@
+"""
+共有HTTPクライアントの効果を測るベンチマーク
+
+ローカルのスタブサーバー（チャットAPI / audio_query / synthesis を模擬）に対して、
+1ターン分の上流呼び出し（3回）を
+  - 旧実装: 呼び出しごとに httpx.AsyncClient を作成
+  - 新実装: api_service（共有クライアント）
+で実行し、1ターンあたりのレイテンシを比較する。
+
+使い方:
+    python benchmarks/bench_http_clients.py --turns 200 --connect-delay 0.02
+
+--connect-delay は新規接続ごとに挿入する遅延（秒）で、TCP/TLS ハンドシェイクの
+往復時間を模擬する。
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WAV_BODY = b"RIFF" + b"\x00" * 4096
+
+async def handle_connection(reader, writer, connect_delay):
+    # 新規接続時のハンドシェイク遅延を模擬
+    await asyncio.sleep(connect_delay)
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            path = request_line.split(b" ")[1].decode()
+            content_length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b""):
+                    break
+                name, _, value = line.decode().partition(":")
+                if name.lower() == "content-length":
+                    content_length = int(value.strip())
+            if content_length:
+                await reader.readexactly(content_length)
+
+            if path.startswith("/api/chat"):
+                body = json.dumps({"message": {"role": "assistant", "content": "こんにちは。"}}).encode()
+                content_type = b"application/json"
+            elif path.startswith("/audio_query"):
+                body = json.dumps({"accent_phrases": [], "speedScale": 1.0}).encode()
+                content_type = b"application/json"
+            else:
+                body = WAV_BODY
+                content_type = b"audio/wav"
+
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: " + content_type +
+                b"\r\nContent-Length: " + str(len(body)).encode() +
+                b"\r\nConnection: keep-alive\r\n\r\n" + body
+            )
+            await writer.drain()
+    except (ConnectionResetError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+async def per_call_clients_turn(base_url):
+    """旧実装を再現: 呼び出しごとにクライアントを作成する"""
+    import httpx
+    async with httpx.AsyncClient() as client:
+        await client.post(f"{base_url}/api/chat", json={"messages": []})
+    async with httpx.AsyncClient() as client:
+        response = await client.post(f"{base_url}/audio_query?text=test&speaker=1")
+        audio_query = response.json()
+    async with httpx.AsyncClient() as client:
+        await client.post(f"{base_url}/synthesis?speaker=1", json=audio_query)
+
+async def shared_clients_turn(api_service):
+    await api_service.create_chat_response([{"role": "user", "content": "test"}])
+    audio_query = await api_service.create_audio_query("test", speaker=1)
+    result = await api_service.synthesize_speech(audio_query, speaker=1)
+    os.remove(result["filepath"])
+
+async def measure(label, turn, turns):
+    latencies = []
+    for _ in range(turns):
+        start = time.perf_counter()
+        await turn()
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{label:<24} mean={statistics.mean(latencies):7.2f}ms  p50={statistics.median(latencies):7.2f}ms  p95={p95:7.2f}ms")
+    return statistics.mean(latencies)
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--connect-delay", type=float, default=0.02)
+    args = parser.parse_args()
+
+    server = await asyncio.start_server(
+        lambda r, w: handle_connection(r, w, args.connect_delay), "127.0.0.1", 0
+    )
+    port = server.sockets[0].getsockname()[1]
+    base_url = f"http://127.0.0.1:{port}"
+
+    # api_service はインポート時にURLを読み込むため先に設定する
+    os.environ["CHAT_API_URL"] = f"{base_url}/api/chat"
+    os.environ["AUDIO_QUERY_API_URL"] = f"{base_url}/audio_query"
+    os.environ["SYNTHESIS_API_URL"] = f"{base_url}/synthesis"
+    os.environ["VOICEVOX_URLS"] = base_url
+    from app.services import api_service, http_clients
+
+    await http_clients.init_clients()
+    try:
+        before = await measure("per-call AsyncClient", lambda: per_call_clients_turn(base_url), args.turns)
+        after = await measure("shared AsyncClient", lambda: shared_clients_turn(api_service), args.turns)
+        print(f"1ターンあたりの削減: {before - after:.2f}ms ({(1 - after / before) * 100:.1f}%)")
+    finally:
+        await http_clients.close_clients()
+        server.close()
+        await server.wait_closed()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,122 @@
+"""
+SQLiteエンジンプロファイルの効果を測るベンチマーク
+
+一時ファイルのデータベースに対して、
+  - 書き込みスレッド: create_conversation と同じく1件ずつ INSERT + COMMIT
+  - 読み込みスレッド: get_conversations と同じ直近履歴の SELECT
+を同時に実行し、default（既定のジャーナル・プールなし）と production（WAL・プラグマ・プール）
+のスループットとレイテンシ、ロック待ちのエラー件数を比較する。
+
+使い方:
+    python benchmarks/bench_sqlite_profile.py --writers 4 --readers 8 --duration 5
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def percentile(values, ratio):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[max(int(len(values) * ratio) - 1, 0)]
+
+def run_profile(profile, args):
+    from sqlalchemy.orm import sessionmaker
+    from app.db.database import create_db_engine
+    from app.models import models
+
+    workdir = tempfile.mkdtemp(prefix="bench_sqlite_")
+    url = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    engine = create_db_engine(url, profile=profile)
+    models.Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    with Session() as db:
+        db.add(models.User(user_id="bench-user"))
+        db.add(models.Agent(agent_id="bench-agent", user_id="bench-user", name="bench", tone="丁寧", personality1="明るい"))
+        db.commit()
+
+    stop = threading.Event()
+    lock = threading.Lock()
+    write_latencies, read_latencies = [], []
+    errors = {"write": 0, "read": 0}
+
+    def writer():
+        with Session() as db:
+            while not stop.is_set():
+                start = time.perf_counter()
+                try:
+                    db.add(models.Conversation(
+                        user_id="bench-user",
+                        agent_id="bench-agent",
+                        user_message="こんにちは、今日の天気はどうですか？",
+                        agent_response="今日は晴れです。お出かけ日和ですね。" * 4
+                    ))
+                    db.commit()
+                except Exception:
+                    db.rollback()
+                    with lock:
+                        errors["write"] += 1
+                    continue
+                with lock:
+                    write_latencies.append((time.perf_counter() - start) * 1000)
+
+    def reader():
+        with Session() as db:
+            while not stop.is_set():
+                start = time.perf_counter()
+                try:
+                    db.query(models.Conversation)\
+                        .filter(models.Conversation.user_id == "bench-user", models.Conversation.agent_id == "bench-agent")\
+                        .order_by(models.Conversation.created_at.desc())\
+                        .limit(5)\
+                        .all()
+                    db.commit()
+                except Exception:
+                    db.rollback()
+                    with lock:
+                        errors["read"] += 1
+                    continue
+                with lock:
+                    read_latencies.append((time.perf_counter() - start) * 1000)
+
+    threads = [threading.Thread(target=writer) for _ in range(args.writers)]
+    threads += [threading.Thread(target=reader) for _ in range(args.readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    engine.dispose()
+
+    print(
+        f"{profile:<10} "
+        f"writes={len(write_latencies) / args.duration:8.1f}/s (p50={statistics.median(write_latencies or [0]):6.2f}ms p95={percentile(write_latencies, 0.95):6.2f}ms errors={errors['write']})  "
+        f"reads={len(read_latencies) / args.duration:8.1f}/s (p50={statistics.median(read_latencies or [0]):6.2f}ms p95={percentile(read_latencies, 0.95):6.2f}ms errors={errors['read']})"
+    )
+    return len(write_latencies), len(read_latencies)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=5.0)
+    args = parser.parse_args()
+
+    # app.db.database はインポート時にエンジンを作成するため、アプリのDBに触れないよう先に設定する
+    os.environ["DATABASE_URL"] = "sqlite://"
+
+    before_writes, before_reads = run_profile("default", args)
+    after_writes, after_reads = run_profile("production", args)
+    if before_writes and before_reads:
+        print(f"書き込み: x{after_writes / before_writes:.2f}  読み込み: x{after_reads / before_reads:.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+/voice/synthesize の同時実行ロードテスト
+
+合成に一定時間かかるスタブVoiceVoxサーバーを立て、アプリ（ASGI）に対して
+同時に N 件の /voice/synthesize を送る。リクエストがイベントループ上で重なって
+処理されていれば、全体の所要時間は「1件分の遅延」程度に収まる。
+直列化されている場合は「N × 遅延」に近くなり、終了コード 1 で失敗する。
+
+使い方:
+    python benchmarks/bench_voice_concurrency.py --requests 10 --delay 0.5
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+async def handle_connection(reader, writer, delay):
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            path = request_line.split(b" ")[1].decode()
+            content_length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b""):
+                    break
+                name, _, value = line.decode().partition(":")
+                if name.lower() == "content-length":
+                    content_length = int(value.strip())
+            if content_length:
+                await reader.readexactly(content_length)
+
+            if path.startswith("/audio_query"):
+                body = json.dumps({"accent_phrases": []}).encode()
+                content_type = b"application/json"
+            else:
+                # 合成処理の時間を模擬
+                await asyncio.sleep(delay)
+                body = b"RIFF" + b"\x00" * 1024
+                content_type = b"audio/wav"
+
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: " + content_type +
+                b"\r\nContent-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body
+            )
+            await writer.drain()
+    except (ConnectionResetError, asyncio.IncompleteReadError):
+        pass
+    except asyncio.CancelledError:
+        # 終了時のキャンセルは接続を閉じるだけにする
+        # （start_server はキャンセルされた処理タスクの結果を取り出そうとしてトレースバックを出すため）
+        pass
+    finally:
+        writer.close()
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=10)
+    parser.add_argument("--delay", type=float, default=0.5)
+    args = parser.parse_args()
+
+    # 終了時にキープアライブ中の接続を閉じるため、スタブサーバーの処理タスクを記録する
+    handlers = set()
+
+    async def handler(reader, writer):
+        task = asyncio.current_task()
+        handlers.add(task)
+        try:
+            await handle_connection(reader, writer, args.delay)
+        finally:
+            handlers.discard(task)
+
+    server = await asyncio.start_server(handler, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    # voice ルーターはインポート時にURLを読み込むため先に設定する
+    os.environ["VOICEVOX_URLS"] = f"http://127.0.0.1:{port}"
+
+    import httpx
+    from app.main import app
+    from app.services import http_clients
+
+    filenames = []
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver", timeout=60) as client:
+            async def one():
+                # キャッシュに当たらないよう毎回異なるテキストを使う
+                response = await client.post("/voice/synthesize", data={
+                    "text": f"ロードテスト {uuid.uuid4().hex}",
+                    "agent_id": "load-test",
+                    "voice_type": "voicevox",
+                    "speaker_id": "1",
+                })
+                response.raise_for_status()
+                return response.json()["filename"]
+
+            start = time.perf_counter()
+            filenames = await asyncio.gather(*(one() for _ in range(args.requests)))
+            elapsed = time.perf_counter() - start
+    finally:
+        for filename in filenames:
+            try:
+                os.remove(os.path.join("audio_files", filename))
+            except OSError:
+                pass
+        await http_clients.close_clients()
+        server.close()
+        # 残っている接続の処理を止め、終了を待ってからループを閉じる（未回収の CancelledError を出さない）
+        for task in list(handlers):
+            task.cancel()
+        await asyncio.gather(*handlers, return_exceptions=True)
+        await server.wait_closed()
+
+    serial = args.requests * args.delay
+    print(f"{args.requests}件の同時リクエスト: {elapsed:.2f}秒（直列なら {serial:.2f}秒）")
+    # 直列の半分未満で終わっていれば処理が重なっている
+    if elapsed >= serial / 2:
+        print("NG: リクエストが直列化されています")
+        sys.exit(1)
+    print("OK: リクエストは並行して処理されています")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -36,6 +36,61 @@ def migrate_database():
     else:
         print("voice_speaker_id column already exists")
     
+    # 会話履歴取得用の複合インデックスを作成
+    cursor.execute("PRAGMA index_list(conversations)")
+    index_names = [index[1] for index in cursor.fetchall()]
+    if 'ix_conversations_user_agent_created' not in index_names:
+        print("Adding ix_conversations_user_agent_created index")
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS ix_conversations_user_agent_created "
+            "ON conversations (user_id, agent_id, created_at DESC)"
+        )
+        cursor.execute("ANALYZE conversations")
+    else:
+        print("ix_conversations_user_agent_created index already exists")
+    
+    # 会話要約テーブルを作成
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='conversation_summaries'")
+    if cursor.fetchone() is None:
+        print("Adding conversation_summaries table")
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS conversation_summaries ("
+            "id INTEGER PRIMARY KEY, "
+            "user_id VARCHAR REFERENCES users (user_id), "
+            "agent_id VARCHAR REFERENCES agents (agent_id), "
+            "summary TEXT NOT NULL DEFAULT '', "
+            "covered_until_id INTEGER NOT NULL DEFAULT 0, "
+            "updated_at DATETIME DEFAULT (CURRENT_TIMESTAMP), "
+            "CONSTRAINT uq_conversation_summaries_user_agent UNIQUE (user_id, agent_id))"
+        )
+        cursor.execute("CREATE INDEX IF NOT EXISTS ix_conversation_summaries_id ON conversation_summaries (id)")
+    else:
+        print("conversation_summaries table already exists")
+    
+    # 非同期チャットジョブのテーブルを作成
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='chat_jobs'")
+    if cursor.fetchone() is None:
+        print("Adding chat_jobs table")
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS chat_jobs ("
+            "job_id VARCHAR PRIMARY KEY, "
+            "user_id VARCHAR, "
+            "agent_id VARCHAR REFERENCES agents (agent_id), "
+            "user_message TEXT NOT NULL, "
+            "status VARCHAR NOT NULL DEFAULT 'queued', "
+            "response_text TEXT, "
+            "audio_path VARCHAR, "
+            "audio_segments TEXT, "
+            "error TEXT, "
+            "created_at DATETIME DEFAULT (CURRENT_TIMESTAMP), "
+            "updated_at DATETIME DEFAULT (CURRENT_TIMESTAMP))"
+        )
+        cursor.execute("CREATE INDEX IF NOT EXISTS ix_chat_jobs_job_id ON chat_jobs (job_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS ix_chat_jobs_user_id ON chat_jobs (user_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS ix_chat_jobs_status ON chat_jobs (status)")
+    else:
+        print("chat_jobs table already exists")
+    
     # 変更を保存
     conn.commit()
     
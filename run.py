@@ -14,5 +14,7 @@ if __name__ == "__main__":
         host=host, 
         port=port, 
         reload=True,
-        timeout_keep_alive=300,  # キープアライブタイムアウトを5分に設定
+        # アイドル接続のキープアライブタイムアウト（ロングポーリングの待ち時間 CHAT_JOB_MAX_WAIT より少し長くする）
+        # 長い処理は /chat/{agent_id}/jobs のジョブAPIを使う
+        timeout_keep_alive=int(os.getenv("APP_KEEP_ALIVE_TIMEOUT", "30")),
     )
\ No newline at end of file
@@ -0,0 +1,13 @@
+import os
+import sys
+import tempfile
+
+# リポジトリのルートから app パッケージを読み込めるようにする
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# テストではリポジトリの app.db を使わず、一時ディレクトリのDBを使う（app を読み込む前に設定する）
+_db_dir = tempfile.mkdtemp(prefix="app-test-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_db_dir, 'test.db')}"
+os.environ["ASYNC_DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(_db_dir, 'test.db')}"
+# リクエストごとのDB接続リークを検出し、リークがあればテストを失敗させる
+os.environ["DB_LEAK_CHECK"] = "strict"
@@ -0,0 +1,28 @@
+"""音声ファイルのライフサイクル管理（所有者の保存）のテスト"""
+import asyncio
+
+import pytest
+
+pytest.importorskip("aiofiles")
+
+from app.services.audio_lifecycle import AudioLifecycleManager
+
+def test_custom_voice_cache_owner_survives_restart(tmp_path):
+    directory = tmp_path / "audio"
+    directory.mkdir()
+    owners_path = str(tmp_path / "owners.json")
+    custom = directory / ("tts_" + "a" * 64 + ".wav")
+    shared = directory / ("tts_" + "b" * 64 + ".wav")
+    custom.write_bytes(b"custom")
+    shared.write_bytes(b"shared")
+
+    manager = AudioLifecycleManager(directory=str(directory), owners_path=owners_path)
+    manager.register(str(custom), owner="agent-1")
+    manager.register(str(shared))
+    asyncio.run(manager.save_owners())
+
+    # 再起動後もディレクトリの走査だけでカスタム音声の所有者がわかる
+    restarted = AudioLifecycleManager(directory=str(directory), owners_path=owners_path)
+    restarted.load_index()
+    assert restarted.files_for_agent("agent-1") == [custom.name]
+    assert restarted.total_bytes("agent-1") == len(b"custom")
@@ -0,0 +1,42 @@
+"""書き込み中のWAVの配信（iter_growing_wav）のテスト"""
+import asyncio
+import struct
+
+import pytest
+
+pytest.importorskip("aiofiles")
+pytest.importorskip("fastapi")
+
+from app.services.audio_stream import iter_growing_wav
+from app.services.audio_writes import AudioWriteRegistry
+from app.services.wav_utils import build_wav_header, build_streaming_wav_header
+
+# 16bit モノラル 24kHz の fmt チャンク
+FMT = struct.pack("<HHIIHH", 1, 1, 24000, 48000, 2, 16)
+
+async def slow_chunks(content, chunk_size, delay):
+    for offset in range(0, len(content), chunk_size):
+        await asyncio.sleep(delay)
+        yield content[offset:offset + chunk_size]
+
+def test_reads_wav_while_it_is_being_written(tmp_path):
+    pcm = bytes(range(256)) * 64
+    content = build_wav_header(FMT, len(pcm)) + pcm
+    path = tmp_path / "tts_growing.wav"
+    registry = AudioWriteRegistry()
+
+    async def run():
+        writer = asyncio.create_task(registry.write(str(path), slow_chunks(content, 1000, 0.01)))
+        write = await registry.wait_started(path.name)
+        # 最初のチャンクが書き込まれてから読み始める（書き込みの途中から追いかける）
+        await write.wait_for_data(0, 5)
+        assert not write.finished
+        received = b"".join([chunk async for chunk in iter_growing_wav(write, str(path))])
+        assert await writer == len(content)
+        return received
+
+    received = asyncio.run(run())
+    header = build_streaming_wav_header(FMT)
+    assert received[:len(header)] == header
+    assert received[len(header):] == pcm
+    assert path.read_bytes() == content
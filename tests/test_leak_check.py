@@ -0,0 +1,127 @@
+"""DB接続リークの検出（ConnectionLeakMiddleware）のテスト"""
+import asyncio
+
+import pytest
+
+pytest.importorskip("aiosqlite")
+pytest.importorskip("fastapi")
+httpx = pytest.importorskip("httpx")
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.db.leak_check import ConnectionLeakError, ConnectionLeakMiddleware, ConnectionTracker
+
+def make_engine(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'leak.db'}")
+    tracker = ConnectionTracker()
+    tracker.install(engine)
+    return engine, tracker
+
+async def respond(send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+async def call(app):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+        return await client.get("/")
+
+def test_leaked_connection_fails_the_request(tmp_path):
+    engine, tracker = make_engine(tmp_path)
+    leaked = []
+
+    async def leaking_app(scope, receive, send):
+        connection = await engine.connect()
+        await connection.execute(text("SELECT 1"))
+        leaked.append(connection)
+        await respond(send)
+
+    async def run():
+        try:
+            with pytest.raises(ConnectionLeakError):
+                await call(ConnectionLeakMiddleware(leaking_app, mode="strict", tracker=tracker))
+        finally:
+            for connection in leaked:
+                await connection.close()
+            await engine.dispose()
+
+    asyncio.run(run())
+
+def test_background_connections_are_not_counted(tmp_path):
+    engine, tracker = make_engine(tmp_path)
+    request_started = asyncio.Event()
+    held = asyncio.Event()
+    release = asyncio.Event()
+
+    async def correct_app(scope, receive, send):
+        request_started.set()
+        async with engine.connect() as connection:
+            await connection.execute(text("SELECT 1"))
+        # リクエストの処理中にバックグラウンドの処理が接続を借りる
+        await held.wait()
+        await respond(send)
+
+    async def background():
+        # リクエストの外で始まった処理（ジョブのワーカーなど）が、リクエストの終了後も接続を借りたままにする
+        await request_started.wait()
+        async with engine.connect() as connection:
+            await connection.execute(text("SELECT 1"))
+            held.set()
+            await release.wait()
+
+    async def run():
+        worker = asyncio.create_task(background())
+        try:
+            response = await call(ConnectionLeakMiddleware(correct_app, mode="strict", tracker=tracker))
+            assert response.status_code == 200
+        finally:
+            release.set()
+            await worker
+            await engine.dispose()
+
+    asyncio.run(run())
+
+def test_deferred_chat_request_passes_strict_check(monkeypatch):
+    from app.main import app
+    from app.db.database import AsyncSessionLocal
+    from app.models import models
+    from app.services import api_service
+    from app.services.chat_jobs import chat_jobs
+    from app.services.conversation_writer import conversation_writer
+
+    async def generate_chat_text(messages):
+        return "こんにちは。"
+
+    async def synthesize_text_streaming(text, voice_settings, on_audio_start):
+        return None
+
+    monkeypatch.setattr(api_service, "generate_chat_text", generate_chat_text)
+    monkeypatch.setattr(api_service, "synthesize_text_streaming", synthesize_text_streaming)
+
+    async def run():
+        async with AsyncSessionLocal() as db:
+            db.add(models.Agent(agent_id="leak-check-agent", name="テスト", tone="丁寧", personality1="明るい"))
+            await db.commit()
+        conversation_writer.start()
+        await chat_jobs.start()
+        try:
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+                response = await client.post(
+                    "/chat/leak-check-agent",
+                    params={"response_mode": "deferred"},
+                    json={"user_message": "やあ", "user_id": "leak-check-user"},
+                )
+            assert response.status_code == 200
+            body = response.json()
+            assert body["audio_status"] == "pending"
+            job = await chat_jobs.get(body["audio_job_id"])
+            while not job.finished:
+                await chat_jobs.wait(job, len(job.events), 5)
+            assert job.status == "done"
+        finally:
+            await chat_jobs.stop()
+            await conversation_writer.stop()
+
+    asyncio.run(run())